@@ -1,16 +1,15 @@
-from google import genai
-from google.genai.types import EmbedContentConfig
 from domain.post import Post
-from typing import List
+from typing import Dict, List
 import re
 import numpy as np
 from numpy import float64
 from numpy.typing import NDArray
-import joblib
+from anchor_store import AnchorStore, convert_pickles, LEGACY_ASSET
+from chunking import Chunk, DocumentEmbedding, CHUNK_THRESHOLD, pool, split_chunks
+from embeddings import EmbeddingProvider, GeminiEmbeddings, LocalEmbeddings, LocalPrescorer, make_provider, PRESCORE_THRESHOLD
+from limiter import Priority
 from strategy import Signal
 
-from env import GEMINI_API_KEY, GEMINI_EMBEDDING_MODEL, GEMINI_EMBEDDING_LENGTH
-
 def cosine_similarity(v1, v2):
     """Calculate cosine similarity between two vectors."""
     # Ensure vectors are numpy arrays and not None
@@ -32,49 +31,92 @@ def cosine_similarity(v1, v2):
     return dot_product / (norm_v1 * norm_v2)
 
 class GeminiAnalyst:
-    def __init__(self):
-        self.client = genai.Client(api_key=GEMINI_API_KEY)
-        self.model = GEMINI_EMBEDDING_MODEL
-        try:
-            self.buy_anchors = joblib.load("buy_anchors.pkl")
-            self.sell_anchors = joblib.load("sell_anchors.pkl")
-            self.noise_anchors = joblib.load("noise_anchors.pkl")
-        except FileNotFoundError:
-            print("Anchor files not found. Please run anchors.py to create them.")
-            self.buy_anchors, self.sell_anchors, self.noise_anchors = [], [], []
-
-    async def get_embedding(self, text: str) -> NDArray[float64] | None:
-        clean_text = self._clean_for_embedding(text)
-
-        try:
-            response = await self.client.aio.models.embed_content(
-                model=self.model,
-                contents=clean_text,
-                config=EmbedContentConfig(
-                    output_dimensionality=GEMINI_EMBEDDING_LENGTH,
-                    task_type="CLASSIFICATION"
-                )
-            )
-            if response.embeddings is None: return None
-            embedding_values_np = np.array(response.embeddings[0].values)
-            normed_embedding = embedding_values_np / np.linalg.norm(embedding_values_np)
-            return normed_embedding
-        except Exception as e:
-            print(f"Gemini Error: {e}")
+    def __init__(self, provider: EmbeddingProvider | None = None):
+        """
+        :param provider: Where embeddings come from, the one named by EMBEDDING_PROVIDER if not given.
+        """
+        self.provider = provider or make_provider()
+        # Hot-reloaded, run `anchor_store.watch()` to pick up newly published sets
+        self.anchor_store = AnchorStore(dimension=self.provider.dimension)
+        if self.anchor_store.current is None:
+            print("No anchor set found. Please run anchors.py to create one, or anchors.py --from-pickles to import the old anchor pickles.")
+        elif self.anchor_store.current.model != self.provider.model:
+            print(f"Anchor set {self.anchor_store.current.version} was embedded with {self.anchor_store.current.model}, posts will be with {self.provider.model}. Rebuild it with anchors.py")
+
+        # Only worth it in front of a provider that costs a network round trip
+        self.prescorer = None
+        if PRESCORE_THRESHOLD is not None and not isinstance(self.provider, LocalEmbeddings):
+            self.prescorer = LocalPrescorer(self.anchor_store, PRESCORE_THRESHOLD)
+
+    def require_anchors(self):
+        """
+        For the live pipeline, which must never classify every post as HOLD for
+        want of anchors. A deployment with only the old anchor pickles gets
+        them imported once, anything else without an anchor set raises RuntimeError.
+        """
+        # The old pickles hold Gemini embeddings
+        if self.anchor_store.current is None and isinstance(self.provider, GeminiEmbeddings) and convert_pickles(self.provider.model) is not None:
+            self.anchor_store.reload()
+        if self.anchor_store.current is None:
+            raise RuntimeError("No anchor set found, every post would classify as HOLD. Run anchors.py to create one, or anchors.py --from-pickles to import the old anchor pickles")
+
+    async def get_embedding(self, text: str, priority: Priority = Priority.HIGH) -> NDArray[float64] | None:
+        document = await self.embed_document(text, priority)
+        return document.embedding if document is not None else None
+
+    async def embed_document(self, text: str, priority: Priority = Priority.HIGH) -> DocumentEmbedding | None:
+        """
+        Embeds `text` whole, or if it's longer than CHUNK_THRESHOLD as
+        overlapping windows in one request, pooled into one vector (see
+        chunking.py). None if it couldn't be embedded.
+        """
+        text = self._clean_for_embedding(text)
+        if CHUNK_THRESHOLD is None or len(text) <= CHUNK_THRESHOLD:
+            embedding = (await self.provider.embed([text], priority))[0]
+            return DocumentEmbedding(embedding, []) if embedding is not None else None
+
+        windows = split_chunks(text)
+        embeddings = await self.provider.embed([text[start:end] for start, end in windows], priority)
+        chunks = [Chunk(start, end, text[start:end], embedding) for (start, end), embedding in zip(windows, embeddings) if embedding is not None]
+        if not chunks:
             return None
+        return DocumentEmbedding(pool(np.stack([chunk.embedding for chunk in chunks])), chunks)
+
+    async def get_embeddings(self, texts: List[str], priority: Priority = Priority.HIGH) -> List[NDArray[float64] | None]:
+        """
+        Embeds many texts at once, in as few requests as the provider allows.
+        Raises `Shed` or `Unavailable` from limiter.py if the provider can't now.
+        """
+        return await self.provider.embed([self._clean_for_embedding(text) for text in texts], priority)
+
+    def worth_embedding(self, text: str) -> bool:
+        """Whether the local pre-score, if enabled, thinks `text` is worth embedding."""
+        return self.prescorer is None or self.prescorer.worth_embedding(self._clean_for_embedding(text))
 
-    def get_signal_from_embedding(self, embedding: NDArray[float64]) -> Signal:
+    def get_signals_from_embedding(self, embedding: NDArray[float64]) -> Dict[str, Signal]:
         """
-        Classifies an embedding into a BUY, SELL, or HOLD signal
+        Classifies an embedding into a BUY, SELL, or HOLD signal for every
+        asset in the anchor set, scoring all assets' anchors at once.
+        """
+        # Taken once, a swap mid-classification must not mix two anchor sets
+        anchors = self.anchor_store.current
+        if embedding is None or anchors is None or not len(anchors):
+            return {}
+
+        return {asset: self._classify(max_sims) for asset, max_sims in anchors.asset_similarities(embedding).items()}
+
+    def get_signal_from_embedding(self, embedding: NDArray[float64], asset: str = LEGACY_ASSET) -> Signal:
+        """
+        Classifies an embedding into a BUY, SELL, or HOLD signal for one asset
         by comparing it to the pre-loaded anchor embeddings.
         """
-        if embedding is None or not any([len(self.buy_anchors), len(self.sell_anchors), len(self.noise_anchors)]):
-            return Signal.HOLD
+        return self.get_signals_from_embedding(embedding).get(asset, Signal.HOLD)
 
-        # Calculate max similarity to each anchor category
-        max_buy_sim = max([cosine_similarity(embedding, anchor) for anchor in self.buy_anchors], default=0)
-        max_sell_sim = max([cosine_similarity(embedding, anchor) for anchor in self.sell_anchors], default=0)
-        max_noise_sim = max([cosine_similarity(embedding, anchor) for anchor in self.noise_anchors], default=0)
+    def _classify(self, max_sims: Dict[str, float]) -> Signal:
+        # Max similarity to each anchor category
+        max_buy_sim = max_sims.get("buy", 0)
+        max_sell_sim = max_sims.get("sell", 0)
+        max_noise_sim = max_sims.get("noise", 0)
 
         # Basic classifier: which anchor category is the post most similar to?
         similarities = {
@@ -83,8 +125,8 @@ class GeminiAnalyst:
             Signal.HOLD: max_noise_sim
         }
 
-        # A minimum confidence threshold to avoid classifying pure noise
-        confidence_threshold = 0.4 
+        # A minimum confidence threshold to avoid classifying pure noise, on the provider's scale
+        confidence_threshold = self.provider.confidence_threshold
         
         # Find the signal with the highest similarity
         best_signal = max(similarities, key=similarities.get)
@@ -1,53 +1,242 @@
 import aiohttp
 import asyncio
+import contextlib
+import random
 import re
+import time
+from typing import List
 
+from db import Database, OutboxAlertRow
 from domain.post import Post
-from strategy import Signal
+from strategy import Signal, AssetRules
+from metrics import metrics
 from env import WEBHOOK_URL
 
+# Discord rejects messages longer than this
+MAX_MESSAGE_LENGTH = 2000
+
+# Alerts queued within this many seconds of each other go out as one message
+COALESCE_DELAY = 2
+MAX_BATCH = 10
+
+# How long the dispatcher sleeps when the outbox is empty, new alerts wake it early
+POLL_INTERVAL = 60
+
+RETRY_MIN_DELAY = 2
+RETRY_MAX_DELAY = 5 * 60
+# Failed deliveries before an alert is given up on, about 4 hours at the max delay
+MAX_ATTEMPTS = 50
+
+SEPARATOR = "======================================================"
+
 class AlertSender:
-    def __init__(self) -> None:
+    def __init__(self, db: Database, webhook_url: str = WEBHOOK_URL) -> None:
         """
-        Initializes the AlertSender.
+        Initializes the AlertSender. Alerts are written to the outbox in the
+        database and delivered by `run`, so they survive restarts.
+
+        :param db: The database holding the outbox.
+        :param webhook_url: The webhook to deliver to.
         """
-        self.session = aiohttp.ClientSession()
+        self.db = db
+        self.webhook_url = webhook_url
+        self.wakeup = asyncio.Event()
+        # When the webhook's rate limit bucket allows the next request
+        self.blocked_until = 0.0
+
+        self.post_to_alert = metrics.histogram("post_to_alert_seconds", "From the post behind an alert arriving to the alert being queued")
+        self.outbox_wait = metrics.histogram("alert_outbox_wait_seconds", "From an alert being queued to the webhook accepting it")
+        metrics.register_gauge("alert_outbox", "Alerts waiting for delivery", lambda: {(): self.db.count_pending_alerts()})
 
-    async def send_decision_alert(self, decision: Signal, post: Post):
+    async def send_decision_alert(self, decision: Signal, post: Post, asset: AssetRules | None = None):
         """
-        Sends an alert to the webhook with the trading decision and source post.
+        Queues an alert with the trading decision and source post. Returns
+        as soon as it's in the outbox, delivery happens in the background.
 
         :param decision: The BUY or SELL signal from the Strategy module.
         :param post: The Post object that was the source of the latest signal.
+        :param asset: The asset the decision is for.
         """
-        
-        # Function to wrap URLs in angle brackets to prevent Discord auto-embedding
-        def suppress_urls_in_content(text: str) -> str:
-            # Regex to find URLs
-            url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-            # Wrap found URLs in < >
-            return re.sub(url_pattern, r'<\g<0>>', text)
+        sanitized_content = suppress_urls(post.content[:1000])
+        title = f"{decision.name} {asset.name} ({asset.ticker})" if asset else decision.name
 
-        sanitized_content = suppress_urls_in_content(post.content[:1000])
+        self.db.enqueue_alert(title, post.url, sanitized_content)
+        self.wakeup.set()
+        self.post_to_alert.record(time.time() - post.received)
+        print(f"Queued alert for decision: {title}")
 
-        # Formatting for the alert message
-        content = (
-            f"======================================================\n"
-            f"**TRADING SIGNAL: {decision.name}**\n"
-            f"======================================================\n"
-            f">>> **Source**: <{post.url}>\n"
-            f"**Content**: {sanitized_content}"
-        )
+    async def send_event_alert(self, event: int, title: str, url: str, body: str):
+        """
+        Queues an event's alert. The first one is posted, later ones edit that
+        message in place, and an update still waiting is replaced by the newer one.
+
+        :param event: The id of the event.
+        :param title: The headline of the alert.
+        :param url: The latest source.
+        :param body: The formatted alert body.
+        """
+        self.db.enqueue_alert(title, url, body, event)
+        self.wakeup.set()
+        print(f"Queued alert for event {event}: {title}")
+
+    async def run(self):
+        """
+        Delivers the outbox forever. The session is created here, inside the
+        running loop, and shared by every request.
+        """
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+            while True:
+                try:
+                    self.wakeup.clear()
+                    delay = self._seconds_until_due()
+                    if delay > 0:
+                        with contextlib.suppress(TimeoutError):
+                            await asyncio.wait_for(self.wakeup.wait(), delay)
+                        continue
+
+                    # Give the rest of a burst a moment to arrive so it's sent as one message
+                    await asyncio.sleep(COALESCE_DELAY)
+                    await self._deliver_batch(session)
+                except Exception as e:
+                    print(f"[Alert Error]: {e}")
+                    await asyncio.sleep(RETRY_MIN_DELAY)
+
+    def _seconds_until_due(self) -> float:
+        now = time.time()
+        next_attempt = self.db.get_next_alert_attempt()
+        due_in = POLL_INTERVAL if next_attempt is None else next_attempt - now
+        return max(due_in, self.blocked_until - now)
+
+    async def _deliver_batch(self, session: aiohttp.ClientSession):
+        alerts = self.db.get_due_alerts(int(time.time()), MAX_BATCH)
+        if not alerts:
+            return
+
+        # Event alerts are edited later so each needs a message of its own
+        if alerts[0].event is not None:
+            alerts = alerts[:1]
+            content = format_event_alert(alerts[0])
+        else:
+            alerts, content = format_alerts([alert for alert in alerts if alert.event is None])
+        ids = [alert.id for alert in alerts]
+
+        event = alerts[0].event
+        message_id = self.db.get_event_alert_message(event) if event is not None else None
+        if message_id is not None:
+            request = session.patch(f"{self.webhook_url}/messages/{message_id}", data={"content": content})
+        elif event is not None:
+            # wait=true makes the webhook return the message, whose id later edits need
+            request = session.post(self.webhook_url, params={"wait": "true"}, data={"content": content})
+        else:
+            request = session.post(self.webhook_url, data={"content": content})
 
         try:
-            await self.session.post(
-                WEBHOOK_URL,
-                data={"content": content}
-            )
-            print(f"Sent alert for decision: {decision.name}")
-        except Exception as e:
+            async with request as response, metrics.time("alert"):
+                self._update_rate_limit(response)
+
+                if response.status == 429:
+                    # Nothing was delivered, the alerts are retried once the bucket resets
+                    retry_after = await self._retry_after(response)
+                    self.blocked_until = max(self.blocked_until, time.time() + retry_after)
+                    print(f"Webhook rate limited, retrying in {retry_after:.1f}s")
+                    return
+
+                if response.status >= 500:
+                    raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status)
+
+                if response.status == 404 and message_id is not None:
+                    # The message was deleted, post the event afresh
+                    self.db.set_event_alert_message(event, None)
+                    return
+
+                if response.status >= 400:
+                    # The webhook will never accept these, retrying would only block the outbox
+                    print(f"Webhook rejected {len(ids)} alert(s) with {response.status}: {await response.text()}")
+                    self.db.delete_alerts(ids)
+                    return
+
+                if event is not None and message_id is None:
+                    self.db.set_event_alert_message(event, str((await response.json())["id"]))
+
+            self.db.delete_alerts(ids)
+            now = time.time()
+            for alert in alerts:
+                self.outbox_wait.record(now - alert.created)
+            metrics.inc("alerts_sent", "Alerts accepted by the webhook", amount=len(ids))
+            print(f"Sent {len(ids)} alert(s)")
+        except (aiohttp.ClientError, TimeoutError) as e:
             print(f"Error sending alert: {e}")
+            metrics.inc("alert_failures", "Webhook requests that failed and were retried")
+            self._defer(alerts)
+
+    def _defer(self, alerts: List[OutboxAlertRow]):
+        expired = [alert.id for alert in alerts if alert.attempts + 1 >= MAX_ATTEMPTS]
+        if expired:
+            print(f"Giving up on {len(expired)} alert(s) after {MAX_ATTEMPTS} attempts")
+            self.db.delete_alerts(expired)
+
+        retry = [alert.id for alert in alerts if alert.id not in expired]
+        if retry:
+            attempts = max(alert.attempts for alert in alerts)
+            delay = random.uniform(RETRY_MIN_DELAY, min(RETRY_MIN_DELAY * 2 ** attempts, RETRY_MAX_DELAY))
+            self.db.defer_alerts(retry, int(time.time() + delay))
+
+    def _update_rate_limit(self, response: aiohttp.ClientResponse):
+        """Waits out the bucket before it's exhausted instead of hitting a 429."""
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset_after = response.headers.get("X-RateLimit-Reset-After")
+        if remaining == "0" and reset_after is not None:
+            self.blocked_until = time.time() + float(reset_after)
+
+    async def _retry_after(self, response: aiohttp.ClientResponse) -> float:
+        if "Retry-After" in response.headers:
+            return float(response.headers["Retry-After"])
+        with contextlib.suppress(Exception):
+            return float((await response.json())["retry_after"])
+        return RETRY_MIN_DELAY
+
+
+def suppress_urls(text: str) -> str:
+    """Wraps URLs in angle brackets to prevent Discord auto-embedding."""
+    # Regex to find URLs
+    url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+    # Wrap found URLs in < >
+    return re.sub(url_pattern, r'<\g<0>>', text)
+
+def format_event_alert(alert: OutboxAlertRow) -> str:
+    content = (
+        f"{SEPARATOR}\n"
+        f"**{alert.title}**\n"
+        f"{SEPARATOR}\n"
+        f"{alert.content}"
+    )
+    return content[:MAX_MESSAGE_LENGTH]
+
+def format_alerts(alerts: List[OutboxAlertRow]) -> tuple[List[OutboxAlertRow], str]:
+    """
+    Formats alerts into one message. A single alert gets the full format,
+    several are listed one per line, as many as fit in a message.
+    Returns the alerts that made it into the message and its content.
+    """
+    if len(alerts) == 1:
+        alert = alerts[0]
+        content = (
+            f"{SEPARATOR}\n"
+            f"**TRADING SIGNAL: {alert.title}**\n"
+            f"{SEPARATOR}\n"
+            f">>> **Source**: <{alert.url}>\n"
+            f"**Content**: {alert.content}"
+        )
+        return alerts, content[:MAX_MESSAGE_LENGTH]
+
+    lines = [SEPARATOR, f"**{len(alerts)} TRADING SIGNALS**", SEPARATOR]
+    included = []
+    for alert in alerts:
+        line = f"**{alert.title}** <{alert.url}>"
+        if len("\n".join(lines + [line])) > MAX_MESSAGE_LENGTH and included:
+            break
+        lines.append(line)
+        included.append(alert)
 
-    async def close(self):
-        """Closes the aiohttp client session."""
-        await self.session.close()
\ No newline at end of file
+    lines[1] = f"**{len(included)} TRADING SIGNALS**"
+    return included, "\n".join(lines)[:MAX_MESSAGE_LENGTH]
\ No newline at end of file
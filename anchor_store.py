@@ -0,0 +1,238 @@
+"""
+Versioned anchor embeddings on disk.
+
+    anchor_sets/
+        CURRENT                     name of the published version
+        20261019-120000/
+            anchors.npy             float32 matrix, one unit-length anchor per row
+            manifest.json           labels, assets, source texts, model and dimension
+
+Every asset's anchors are stacked into the one matrix. Each row has a label
+("buy", "sell" or "noise") and the ticker it belongs to, or null if it's
+shared by every asset, as the noise anchors are.
+
+A version directory is never modified once written. Publishing a version
+only replaces CURRENT, so readers always see a complete set.
+"""
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import asyncio
+import os
+import time
+import orjson
+import numpy as np
+from numpy.typing import NDArray
+
+ANCHOR_STORE_DIR = "anchor_sets"
+CURRENT_FILE = "CURRENT"
+MATRIX_FILE = "anchors.npy"
+MANIFEST_FILE = "manifest.json"
+
+# How often a running process checks for a newly published version
+ANCHOR_POLL_INTERVAL = 10
+
+LEGACY_PICKLES = {"buy": "buy_anchors.pkl", "sell": "sell_anchors.pkl", "noise": "noise_anchors.pkl"}
+
+# Sets written before anchors were per asset only had silver's
+LEGACY_ASSET = "SI=F"
+
+
+@dataclass
+class AnchorSet:
+    version: str
+    matrix: NDArray[np.float32]
+    labels: NDArray
+    assets: List[str | None]
+    texts: List[str]
+    model: str
+    dimension: int
+    groups: List[tuple[str | None, str]] = field(init=False)
+    group_ids: NDArray[np.intp] = field(init=False)
+
+    def __post_init__(self):
+        rows = list(zip(self.assets, self.labels.tolist()))
+        self.groups = sorted(set(rows), key=lambda group: (group[0] or "", group[1]))
+        index = {group: i for i, group in enumerate(self.groups)}
+        self.group_ids = np.array([index[group] for group in rows], dtype=np.intp)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    @property
+    def asset_names(self) -> List[str]:
+        return sorted({asset for asset, _ in self.groups if asset is not None})
+
+    def category(self, label: str, asset: str = LEGACY_ASSET) -> NDArray[np.float32]:
+        """The anchors of one label that apply to `asset`, its own and the shared ones, as a matrix."""
+        mask = (self.labels == label) & np.array([a is None or a == asset for a in self.assets], dtype=bool)
+        return self.matrix[mask]
+
+    def asset_similarities(self, embedding: NDArray) -> Dict[str, Dict[str, float]]:
+        """
+        Max cosine similarity of `embedding` to each label's anchors, for every
+        asset, from one matrix-vector product over the stacked anchors.
+        """
+        embedding = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(embedding)
+        if norm == 0:
+            return {asset: {} for asset in self.asset_names}
+
+        group_max = np.full(len(self.groups), -np.inf, dtype=np.float32)
+        np.maximum.at(group_max, self.group_ids, self.matrix @ (embedding / norm))
+
+        shared = {label: float(sim) for (asset, label), sim in zip(self.groups, group_max) if asset is None}
+        similarities = {asset: dict(shared) for asset in self.asset_names}
+        for (asset, label), sim in zip(self.groups, group_max):
+            if asset is not None:
+                similarities[asset][label] = max(float(sim), shared.get(label, -np.inf))
+        return similarities
+
+
+def load_anchor_set(path: str) -> AnchorSet:
+    """Opens one version directory, the matrix is memory-mapped rather than read."""
+    with open(os.path.join(path, MANIFEST_FILE), "rb") as f:
+        manifest = orjson.loads(f.read())
+
+    matrix = np.load(os.path.join(path, MATRIX_FILE), mmap_mode="r")
+    if matrix.dtype != np.float32 or matrix.shape != (len(manifest["labels"]), manifest["dimension"]):
+        raise ValueError(f"Anchor matrix {matrix.dtype}{matrix.shape} does not match the manifest in {path}")
+
+    labels = manifest["labels"]
+    assets = manifest.get("assets") or [None if label == "noise" else LEGACY_ASSET for label in labels]
+
+    return AnchorSet(
+        os.path.basename(os.path.normpath(path)),
+        matrix,
+        np.array(labels),
+        assets,
+        manifest["texts"],
+        manifest["model"],
+        manifest["dimension"],
+    )
+
+def open_anchor_set(path: str = ANCHOR_STORE_DIR) -> AnchorSet:
+    """Loads `path` if it is a version directory, otherwise the published version of the store at `path`."""
+    if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        return load_anchor_set(path)
+
+    version = current_version(path)
+    if version is None:
+        raise FileNotFoundError(f"No anchor set has been published in {path}")
+    return load_anchor_set(os.path.join(path, version))
+
+def current_version(root: str = ANCHOR_STORE_DIR) -> str | None:
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_anchor_set(labels: List[str], assets: List[str | None], texts: List[str], embeddings: List[NDArray], model: str, root: str = ANCHOR_STORE_DIR, publish: bool = True) -> str:
+    """
+    Writes a new version and, unless `publish` is False, makes it current.
+    Returns the version name.
+    """
+    if not (len(labels) == len(assets) == len(texts) == len(embeddings)):
+        raise ValueError("labels, assets, texts and embeddings must have the same length")
+
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+    version = time.strftime("%Y%m%d-%H%M%S")
+    while os.path.exists(os.path.join(root, version)):
+        version += "a"
+
+    # Written under a temporary name so a half-written version is never visible
+    staging = os.path.join(root, f".{version}.tmp")
+    os.makedirs(staging)
+    np.save(os.path.join(staging, MATRIX_FILE), matrix)
+    manifest = {"labels": list(labels), "assets": list(assets), "texts": list(texts), "model": model, "dimension": int(matrix.shape[1])}
+    with open(os.path.join(staging, MANIFEST_FILE), "wb") as f:
+        f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+    os.rename(staging, os.path.join(root, version))
+
+    if publish:
+        publish_version(version, root)
+    return version
+
+def publish_version(version: str, root: str = ANCHOR_STORE_DIR):
+    """Atomically points CURRENT at `version`."""
+    load_anchor_set(os.path.join(root, version))
+
+    pointer = os.path.join(root, CURRENT_FILE)
+    with open(pointer + ".tmp", "w") as f:
+        f.write(version)
+    os.replace(pointer + ".tmp", pointer)
+
+def convert_pickles(model: str, directory: str = ".", root: str = ANCHOR_STORE_DIR) -> str | None:
+    """
+    One-off import of the old buy/sell/noise_anchors.pkl files. Source texts
+    weren't stored alongside them, so they're taken from `anchors.py`, which
+    generated them in the same order.
+    Returns the new version, or None if there's nothing to convert.
+    """
+    import joblib
+    import anchors
+
+    paths = {label: os.path.join(directory, name) for label, name in LEGACY_PICKLES.items()}
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+
+    texts = {**anchors.ASSET_ANCHORS[LEGACY_ASSET], "noise": anchors.NOISE_ANCHORS}
+    labels, assets, all_texts, embeddings = [], [], [], []
+    for label, path in paths.items():
+        vectors = joblib.load(path)
+        labels += [label] * len(vectors)
+        assets += [None if label == "noise" else LEGACY_ASSET] * len(vectors)
+        all_texts += texts[label] if len(texts[label]) == len(vectors) else [""] * len(vectors)
+        embeddings += vectors
+
+    return save_anchor_set(labels, assets, all_texts, embeddings, model, root)
+
+
+class AnchorStore:
+    """
+    Holds the published anchor set and swaps in new versions as they're
+    published. Readers take `store.current` once per classification, the
+    reference is replaced in one assignment so they never see a mix of sets.
+    """
+
+    def __init__(self, root: str = ANCHOR_STORE_DIR, dimension: int | None = None) -> None:
+        """
+        :param root: The store directory.
+        :param dimension: If given, versions of any other dimension are refused.
+        """
+        self.root = root
+        self.dimension = dimension
+        self.current: AnchorSet | None = None
+        self.reload()
+
+    def reload(self) -> bool:
+        """Loads the published version if it changed. Returns True if a new set was swapped in."""
+        version = current_version(self.root)
+        if version is None or (self.current is not None and self.current.version == version):
+            return False
+
+        try:
+            anchor_set = load_anchor_set(os.path.join(self.root, version))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[Anchor Store Error] Could not load {version}: {e}")
+            return False
+
+        if self.dimension is not None and anchor_set.dimension != self.dimension:
+            print(f"[Anchor Store Error] {version} has dimension {anchor_set.dimension}, expected {self.dimension}")
+            return False
+
+        self.current = anchor_set
+        print(f"Loaded anchor set {version} ({len(anchor_set)} anchors, {anchor_set.model})")
+        return True
+
+    async def watch(self, interval: float = ANCHOR_POLL_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"[Anchor Store Error]: {e}")
@@ -1,5 +1,7 @@
 from ai_engine import GeminiAnalyst
-import joblib
+from anchor_store import save_anchor_set, publish_version, convert_pickles
+from embeddings import make_provider, EMBEDDING_PROVIDER
+import argparse
 import asyncio
 
 BUY_ANCHORS = [
@@ -56,21 +58,102 @@ NOISE_ANCHORS = [
     "Does anyone have a good recipe for banana bread?"
 ]
 
-async def create_anchors():
-    gemini = GeminiAnalyst()
+GOLD_BUY_ANCHORS = [
+    "Central banks added record amounts of gold to their reserves last quarter.",
+    "Real yields fall as the Federal Reserve signals rate cuts are coming.",
+    "Banking sector turmoil sends investors fleeing to safe-haven assets.",
+    "Escalating conflict raises fears of a wider war, gold demand surges.",
+]
 
-    buy_embeddings = [gemini.get_embedding(text) for text in BUY_ANCHORS]
-    sell_embeddings = [gemini.get_embedding(text) for text in SELL_ANCHORS]
-    noise_embeddings = [gemini.get_embedding(text) for text in NOISE_ANCHORS]
-    
-    buy_embeddings = await asyncio.gather(*buy_embeddings)
-    sell_embeddings = await asyncio.gather(*sell_embeddings)
-    noise_embeddings = await asyncio.gather(*noise_embeddings)
+GOLD_SELL_ANCHORS = [
+    "Treasury yields climb to a new high as the Fed rules out rate cuts this year.",
+    "Gold ETFs see their largest outflows in months as risk appetite returns.",
+    "Ceasefire agreement eases geopolitical tensions, safe-haven demand fades.",
+]
+
+OIL_BUY_ANCHORS = [
+    "OPEC+ agrees to deepen production cuts through the end of the year.",
+    "Attack on tankers in the Strait of Hormuz disrupts crude shipments.",
+    "US crude inventories fall far more than expected in the weekly EIA report.",
+    "Hurricane forces evacuation of offshore oil platforms in the Gulf of Mexico.",
+]
+
+OIL_SELL_ANCHORS = [
+    "OPEC+ announces it will raise output as members abandon quotas.",
+    "US crude stockpiles post a surprise build as refinery demand weakens.",
+    "China factory activity contracts again, clouding the outlook for oil demand.",
+    "Sanctions relief clears the way for more barrels to return to the market.",
+]
+
+DOLLAR_BUY_ANCHORS = [
+    "Fed officials push back against rate cut expectations, the dollar rallies.",
+    "US economy adds far more jobs than forecast, wages rise strongly.",
+    "Global risk-off move drives investors into US Treasuries and the dollar.",
+]
+
+DOLLAR_SELL_ANCHORS = [
+    "Weak US retail sales data boosts bets on imminent Fed rate cuts.",
+    "European Central Bank surprises with a larger than expected rate hike, the euro jumps.",
+    "Bank of Japan ends negative interest rates, the yen strengthens sharply.",
+]
+
+# Buy and sell anchors per ticker, the noise anchors are shared by all of them.
+# Adding an asset here and in strategy.ASSETS is all it takes to track it.
+ASSET_ANCHORS = {
+    "SI=F": {"buy": BUY_ANCHORS, "sell": SELL_ANCHORS},
+    "GC=F": {"buy": GOLD_BUY_ANCHORS, "sell": GOLD_SELL_ANCHORS},
+    "CL=F": {"buy": OIL_BUY_ANCHORS, "sell": OIL_SELL_ANCHORS},
+    "DX-Y.NYB": {"buy": DOLLAR_BUY_ANCHORS, "sell": DOLLAR_SELL_ANCHORS},
+}
+
+async def create_anchors(publish: bool = True, provider: str = EMBEDDING_PROVIDER) -> str:
+    """
+    Embeds every asset's anchor texts and writes them as a new version of the
+    anchor store. The provider must be the one posts will be embedded with.
+    """
+    analyst = GeminiAnalyst(make_provider(provider))
+
+    labels, assets, texts = [], [], []
+    for asset, categories in ASSET_ANCHORS.items():
+        for label, category_texts in categories.items():
+            labels += [label] * len(category_texts)
+            assets += [asset] * len(category_texts)
+            texts += category_texts
+    labels += ["noise"] * len(NOISE_ANCHORS)
+    assets += [None] * len(NOISE_ANCHORS)
+    texts += NOISE_ANCHORS
+
+    embeddings = await analyst.get_embeddings(texts)
+
+    failed = [text for text, embedding in zip(texts, embeddings) if embedding is None]
+    if failed:
+        raise RuntimeError(f"Could not embed {len(failed)} anchors, e.g. {failed[0]!r}")
+
+    return save_anchor_set(labels, assets, texts, embeddings, analyst.provider.model, publish=publish)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and publish anchor sets. Running processes pick up a published set within seconds.")
+    parser.add_argument("--draft", action="store_true", help="Write the new version without publishing it, e.g. to try it with reclassify.py first")
+    parser.add_argument("--publish", metavar="VERSION", help="Publish an existing version instead of building one")
+    parser.add_argument("--from-pickles", action="store_true", help="Import the old buy/sell/noise_anchors.pkl files")
+    parser.add_argument("--provider", choices=["gemini", "local"], default=EMBEDDING_PROVIDER, help="The embedding provider to build with")
+    args = parser.parse_args()
+
+    if args.publish:
+        publish_version(args.publish)
+        version = args.publish
+    elif args.from_pickles:
+        from env import GEMINI_EMBEDDING_MODEL
+        version = convert_pickles(GEMINI_EMBEDDING_MODEL)
+        if version is None:
+            print("No anchor pickles found.")
+            return
+    else:
+        version = asyncio.run(create_anchors(publish=not args.draft, provider=args.provider))
 
-    joblib.dump(buy_embeddings, "buy_anchors.pkl")
-    joblib.dump(sell_embeddings, "sell_anchors.pkl")
-    joblib.dump(noise_embeddings, "noise_anchors.pkl")
+    print(f"Anchor set {version} {'written' if args.draft else 'published'}")
 
 
 if __name__ == "__main__":
-    asyncio.run(create_anchors())
\ No newline at end of file
+    main()
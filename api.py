@@ -1,16 +1,50 @@
-from fastapi import FastAPI
-from starlette.responses import FileResponse
+from collections import OrderedDict
+from fastapi import FastAPI, Request
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from typing import Callable, Iterator
+import asyncio
 import os
+import threading
+import time
+import orjson
 import pandas as pd
 from datetime import datetime, timedelta, timezone
+from numpy import float64
+from numpy.typing import NDArray
 
-from db import Database
-from market_data import MarketDataProvider
+from db import Database, DocumentChunkRow, ReadOnlyPool, FIRST_PAGE, PAGE_FETCH_SIZE
+from ai_engine import GeminiAnalyst
+from limiter import Unavailable
+from metrics import metrics
+from diagnostics import loop_monitor, sample_profile, format_collapsed, PROFILE_INTERVAL, PROFILE_MAX_SECONDS
+from dashboard_feed import feed, FEED_WINDOW
+from price_history import PriceHistoryCache, DEFAULT_RANGE, DEFAULT_POINTS
+
+# Connections for the query endpoints, each streams a page on its own
+READ_POOL_SIZE = 4
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+DEFAULT_SIMILAR = 20
+MAX_SIMILAR = 200
+# Embedded query texts kept so repeating a search doesn't call Gemini again
+QUERY_CACHE_SIZE = 256
 
 # --- Initialization ---
 app = FastAPI()
-db = Database()
-market_provider = MarketDataProvider()
+# The pipeline's analyst, set by main.py, so query embeddings share its rate limit and anchors
+app.state.analyst = None
+readers = ReadOnlyPool(READ_POOL_SIZE)
+profiling = asyncio.Lock()
+# Opened at startup, once the writer has brought the schema up to date
+db: Database
+price_history: PriceHistoryCache
+
+@app.on_event("startup")
+def open_database():
+    global db, price_history
+    db = Database(read_only=True)
+    price_history = PriceHistoryCache(db)
+    feed.load_signals(db.get_signal_labels_since(int(time.time()) - FEED_WINDOW))
 
 # Get the directory of the current script
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -30,26 +64,176 @@ async def get_index():
 
 # --- API Endpoints ---
 
+@app.get("/metrics")
+async def get_metrics():
+    """Pipeline latencies, counters and queue depths for Prometheus to scrape."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# --- Admin Endpoints ---
+# The server only listens on localhost, these are for whoever is on the box
+
+@app.get("/admin/stalls")
+async def get_stalls():
+    """The most recent event loop stalls, with the stack that was running when each was caught."""
+    return [
+        {"started": stall.started, "duration": stall.duration, "stack": stall.stack}
+        for stall in reversed(loop_monitor.stalls)
+    ]
+
+@app.get("/admin/profile")
+async def get_profile(seconds: float = 10, interval: float = PROFILE_INTERVAL, loop_only: bool = False):
+    """
+    Samples the live process for `seconds` and returns collapsed stacks,
+    ready for flamegraph.pl or speedscope. `loop_only` samples just the
+    event loop thread.
+    """
+    if profiling.locked():
+        return JSONResponse({"error": "A profile is already running"}, status_code=409)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or interval < 0.001:
+        return JSONResponse({"error": f"seconds must be in (0, {PROFILE_MAX_SECONDS}] and interval at least 0.001"}, status_code=400)
+
+    async with profiling:
+        thread_id = threading.get_ident() if loop_only else None
+        samples = await asyncio.to_thread(sample_profile, seconds, interval, thread_id)
+
+    filename = f"balthazar-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+    return PlainTextResponse(format_collapsed(samples), headers={"Content-Disposition": f'inline; filename="{filename}"'})
+
+@app.get("/api/stream")
+async def get_stream(request: Request):
+    """
+    Server-sent events for the dashboard: a snapshot of the last day of
+    signals, prices and decisions, then each change as it happens.
+    A reconnecting browser resumes from its Last-Event-ID.
+    """
+    return StreamingResponse(
+        feed.stream(request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.get("/api/price-history")
-async def get_price_history():
+async def get_price_history(
+    request: Request,
+    ticker: str = "SI=F",
+    resolution: str | None = None,
+    start: int | None = None,
+    end: int | None = None,
+    range: int = DEFAULT_RANGE,
+    points: int = DEFAULT_POINTS,
+):
     """
-    Provides historical price data for the silver futures ticker,
-    updated every minute.
+    Closing prices of `ticker` as [timestamp_ms, close] pairs, served from
+    the local bar store. `start` and `end` are epoch milliseconds, `range`
+    is the length in seconds when `start` is omitted. Without a
+    `resolution` the finest one that fits the range is used, and the
+    series is downsampled to at most `points` points.
     """
-    hist_df = market_provider.get_historical_data(ticker='SI=F', period="1d", interval="1m")
-    
-    if hist_df is not None and not hist_df.empty:
-        # Reset index to make 'Datetime' a column
-        hist_df = hist_df.reset_index()
-        
-        # Convert timezone-aware Datetime to UTC timestamp in milliseconds for JS
-        hist_df['timestamp'] = hist_df['Datetime'].apply(lambda x: int(x.timestamp() * 1000))
-        
-        # Select and format the data
-        chart_data = hist_df[['timestamp', 'Close']].values.tolist()
-        return {"prices": chart_data}
-        
-    return {"error": "Could not fetch price history"}
+    try:
+        cached = price_history.get(ticker, resolution, start, end, range, points)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    headers = {"ETag": cached.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == cached.etag:
+        return Response(status_code=304, headers=headers)
+
+    if cached.gzipped is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(cached.gzipped, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(cached.body, media_type="application/json", headers=headers)
+
+@app.get("/api/events")
+async def get_events(cursor: str | None = None, limit: int = DEFAULT_PAGE_SIZE, since: int = 0):
+    """
+    Events newest first as NDJSON, one per line, ending with a
+    {"next_cursor": ...} line to pass back for the next page (null on the
+    last one). `since` leaves out events not updated after that epoch second.
+    """
+    try:
+        before = _parse_cursor(cursor)
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    def page(reader: Database):
+        for event in reader.iter_events_page(before, limit, since):
+            yield _event_json(event), (event.last_updated, event.id)
+
+    return StreamingResponse(_stream_page(page, limit), media_type="application/x-ndjson")
+
+@app.get("/api/intelligence")
+async def get_intelligence(cursor: str | None = None, limit: int = DEFAULT_PAGE_SIZE, since: int = 0, event: int | None = None):
+    """
+    Intelligence newest first as NDJSON, paginated like /api/events,
+    optionally only the posts of one event.
+    """
+    try:
+        before = _parse_cursor(cursor)
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    def page(reader: Database):
+        for row, last_updated in reader.iter_intelligence_page(before, limit, since, event):
+            yield {"id": row.rowid, "url": row.url, "content": row.content, "event": row.event, "last_updated": last_updated}, (last_updated, row.rowid)
+
+    return StreamingResponse(_stream_page(page, limit), media_type="application/x-ndjson")
+
+@app.get("/api/similar")
+async def get_similar(text: str | None = None, url: str | None = None, kind: str = "intelligence", limit: int = DEFAULT_SIMILAR, since: int = 0):
+    """
+    The intelligence or events closest to `text`, or to the stored post at
+    `url`, as NDJSON with their cosine distance, closest first. Intelligence
+    from long documents comes with the passage that matched best, and kind
+    "passages" searches those passages themselves.
+    """
+    if (text is None) == (url is None):
+        return JSONResponse({"error": "Pass one of text or url"}, status_code=400)
+    if kind not in ("intelligence", "events", "passages"):
+        return JSONResponse({"error": "kind must be intelligence, events or passages"}, status_code=400)
+    limit = max(1, min(limit, MAX_SIMILAR))
+
+    embedding = None
+    if text is not None:
+        if app.state.analyst is None:
+            return JSONResponse({"error": "Searching by text needs the pipeline running, search by url instead"}, status_code=503)
+        try:
+            embedding = await _embed_query(app.state.analyst, text)
+        except Unavailable:
+            return JSONResponse({"error": "Gemini is unavailable, try again later"}, status_code=503)
+        if embedding is None:
+            return JSONResponse({"error": "Could not embed the query"}, status_code=502)
+
+    def search() -> list | None:
+        with readers.connection() as reader:
+            query = embedding
+            if query is None:
+                source = reader.get_intelligence_by_url(url)
+                if source is None:
+                    return None
+                query = source.embedding
+
+            # One extra, the post searched by is its own closest match
+            if kind == "events":
+                results = [{**_event_json(event), "distance": distance} for event, distance in reader.get_closest_events(query, limit + 1, since)]
+            elif kind == "passages":
+                results = [
+                    {"url": chunk.url, "chunk": chunk.chunk, "content": chunk.content, "distance": distance}
+                    for chunk, distance in reader.get_closest_chunks(query, limit + 1, since)
+                ]
+            else:
+                closest = reader.get_closest_intelligence(query, limit + 1, since)
+                passages = reader.get_best_chunks([row.url for row, _ in closest], query)
+                results = [
+                    {"id": row.rowid, "url": row.url, "content": row.content, "event": row.event, "distance": distance, **_passage_json(passages.get(row.url))}
+                    for row, distance in closest
+                ]
+        return [result for result in results if url is None or result.get("url") != url][:limit]
+
+    results = await asyncio.to_thread(search)
+    if results is None:
+        return JSONResponse({"error": "No intelligence stored for that url"}, status_code=404)
+    return Response(b"".join(orjson.dumps(result) + b"\n" for result in results), media_type="application/x-ndjson")
 
 @app.get("/api/sentiment")
 async def get_sentiment():
@@ -59,7 +243,7 @@ async def get_sentiment():
     """
     # 1. Fetch signals from the last 24 hours
     twenty_four_hours_ago = int((datetime.now() - timedelta(hours=24)).timestamp())
-    signals = db.get_signals_since(twenty_four_hours_ago)
+    signals = db.get_signal_labels_since(twenty_four_hours_ago)
 
     if not signals:
         return {
@@ -68,7 +252,7 @@ async def get_sentiment():
         }
 
     # 2. Use pandas to process the data
-    df = pd.DataFrame([s.__dict__ for s in signals])
+    df = pd.DataFrame(signals, columns=['added', 'signal'])
     df['timestamp'] = pd.to_datetime(df['added'], unit='s', utc=True)
     df.set_index('timestamp', inplace=True)
 
@@ -134,4 +318,64 @@ async def get_sentiment():
     }
 
 
+# --- Query Helpers ---
+
+_query_embeddings: OrderedDict[str, NDArray[float64]] = OrderedDict()
+
+async def _embed_query(analyst: GeminiAnalyst, text: str) -> NDArray[float64] | None:
+    """Embeds a search text once, later searches for it are served from an LRU."""
+    embedding = _query_embeddings.get(text)
+    if embedding is not None:
+        _query_embeddings.move_to_end(text)
+        return embedding
+
+    embedding = await analyst.get_embedding(text)
+    if embedding is not None:
+        _query_embeddings[text] = embedding
+        while len(_query_embeddings) > QUERY_CACHE_SIZE:
+            _query_embeddings.popitem(last=False)
+    return embedding
+
+def _parse_cursor(cursor: str | None) -> tuple[int, int]:
+    """Cursors are "<last_updated>:<id>" of the last row of the previous page."""
+    if not cursor:
+        return FIRST_PAGE
+    last_updated, id = cursor.split(":")
+    return int(last_updated), int(id)
+
+def _passage_json(passage: tuple[DocumentChunkRow, float] | None) -> dict:
+    if passage is None:
+        return {}
+    chunk, distance = passage
+    return {"passage": {"chunk": chunk.chunk, "content": chunk.content, "distance": distance}}
+
+def _event_json(event) -> dict:
+    return {
+        "id": event.id,
+        "summary": event.summary,
+        "signal": event.signal,
+        "alerted": bool(event.alerted),
+        "added": event.added,
+        "last_updated": event.last_updated,
+    }
+
+def _stream_page(page: Callable[[Database], Iterator[tuple[dict, tuple[int, int]]]], limit: int) -> Iterator[bytes]:
+    """
+    Serializes one page as NDJSON in chunks while it's read. Runs in a
+    worker thread, on a read-only connection held until the page ends.
+    """
+    with readers.connection() as reader:
+        lines = []
+        count = 0
+        last = None
+        for item, key in page(reader):
+            lines.append(orjson.dumps(item))
+            count += 1
+            last = key
+            if len(lines) >= PAGE_FETCH_SIZE:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
 
+    next_cursor = f"{last[0]}:{last[1]}" if count == limit and last is not None else None
+    lines.append(orjson.dumps({"next_cursor": next_cursor}))
+    yield b"\n".join(lines) + b"\n"
@@ -0,0 +1,250 @@
+"""
+Vectorized replay of `Strategy.decide` over stored signals and local price bars.
+
+Decisions are made where the live pipeline makes them: BUY and SELL signals
+are debounced into bursts, each decided once on the decayed BUY minus SELL
+score at the time it comes due, then filtered by the trend and RSI rules.
+
+Usage:
+    python backtest.py si_bars.csv [days]
+
+The bar file is a CSV with a timestamp column (`Datetime` or `timestamp`)
+and a `Close` column, e.g. `MarketDataProvider.get_historical_data(...).to_csv(...)`.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from itertools import product
+from typing import List
+
+import math
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+from vectors import max_similarities, classify_similarities
+from anchor_store import AnchorSet, open_anchor_set
+from strategy import DECISION_MAX_DELAY, DECISION_WINDOW, SIGNAL_HALF_LIFE, SIGNAL_SCORE_THRESHOLD
+
+BUY, SELL, HOLD = 1, -1, 0
+
+# Bars each decision is held for when scoring P&L
+HOLDING_BARS = 12
+
+
+@dataclass(frozen=True)
+class BacktestParams:
+    ma_short: int = 20
+    ma_long: int = 50
+    rsi_window: int = 14
+    rsi_oversold: float = 30
+    rsi_overbought: float = 70
+    confidence_threshold: float = 0.4
+    holding_bars: int = HOLDING_BARS
+    half_life: float = SIGNAL_HALF_LIFE
+    decision_window: float = DECISION_WINDOW
+    decision_max_delay: float = DECISION_MAX_DELAY
+    score_threshold: float = SIGNAL_SCORE_THRESHOLD
+
+
+@dataclass
+class BacktestResult:
+    params: BacktestParams
+    trades: int
+    pnl: float
+    hit_rate: float
+    max_drawdown: float
+
+
+@dataclass
+class BacktestData:
+    """Bars and signals, everything as flat arrays."""
+    bar_times: NDArray[np.int64]
+    closes: NDArray[np.float64]
+    # Oldest first
+    signal_times: NDArray[np.int64]
+    # Max cosine similarity of each signal to the buy, sell and noise anchors
+    buy_sims: NDArray[np.float32]
+    sell_sims: NDArray[np.float32]
+    noise_sims: NDArray[np.float32]
+
+
+def load_bars(path: str) -> tuple[NDArray[np.int64], NDArray[np.float64]]:
+    df = pd.read_csv(path)
+    time_column = "Datetime" if "Datetime" in df.columns else "timestamp"
+    times = ((pd.to_datetime(df[time_column], utc=True) - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+    order = np.argsort(times, kind="stable")
+    return times[order], df["Close"].to_numpy(dtype=np.float64)[order]
+
+def load_signal_embeddings(since: int) -> tuple[NDArray[np.int64], NDArray[np.float32]]:
+    """Stored signal times and embeddings from the archive and the live database."""
+    from db import Database
+    from retention import load_archive
+
+    archived = load_archive("historical_signals", since=since)
+    times = [archived["added"]] if archived else []
+    embeddings = [archived["embedding"]] if archived else []
+
+    live = Database().get_signals_since(since)
+    if live:
+        times.append(np.array([row.added for row in live], dtype=np.int64))
+        embeddings.append(np.stack([row.embedding for row in live]))
+
+    if not times:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+
+    times = np.concatenate(times)
+    order = np.argsort(times, kind="stable")
+    return times[order], np.concatenate(embeddings).astype(np.float32)[order]
+
+def anchor_similarities(embeddings: NDArray[np.float32], anchors: AnchorSet) -> tuple[NDArray, NDArray, NDArray]:
+    """Max similarity per anchor category, as in `GeminiAnalyst.get_signal_from_embedding`, in three matrix products."""
+    return (
+        max_similarities(embeddings, anchors.category("buy")),
+        max_similarities(embeddings, anchors.category("sell")),
+        max_similarities(embeddings, anchors.category("noise")),
+    )
+
+def load_data(bars_path: str, since: int, anchors: AnchorSet | None = None) -> BacktestData:
+    bar_times, closes = load_bars(bars_path)
+    signal_times, embeddings = load_signal_embeddings(since)
+    buy, sell, noise = anchor_similarities(embeddings, anchors or open_anchor_set())
+    return BacktestData(bar_times, closes, signal_times, buy, sell, noise)
+
+
+def rolling_mean(values: NDArray, window: int) -> NDArray:
+    """Trailing mean, NaN until a full window is available (pandas `rolling(window).mean()`)."""
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        cumsum = np.cumsum(np.insert(values, 0, 0.0))
+        out[window - 1:] = (cumsum[window:] - cumsum[:-window]) / window
+    return out
+
+def indicators(closes: NDArray, params: BacktestParams) -> tuple[NDArray, NDArray, NDArray]:
+    """MA short, MA long and RSI exactly as `MarketDataProvider.get_technical_indicators` computes them."""
+    ma_short = rolling_mean(closes, params.ma_short)
+    ma_long = rolling_mean(closes, params.ma_long)
+
+    delta = np.diff(closes, prepend=np.nan)
+    gain = rolling_mean(np.nan_to_num(np.where(delta > 0, delta, 0.0)), params.rsi_window)
+    loss = rolling_mean(np.nan_to_num(np.where(delta < 0, -delta, 0.0)), params.rsi_window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = 100 - 100 / (1 + gain / loss)
+    return ma_short, ma_long, rsi
+
+def classify(data: BacktestData, threshold: float) -> NDArray[np.int8]:
+    """Vectorized `get_signal_from_embedding`."""
+    labels = classify_similarities(data.buy_sims, data.sell_sims, data.noise_sims, threshold)
+    return np.select([labels == "BUY", labels == "SELL"], [BUY, SELL], HOLD).astype(np.int8)
+
+def debounced_decisions(times: NDArray[np.int64], signals: NDArray[np.int8], params: BacktestParams) -> tuple[NDArray[np.float64], NDArray[np.int8]]:
+    """
+    The times `PostProcessor` has `Strategy` decide, with the aggregate AI
+    signal at each. Only BUY and SELL signals reach the strategy. A burst is
+    due `decision_window` after its last signal or `decision_max_delay` after
+    its first, whichever is sooner, and is judged on the score then.
+    """
+    actionable = signals != HOLD
+    times, signals = times[actionable].astype(np.float64), signals[actionable]
+    decay = math.log(2) / params.half_life
+
+    decision_times, aggregates = [], []
+    # BUY and SELL intensities decay alike, so their difference is one decaying sum
+    score, updated = 0.0, 0.0
+    i = 0
+    while i < len(times):
+        start = times[i]
+        due = min(start + params.decision_window, start + params.decision_max_delay)
+        j = i
+        while j < len(times) and times[j] < due:
+            score = score * math.exp(-decay * (times[j] - updated)) + signals[j]
+            updated = times[j]
+            due = min(times[j] + params.decision_window, start + params.decision_max_delay)
+            j += 1
+
+        value = score * math.exp(-decay * (due - updated))
+        decision_times.append(due)
+        aggregates.append(BUY if value >= params.score_threshold else SELL if value <= -params.score_threshold else HOLD)
+        i = j
+
+    return np.array(decision_times, dtype=np.float64), np.array(aggregates, dtype=np.int8)
+
+def run_backtest(data: BacktestData, params: BacktestParams) -> BacktestResult:
+    decision_times, signals = debounced_decisions(data.signal_times, classify(data, params.confidence_threshold), params)
+    ma_short, ma_long, rsi = indicators(data.closes, params)
+
+    # Each decision is made on the last bar at or before it
+    bars = np.searchsorted(data.bar_times, decision_times, side="right") - 1
+    valid = bars >= 0
+    bars, signals = bars[valid], signals[valid]
+    has_indicators = ~(np.isnan(ma_short[bars]) | np.isnan(ma_long[bars]) | np.isnan(rsi[bars]))
+    uptrend = ma_short[bars] > ma_long[bars]
+    downtrend = ma_short[bars] < ma_long[bars]
+
+    # Strategy.decide falls back to the aggregate AI signal when indicators are missing
+    buys = (signals == BUY) & np.where(has_indicators, uptrend & ~(rsi[bars] > params.rsi_overbought), True)
+    sells = (signals == SELL) & np.where(has_indicators, downtrend & ~(rsi[bars] < params.rsi_oversold), True)
+    decisions = np.where(buys, BUY, np.where(sells, SELL, HOLD))
+
+    exits = np.minimum(bars + params.holding_bars, len(data.closes) - 1)
+    traded = (decisions != HOLD) & (exits > bars)
+    returns = decisions[traded] * (data.closes[exits[traded]] / data.closes[bars[traded]] - 1)
+
+    if not len(returns):
+        return BacktestResult(params, 0, 0.0, 0.0, 0.0)
+
+    equity = np.cumsum(returns)
+    drawdown = np.max(np.maximum.accumulate(np.maximum(equity, 0)) - equity)
+    return BacktestResult(params, len(returns), float(equity[-1]), float(np.mean(returns > 0)), float(drawdown))
+
+
+_worker_data: BacktestData | None = None
+
+def _init_worker(data: BacktestData):
+    global _worker_data
+    _worker_data = data
+
+def _run_in_worker(params: BacktestParams) -> BacktestResult:
+    return run_backtest(_worker_data, params)
+
+def sweep(data: BacktestData, grid: List[BacktestParams], workers: int | None = None) -> List[BacktestResult]:
+    """Evaluates every parameter set across a process pool, the data is sent to each worker once."""
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data, )) as pool:
+        return list(pool.map(_run_in_worker, grid, chunksize=max(1, len(grid) // ((workers or os.cpu_count() or 1) * 4))))
+
+def default_grid() -> List[BacktestParams]:
+    return [
+        BacktestParams(ma_short=short, ma_long=long, rsi_oversold=low, rsi_overbought=high, confidence_threshold=threshold)
+        for short, long, (low, high), threshold in product(
+            [10, 20, 30],
+            [50, 100],
+            [(20, 80), (30, 70), (40, 60)],
+            [0.3, 0.35, 0.4, 0.45, 0.5],
+        )
+        if short < long
+    ]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    since = int(time.time()) - days * 24 * 60 * 60
+
+    start = time.perf_counter()
+    data = load_data(sys.argv[1], since)
+    print(f"Loaded {len(data.signal_times)} signals over {len(data.closes)} bars in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    results = sweep(data, default_grid())
+    print(f"Evaluated {len(results)} parameter sets in {time.perf_counter() - start:.2f}s")
+
+    for result in sorted(results, key=lambda r: r.pnl, reverse=True)[:10]:
+        print(f"pnl {result.pnl:+.4f}  hit {result.hit_rate:.1%}  dd {result.max_drawdown:.4f}  trades {result.trades}  {asdict(result.params)}")
+
+
+if __name__ == "__main__":
+    main()
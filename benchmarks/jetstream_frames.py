@@ -0,0 +1,73 @@
+"""
+Measures Jetstream frame handling throughput on a single core.
+
+Usage:
+    python -m benchmarks.jetstream_frames firehose_sample.jsonl
+
+The sample is a file of raw Jetstream frames, one per line.
+"""
+from bluesky import extract_links, prefilter_frame, parse_frame
+from domain.post import Post
+
+import os
+import sys
+import time
+import orjson
+
+REPEAT = 5
+
+
+def full_decode(frame: bytes) -> Post | None:
+    """The original path: decode everything, then discard."""
+    data = orjson.loads(frame)
+    links = extract_links(data)
+    try:
+        if data["commit"]["operation"] != "create":
+            return None
+        if "reply" in data["commit"]["record"]:
+            return None
+        did = data["did"]
+        return Post(
+            f"https://bsky.app/profile/{did}/post/{data['commit']['rkey']}",
+            did,
+            data["commit"]["record"]["text"],
+            links
+        )
+    except:
+        return None
+
+def staged_decode(frame: bytes) -> Post | None:
+    if not prefilter_frame(frame):
+        return None
+    return parse_frame(frame)
+
+def frames_per_second(handler, frames: list[bytes]) -> tuple[float, int]:
+    best = 0.0
+    kept = 0
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        kept = sum(1 for frame in frames if handler(frame) is not None)
+        elapsed = time.perf_counter() - start
+        best = max(best, len(frames) / elapsed)
+    return best, kept
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+    with open(sys.argv[1], "rb") as f:
+        frames = [line.rstrip(b"\n") for line in f if line.strip()]
+
+    print(f"Loaded {len(frames)} frames")
+    for name, handler in [("full decode", full_decode), ("staged decode", staged_decode)]:
+        fps, kept = frames_per_second(handler, frames)
+        print(f"{name:>14}: {fps:>12,.0f} frames/s ({kept} posts kept)")
+
+
+if __name__ == "__main__":
+    main()
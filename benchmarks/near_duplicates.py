@@ -0,0 +1,66 @@
+"""
+Throughput and accuracy of NearDuplicateDetector on a synthetic corpus of
+reworded stories.
+
+Usage:
+    python -m benchmarks.near_duplicates [stories] [copies_per_story]
+"""
+from dedup import NearDuplicateDetector
+from domain.post import Post
+
+import random
+import sys
+import time
+
+VOCABULARY = [f"word{i}" for i in range(5000)]
+STORY_LENGTH = 40
+EDITS_PER_COPY = 2
+
+
+def make_corpus(stories: int, copies: int, seed: int = 0) -> list[tuple[Post, int]]:
+    """Returns (post, story index) pairs with each story followed by lightly edited copies, shuffled."""
+    rng = random.Random(seed)
+    corpus = []
+    for story in range(stories):
+        words = rng.choices(VOCABULARY, k=STORY_LENGTH)
+        corpus.append((Post(f"https://example.com/{story}/0", "N/A", " ".join(words), []), story))
+        for copy in range(1, copies + 1):
+            edited = list(words)
+            for _ in range(EDITS_PER_COPY):
+                edited[rng.randrange(STORY_LENGTH)] = rng.choice(VOCABULARY)
+            corpus.append((Post(f"https://example.com/{story}/{copy}", "N/A", " ".join(edited), []), story))
+    rng.shuffle(corpus)
+    return corpus
+
+
+def main():
+    stories = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    copies = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    corpus = make_corpus(stories, copies)
+
+    detector = NearDuplicateDetector()
+    story_of = {}
+    seen_stories = set()
+    true_positives = false_positives = false_negatives = 0
+
+    start = time.perf_counter()
+    for post, story in corpus:
+        story_of[post.url] = story
+        original = detector.check(post, now=0)
+        if original is not None:
+            if story_of[original.url] == story:
+                true_positives += 1
+            else:
+                false_positives += 1
+        elif story in seen_stories:
+            false_negatives += 1
+        seen_stories.add(story)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(corpus)} posts in {elapsed:.2f}s ({len(corpus) / elapsed:,.0f} posts/s)")
+    duplicates = len(corpus) - stories
+    print(f"Caught {true_positives}/{duplicates} near-duplicates, {false_positives} false positives, {false_negatives} missed")
+
+
+if __name__ == "__main__":
+    main()
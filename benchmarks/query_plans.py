@@ -0,0 +1,77 @@
+"""
+Seeds a scratch database and checks that every hot query is answered from
+its index according to EXPLAIN QUERY PLAN. Exits non-zero on a regression.
+
+Usage:
+    python -m benchmarks.query_plans [rows]
+"""
+import sys
+import tempfile
+import numpy as np
+
+import db
+from env import GEMINI_EMBEDDING_LENGTH
+
+# (description, query, params, expected fragment of the plan)
+HOT_QUERIES = [
+    ("get_signal_labels_since", "SELECT added, signal FROM historical_signals WHERE added > ?", (0, ), "COVERING INDEX idx_signals_added"),
+    ("get_signals_since", "SELECT * FROM historical_signals WHERE added > ?", (0, ), "idx_signals_added"),
+    ("get_event_intelligence", "SELECT rowid, * FROM intelligence WHERE event = ?", (1, ), "INDEX idx_intelligence_event"),
+    ("get_closest_intelligence", db._coarse_scan("intelligence", "t.last_updated > ? AND t.last_updated >= ?"), (0, 0), "INDEX idx_intelligence_last_updated"),
+    ("get_closest_events[window]", db._coarse_scan("events", "t.last_updated > ?"), (0, ), "INDEX idx_last_updated"),
+    ("get_alertable_events", "SELECT * FROM events WHERE signal > ? AND alerted = FALSE", (0, ), "INDEX idx_events_alertable"),
+    ("get_recent_events", "SELECT * FROM events WHERE last_updated > ? ORDER BY last_updated DESC", (0, ), "INDEX idx_last_updated"),
+    ("iter_events_page", "SELECT * FROM events WHERE last_updated > ? AND (last_updated, id) < (?, ?) ORDER BY last_updated DESC, id DESC LIMIT ?", (0, 2 ** 62, 2 ** 62, 100), "INDEX idx_last_updated"),
+    ("iter_intelligence_page", "SELECT rowid, * FROM intelligence WHERE last_updated > ? AND (last_updated, rowid) < (?, ?) ORDER BY last_updated DESC, rowid DESC LIMIT ?", (0, 2 ** 62, 2 ** 62, 100), "INDEX idx_intelligence_last_updated"),
+    ("get_closest_chunks", db._coarse_scan("document_chunks", "t.added > ?"), (0, ), "INDEX idx_document_chunks_added"),
+    ("get_best_chunks", "SELECT * FROM document_chunks WHERE url IN (?, ?)", ("a", "b"), "sqlite_autoindex_document_chunks_1"),
+    ("get_duplicates", "SELECT url FROM duplicates WHERE original = ? ORDER BY added, rowid", ("a", ), "INDEX idx_duplicates_original"),
+    ("has_rss_item", "SELECT EXISTS(SELECT 1 FROM rss WHERE source = ? AND id = ? LIMIT 1)", ("a", "b"), "sqlite_autoindex_rss_1"),
+]
+
+
+def seed(database: db.Database, rows: int):
+    rng = np.random.default_rng(0)
+    now = 1_700_000_000
+    embedding = rng.normal(size=GEMINI_EMBEDDING_LENGTH).astype(np.float32)
+    blob = embedding.tobytes()
+
+    c = database.conn.cursor()
+    c.executemany(
+        "INSERT INTO historical_signals (url, embedding, signal, added) VALUES (?, ?, ?, ?)",
+        ((f"s{i}", blob, ["BUY", "SELL", "HOLD"][i % 3], now + i) for i in range(rows))
+    )
+    c.executemany(
+        "INSERT INTO intelligence (url, content, embedding, event, added, last_updated) VALUES (?, ?, ?, ?, ?, ?)",
+        ((f"i{i}", "content", blob, i % 500, now + i, now + i) for i in range(rows))
+    )
+    c.executemany(
+        "INSERT INTO events (summary, embedding, signal, alerted, added, last_updated) VALUES (?, ?, ?, ?, ?, ?)",
+        (("summary", blob, i % 20, i % 2, now + i, now + i) for i in range(rows // 10))
+    )
+    c.executemany("INSERT INTO rss (source, id) VALUES (?, ?)", ((f"src{i % 30}", f"id{i}") for i in range(rows)))
+    database.conn.commit()
+    database.quantize_existing("intelligence")
+    c.execute("ANALYZE")
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    with tempfile.NamedTemporaryFile(suffix=".db") as f:
+        db.DB_NAME = f.name
+        database = db.Database()
+        seed(database, rows)
+
+        failures = 0
+        for name, query, params, expected in HOT_QUERIES:
+            plan = " | ".join(row["detail"] for row in database.conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+            ok = expected in plan
+            failures += not ok
+            print(f"{'ok' if ok else 'FAIL':>4}  {name}: {plan}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
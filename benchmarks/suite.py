@@ -0,0 +1,585 @@
+"""
+The benchmark suite: the hot paths one at a time, then the pipeline end to
+end, all offline. Gemini, yfinance and the webhook are the stand-ins from
+fakes.py and every database is a scratch one, seeded with made-up rows.
+
+Usage:
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --compare baseline.json
+    python -m benchmarks.suite --only db,api --quick
+
+Each benchmark is timed over a number of rounds after a warmup one and
+reported in seconds per operation, the median and the best round. --compare
+runs the suite and checks it against an earlier --output: any benchmark
+whose median is more than --tolerance slower than the baseline's is flagged
+as a regression and the exit status is 1. Only compare runs made on the same
+machine with the same --quick setting.
+"""
+from compression import zstd
+from dataclasses import dataclass
+from itertools import count
+from statistics import median
+from typing import Callable, Dict, Iterator, List
+
+import argparse
+import asyncio
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+import feedparser
+import numpy as np
+import orjson
+from numpy.typing import NDArray
+
+import db
+from alert import AlertSender, MAX_BATCH
+from bluesky import BlueskyClient
+from domain.post import Post
+from embeddings import GeminiEmbeddings, LocalEmbeddings, LocalPrescorer
+from event_clustering import EventReclusterer
+from fakes import FakeAnalyst, FakeGeminiServer, FakeMarketProvider, FakeWebhookServer, RecordedPages, fake_anchor_set, fake_embedding
+from heuristics import KEYWORDS, should_process_post
+from post_processor import PostProcessor
+from rss import RssFetcher
+from env import GEMINI_EMBEDDING_LENGTH
+
+ROUNDS = 7
+QUICK_ROUNDS = 3
+# A median this much slower than the baseline's is a regression
+DEFAULT_TOLERANCE = 0.25
+
+DAY = 24 * 60 * 60
+# Requests per second the fake Gemini allows, the gemini group should run at about this
+GEMINI_QUOTA = 200
+# Share of made-up posts that mention a tracked keyword, about what the firehose has
+KEYWORD_RATE = 0.05
+
+FILLER = (
+    "the a and of to in is it that for on was with as at be this have from or by "
+    "one had not but what all were when we there can an your which their said if do "
+    "will each about how up out them then she many some so these would other into has "
+    "more two like him see time could no make than first been its who now people my "
+    "over down only way find use may water long little very after words called just "
+    "where most know get through back much before go good new write our used me man "
+    "day too any same right look think also around another came come work three word"
+).split()
+
+
+@dataclass
+class Result:
+    name: str
+    # Operations per round, times are per operation
+    ops: int
+    times: List[float]
+
+    @property
+    def median(self) -> float:
+        return median(self.times)
+
+    @property
+    def best(self) -> float:
+        return min(self.times)
+
+    def to_json(self) -> dict:
+        return {"ops": self.ops, "median": self.median, "best": self.best, "times": self.times}
+
+
+class Suite:
+    def __init__(self, directory: str, quick: bool = False) -> None:
+        """
+        :param directory: Where the scratch databases are created.
+        :param quick: Run fewer rounds over smaller inputs, for a fast check.
+        """
+        self.directory = directory
+        self.quick = quick
+        self.rounds = QUICK_ROUNDS if quick else ROUNDS
+        self.loop = asyncio.new_event_loop()
+        self.names = count()
+
+    def scale(self, full, quick):
+        return quick if self.quick else full
+
+    def database(self, name: str) -> db.Database:
+        """A new, empty scratch database."""
+        db.DB_NAME = os.path.join(self.directory, f"{name}_{next(self.names)}.db")
+        return db.Database()
+
+    def measure(self, name: str, run: Callable, ops: int, rounds: int | None = None, setup: Callable | None = None, warmup: bool = True) -> Result:
+        """
+        Times `run`, which does `ops` operations, once untimed to warm up and
+        then `rounds` times. If `setup` is given it's called, untimed, before
+        every round and what it returns is passed to `run`.
+        """
+        def once() -> float:
+            args = () if setup is None else (setup(), )
+            start = time.perf_counter()
+            run(*args)
+            return time.perf_counter() - start
+
+        if warmup:
+            once()
+        times = [once() / ops for _ in range(rounds or self.rounds)]
+        return Result(name, ops, times)
+
+    def measure_async(self, name: str, run: Callable, ops: int, **kwargs) -> Result:
+        """`measure` for a coroutine function, every round runs on the suite's event loop."""
+        return self.measure(name, lambda *args: self.loop.run_until_complete(run(*args)), ops, **kwargs)
+
+
+## MADE-UP INPUTS
+
+def make_post_text(rng: random.Random, keyword_rate: float = KEYWORD_RATE) -> str:
+    words = rng.choices(FILLER, k=rng.randint(8, 45))
+    if rng.random() < keyword_rate:
+        words.insert(rng.randrange(len(words)), rng.choice(sorted(KEYWORDS)))
+    if rng.random() < 0.2:
+        words.append(f"#{rng.choice(FILLER).capitalize()}{rng.choice(FILLER).capitalize()}")
+    if rng.random() < 0.2:
+        words.append(f"https://example.com/{rng.choice(FILLER)}/{rng.getrandbits(32):x}?ref=bsky")
+    return " ".join(words)
+
+def make_article(rng: random.Random, paragraphs: int = 12) -> str:
+    """A page as AntiBot returns it, markdown with links and images."""
+    parts = [f"# {make_post_text(rng, 0.5)}"]
+    for i in range(paragraphs):
+        parts.append(make_post_text(rng, 0.2) + " " + make_post_text(rng, 0))
+        if i % 4 == 0:
+            parts.append(f"[{rng.choice(FILLER)} {rng.choice(FILLER)}](https://example.com/{rng.getrandbits(32):x}) ![chart](https://cdn.example.com/{i}.png)")
+    return "\n\n".join(parts)
+
+def make_frames(rng: random.Random, amount: int) -> List[bytes]:
+    """Jetstream post commits: mostly creates, some replies, some deletes."""
+    frames = []
+    for i in range(amount):
+        did = f"did:plc:{rng.getrandbits(96):024x}"
+        rkey = f"3l{rng.getrandbits(48):012x}"
+        kind = rng.random()
+        commit = {"rev": f"3l{rng.getrandbits(48):012x}", "operation": "delete" if kind < 0.15 else "create", "collection": "app.bsky.feed.post", "rkey": rkey}
+        if kind >= 0.15:
+            text = make_post_text(rng)
+            record = {"$type": "app.bsky.feed.post", "createdAt": "2026-10-19T12:00:00.000Z", "langs": ["en"], "text": text}
+            if kind < 0.35:
+                parent = {"cid": f"bafyrei{rng.getrandbits(128):032x}", "uri": f"at://{did}/app.bsky.feed.post/{rkey}"}
+                record["reply"] = {"parent": parent, "root": parent}
+            if "https://" in text:
+                start = text.index("https://")
+                record["facets"] = [{"features": [{"$type": "app.bsky.richtext.facet#link", "uri": text[start:]}], "index": {"byteStart": start, "byteEnd": len(text)}}]
+            commit["record"] = record
+            commit["cid"] = f"bafyrei{rng.getrandbits(128):032x}"
+        frames.append(orjson.dumps({"did": did, "time_us": 1_760_875_200_000_000 + i * 250, "kind": "commit", "commit": commit}))
+    return frames
+
+def make_feed(rng: random.Random, entries: int) -> tuple[str, Dict[str, str]]:
+    """An RSS 2.0 feed with HTML summaries and full content, and the page behind each entry."""
+    items = []
+    pages = {}
+    for i in range(entries):
+        url = f"https://news.example.com/{i}/{rng.getrandbits(32):x}"
+        summary = f"<p>{make_post_text(rng, 0.3)}</p>"
+        content = "".join(f"<p>{make_post_text(rng, 0.1)} <a href=\"https://example.com/{j}\">{rng.choice(FILLER)}</a></p>" for j in range(6))
+        items.append(
+            f"<item><title>{make_post_text(rng, 0.5)[:80]}</title><link>{url}</link><guid>{url}</guid>"
+            f"<description><![CDATA[{summary}]]></description><content:encoded><![CDATA[{content}]]></content:encoded></item>"
+        )
+        pages[url] = make_article(rng)
+    feed = (
+        '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0" xmlns:content="http://purl.org/rss/1.0/modules/content/">'
+        f"<channel><title>Example</title><link>https://news.example.com</link>{''.join(items)}</channel></rss>"
+    )
+    return feed, pages
+
+def make_embeddings(rng: np.random.Generator, amount: int, clusters: int) -> NDArray[np.float32]:
+    """Unit vectors scattered around `clusters` centres, like posts about a handful of stories."""
+    centres = rng.standard_normal((clusters, GEMINI_EMBEDDING_LENGTH))
+    vectors = centres[rng.integers(clusters, size=amount)] + 0.6 * rng.standard_normal((amount, GEMINI_EMBEDDING_LENGTH))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+## SEEDING
+
+def seed_intelligence(database: db.Database, embeddings: NDArray[np.float32], now: int, span: int, events: int = 0):
+    """Intelligence rows spread evenly over the `span` seconds before `now`."""
+    rows = len(embeddings)
+    database.conn.executemany(
+        "INSERT INTO intelligence (url, content, embedding, event, added, last_updated) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (f"https://example.com/i/{i}", f"story {i}", embedding.tobytes(), i % events if events else None, t, t)
+            for i, embedding in enumerate(embeddings)
+            for t in [now - span + span * i // rows]
+        )
+    )
+    database.conn.commit()
+    database.quantize_existing("intelligence")
+
+def seed_signals(database: db.Database, rows: int, now: int, rng: random.Random):
+    """A day of historical signals, mostly HOLD."""
+    blob = fake_embedding("signal").astype(np.float32).tobytes()
+    database.conn.executemany(
+        "INSERT INTO historical_signals (url, embedding, signal, added) VALUES (?, ?, ?, ?)",
+        ((f"https://example.com/s/{i}", blob, rng.choices(["BUY", "SELL", "HOLD"], [1, 1, 8])[0], now - DAY + DAY * i // rows) for i in range(rows))
+    )
+    database.conn.commit()
+
+def seed_database(database: db.Database, rows: int, now: int):
+    """A week of intelligence and events, a day of signals, RSS items, queued alerts and a week of one-minute bars."""
+    rng = np.random.default_rng(0)
+    events = max(rows // 20, 1)
+    seed_intelligence(database, make_embeddings(rng, rows, events), now, 7 * DAY, events)
+    seed_signals(database, rows, now, random.Random(0))
+
+    c = database.conn.cursor()
+    c.executemany(
+        "INSERT INTO events (id, summary, embedding, signal, alerted, added, last_updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (i, f"event {i}", embedding.tobytes(), i % 20, i % 2, t, t)
+            for i, embedding in enumerate(make_embeddings(rng, events, events))
+            for t in [now - 7 * DAY + 7 * DAY * i // events]
+        )
+    )
+    c.executemany("INSERT INTO rss (source, id) VALUES (?, ?)", ((f"https://feed{i % 30}.example.com/rss", f"item{i}") for i in range(rows)))
+    c.executemany("INSERT INTO alert_outbox (title, url, content) VALUES (?, ?, ?)", ((f"BUY {i}", f"https://example.com/a/{i}", "content") for i in range(1000)))
+    closes = 30 * np.exp(np.cumsum(rng.normal(0, 0.0005, 7 * DAY // 60)))
+    c.executemany(
+        "INSERT INTO price_bars (ticker, resolution, time, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (("SI=F", "1m", now - 7 * DAY + i * 60, close, close, close, close, 0.0) for i, close in enumerate(closes.tolist()))
+    )
+    database.conn.commit()
+    database.quantize_existing("events")
+    c.execute("ANALYZE")
+
+
+## BENCHMARKS
+
+def bench_text(suite: Suite) -> Iterator[Result]:
+    rng = random.Random(0)
+    analyst = FakeAnalyst()
+    posts = [make_post_text(rng, 0.5) for _ in range(suite.scale(5000, 1000))]
+    articles = [make_article(rng) for _ in range(suite.scale(200, 50))]
+    yield suite.measure("clean_for_embedding[post]", lambda: [analyst._clean_for_embedding(text) for text in posts], len(posts))
+    yield suite.measure("clean_for_embedding[article]", lambda: [analyst._clean_for_embedding(text) for text in articles], len(articles))
+
+def bench_classify(suite: Suite) -> Iterator[Result]:
+    analyst = FakeAnalyst()
+    analyst.anchor_store.current = fake_anchor_set()
+    embeddings = [fake_embedding(str(i)) for i in range(suite.scale(5000, 1000))]
+    yield suite.measure("get_signal_from_embedding", lambda: [analyst.get_signal_from_embedding(e) for e in embeddings], len(embeddings))
+    yield suite.measure("get_signals_from_embedding", lambda: [analyst.get_signals_from_embedding(e) for e in embeddings], len(embeddings))
+
+def bench_embeddings(suite: Suite) -> Iterator[Result]:
+    rng = random.Random(0)
+    local = LocalEmbeddings()
+    posts = [make_post_text(rng, 0.5) for _ in range(suite.scale(5000, 1000))]
+    articles = [make_article(rng) for _ in range(suite.scale(500, 100))]
+
+    async def one_by_one():
+        for text in posts:
+            await local.embed([text])
+
+    yield suite.measure_async("local_embed[post]", one_by_one, len(posts))
+    yield suite.measure_async("local_embed[post batch]", lambda: local.embed(posts), len(posts))
+    yield suite.measure_async("local_embed[article batch]", lambda: local.embed(articles), len(articles))
+
+    analyst = FakeAnalyst()
+    analyst.anchor_store.current = fake_anchor_set()
+    prescorer = LocalPrescorer(analyst.anchor_store, 0.1, local)
+    yield suite.measure("prescore", lambda: [prescorer.worth_embedding(text) for text in posts], len(posts))
+
+    # Filings and press releases with their pages, split into windows and pooled
+    documents = [" ".join(make_article(rng) for _ in range(8)) for _ in range(suite.scale(100, 20))]
+
+    async def embed_documents():
+        for document in documents:
+            await analyst.embed_document(document)
+
+    yield suite.measure_async("embed_document[long]", embed_documents, len(documents))
+
+def bench_heuristics(suite: Suite) -> Iterator[Result]:
+    rng = random.Random(0)
+    # What reaches it has passed the prefilter, so most posts mention a keyword
+    posts = [
+        Post(f"https://bsky.app/profile/did:plc:{i}/post/{i}", f"did:plc:{rng.getrandbits(96):024x}", make_post_text(rng, 0.8), [f"https://example.com/{i}"] * rng.randint(0, 2))
+        for i in range(suite.scale(20_000, 5000))
+    ]
+    yield suite.measure("should_process_post", lambda: [should_process_post(post) for post in posts], len(posts))
+
+def bench_jetstream(suite: Suite) -> Iterator[Result]:
+    frames = make_frames(random.Random(0), suite.scale(50_000, 10_000))
+    queue = asyncio.Queue()
+    client = BlueskyClient(queue, compress=False)
+
+    async def handle(messages: List[bytes]):
+        for message in messages:
+            await client.handle_frame(message)
+        while not queue.empty():
+            queue.get_nowait()
+
+    yield suite.measure_async("jetstream.handle_frame", lambda: handle(frames), len(frames))
+
+    # Jetstream's own dictionary isn't in the repo, one trained on the sample stands in for it
+    client.zstd_dict = zstd.train_dict(frames[:5000], 64 * 1024)
+    compressed = [zstd.compress(frame, zstd_dict=client.zstd_dict) for frame in frames]
+    yield suite.measure_async("jetstream.handle_frame[zstd]", lambda: handle(compressed), len(compressed))
+
+def bench_rss(suite: Suite) -> Iterator[Result]:
+    feed, pages = make_feed(random.Random(0), suite.scale(100, 30))
+    fetcher = RssFetcher(suite.database("rss"), RecordedPages(pages), asyncio.Queue())
+    entries = feedparser.parse(feed).entries
+
+    async def contents():
+        for entry in entries:
+            await fetcher.get_string_content(entry, entry.link)
+
+    yield suite.measure("feedparser.parse", lambda: feedparser.parse(feed), len(entries))
+    yield suite.measure_async("rss.get_string_content", contents, len(entries))
+
+def bench_db(suite: Suite) -> Iterator[Result]:
+    writes = suite.scale(500, 100)
+    embeddings = [fake_embedding(f"write {i}") for i in range(writes)]
+    database = suite.database("db_writes")
+    rounds = count()
+    bars = [(i * 60, 30.0, 30.1, 29.9, 30.05, 100.0) for i in range(60)]
+
+    # Every round writes new keys, a repeat would only hit INSERT OR IGNORE
+    yield suite.measure("db.add_historical_signal", lambda r: [database.add_historical_signal(f"https://example.com/{r}/{i}", e, "HOLD") for i, e in enumerate(embeddings)], writes, setup=lambda: next(rounds))
+    yield suite.measure("db.add_intelligence", lambda r: [database.add_intelligence(f"https://example.com/{r}/{i}", "content", e) for i, e in enumerate(embeddings)], writes, setup=lambda: next(rounds))
+    yield suite.measure("db.set_intelligence_event", lambda: [database.set_intelligence_event(f"https://example.com/1/{i}", i) for i in range(writes)], writes)
+    yield suite.measure("db.add_event", lambda: [database.add_event("summary", 1, e) for e in embeddings], writes)
+    yield suite.measure("db.corroborate_event", lambda: [database.corroborate_event(i + 1, [("SI=F", "BUY"), ("GC=F", "BUY")]) for i in range(writes)], writes)
+    yield suite.measure("db.add_rss_item", lambda r: [database.add_rss_item("https://feed.example.com/rss", f"{r}/{i}") for i in range(writes)], writes, setup=lambda: next(rounds))
+    yield suite.measure("db.enqueue_alert", lambda: [database.enqueue_alert("BUY Silver (SI=F)", "https://example.com", "content") for _ in range(writes)], writes)
+    yield suite.measure("db.upsert_price_bars[60]", lambda r: [database.upsert_price_bars("SI=F", "1m", [(t + (r * writes + i) * 3600, *bar) for t, *bar in bars]) for i in range(writes // 10)], writes // 10, setup=lambda: next(rounds))
+
+    rows = suite.scale(20_000, 5000)
+    now = int(time.time())
+    database = suite.database("db_queries")
+    seed_database(database, rows, now)
+    query = make_embeddings(np.random.default_rng(1), 1, rows // 20)[0].astype(np.float64)
+    events = rows // 20
+
+    def repeat(amount: int, query: Callable):
+        return lambda: [query(i) for i in range(amount)]
+
+    yield suite.measure("db.has_rss_item", repeat(2000, lambda i: database.has_rss_item(f"https://feed{i % 30}.example.com/rss", f"item{i * 7}")), 2000)
+    yield suite.measure("db.get_signal_labels_since[day]", repeat(5, lambda _: database.get_signal_labels_since(now - DAY)), 5)
+    yield suite.measure("db.get_signals_since[hour]", repeat(5, lambda _: database.get_signals_since(now - DAY // 24)), 5)
+    yield suite.measure("db.get_closest_intelligence[day]", repeat(20, lambda _: database.get_closest_intelligence(query, 10, now - DAY)), 20)
+    yield suite.measure("db.get_closest_intelligence[week]", repeat(20, lambda _: database.get_closest_intelligence(query, 10, now - 7 * DAY)), 20)
+    yield suite.measure("db.get_closest_events", repeat(20, lambda _: database.get_closest_events(query, 10)), 20)
+    yield suite.measure("db.get_event_intelligence", repeat(200, lambda i: database.get_event_intelligence(i % events)), 200)
+    yield suite.measure("db.get_alertable_events", repeat(20, lambda _: database.get_alertable_events(10)), 20)
+    yield suite.measure("db.iter_events_page", repeat(200, lambda _: list(database.iter_events_page(db.FIRST_PAGE, 100))), 200)
+    yield suite.measure("db.iter_intelligence_page", repeat(200, lambda _: list(database.iter_intelligence_page(db.FIRST_PAGE, 100))), 200)
+    yield suite.measure("db.get_due_alerts", repeat(1000, lambda _: database.get_due_alerts(now, MAX_BATCH)), 1000)
+    yield suite.measure("db.get_price_closes[day]", repeat(50, lambda _: database.get_price_closes("SI=F", "1m", now - DAY, now)), 50)
+
+def bench_recluster(suite: Suite) -> Iterator[Result]:
+    for rows in suite.scale([1000, 4000, 16_000], [500, 2000]):
+        database = suite.database(f"recluster_{rows}")
+        seed_intelligence(database, make_embeddings(np.random.default_rng(0), rows, max(rows // 50, 2)), int(time.time()), DAY)
+        reclusterer = EventReclusterer(database)
+        # Seconds to minutes a run at the top end, a warmup round would double that
+        yield suite.measure(f"recluster[n={rows}]", reclusterer.run_recluster_job, 1, rounds=min(suite.rounds, 3), warmup=False)
+
+def bench_api(suite: Suite) -> Iterator[Result]:
+    for rows in suite.scale([20_000, 100_000], [20_000]):
+        database = suite.database(f"sentiment_{rows}")
+        seed_signals(database, rows, int(time.time()), random.Random(0))
+        # Imported only once DB_NAME points at a scratch file, nothing it does may touch the live database
+        import api
+        api.db = db.Database(read_only=True)
+        yield suite.measure_async(f"api.sentiment[rows={rows}]", api.get_sentiment, 1, rounds=suite.rounds * 2)
+
+def bench_alerts(suite: Suite) -> Iterator[Result]:
+    batches = suite.scale(100, 20)
+    database = suite.database("alerts")
+    webhook = FakeWebhookServer(bucket_size=10 ** 9)
+    suite.loop.run_until_complete(webhook.__aenter__())
+    alerter = AlertSender(database, webhook_url=webhook.url)
+
+    def enqueue():
+        for i in range(batches * MAX_BATCH):
+            database.enqueue_alert("BUY Silver (SI=F)", f"https://example.com/{i}", "content " * 50)
+
+    async def deliver(_):
+        async with aiohttp.ClientSession() as session:
+            for _ in range(batches):
+                await alerter._deliver_batch(session)
+
+    try:
+        yield suite.measure_async("alerts.deliver", deliver, batches * MAX_BATCH, setup=enqueue)
+    finally:
+        suite.loop.run_until_complete(webhook.__aexit__(None, None, None))
+
+def bench_gemini(suite: Suite) -> Iterator[Result]:
+    """Posts embedded one request each against a quota, through the adaptive limiter."""
+    rng = random.Random(0)
+    texts = [make_post_text(rng) for _ in range(suite.scale(1000, 400))]
+    server = FakeGeminiServer(quota=GEMINI_QUOTA, latency=0.05)
+    suite.loop.run_until_complete(server.__aenter__())
+    provider = GeminiEmbeddings(base_url=server.url)
+
+    async def run():
+        embeddings = await asyncio.gather(*[provider.embed([text]) for text in texts])
+        # Being rate limited may slow it down, never lose a post
+        if any(embedding is None for embedding, in embeddings):
+            raise RuntimeError("A post wasn't embedded")
+
+    try:
+        yield suite.measure_async(f"gemini.embed[quota={GEMINI_QUOTA}/s]", run, len(texts), rounds=suite.scale(3, 2))
+    finally:
+        suite.loop.run_until_complete(server.__aexit__(None, None, None))
+
+def bench_pipeline(suite: Suite) -> Iterator[Result]:
+    """Frames through the Bluesky client, the processor and into the database."""
+    frames = make_frames(random.Random(1), suite.scale(20_000, 5000))
+    analyst = FakeAnalyst()
+    analyst.anchor_store.current = fake_anchor_set()
+
+    async def run(database: db.Database):
+        # A fresh processor each round, its duplicate detector would drop everything the second time
+        queue = asyncio.Queue()
+        client = BlueskyClient(queue, compress=False)
+        processor = PostProcessor(database, analyst, FakeMarketProvider(), queue)
+        processing = asyncio.create_task(processor.process_queue())
+        for frame in frames:
+            await client.handle_frame(frame)
+        await queue.put(None)
+        await processing
+        for task in processor.decision_tasks.values():
+            task.cancel()
+
+    yield suite.measure_async("pipeline.jetstream_to_signal", run, len(frames), setup=lambda: suite.database("pipeline"))
+
+
+GROUPS: Dict[str, Callable[[Suite], Iterator[Result]]] = {
+    "text": bench_text,
+    "classify": bench_classify,
+    "embeddings": bench_embeddings,
+    "heuristics": bench_heuristics,
+    "jetstream": bench_jetstream,
+    "rss": bench_rss,
+    "db": bench_db,
+    "recluster": bench_recluster,
+    "api": bench_api,
+    "alerts": bench_alerts,
+    "gemini": bench_gemini,
+    "pipeline": bench_pipeline,
+}
+
+
+## REPORTING
+
+def format_seconds(seconds: float) -> str:
+    for unit, scale in [("s", 1), ("ms", 1e-3), ("µs", 1e-6)]:
+        if seconds >= scale:
+            return f"{seconds / scale:.3g}{unit}"
+    return f"{seconds / 1e-9:.3g}ns"
+
+def compare(results: Dict[str, Result], baseline: dict, tolerance: float, quick: bool, partial: bool = False) -> int:
+    """
+    Prints each benchmark against the baseline and returns how many regressed.
+    Unless `partial`, benchmarks only in the baseline are listed as missing.
+    """
+    if baseline["meta"].get("quick") != quick:
+        print("Warning: the baseline was run with a different --quick setting, its inputs were different")
+
+    regressions = 0
+    for name, result in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            print(f"{'new':>10}  {name}")
+            continue
+        ratio = result.median / previous["median"]
+        if ratio > 1 + tolerance:
+            status = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 / (1 + tolerance):
+            status = "faster"
+        else:
+            status = "ok"
+        print(f"{status:>10}  {name:<40} {format_seconds(previous['median']):>9} -> {format_seconds(result.median):>9}  {ratio:5.2f}x")
+
+    if not partial:
+        for name in sorted(baseline["results"].keys() - results.keys()):
+            print(f"{'missing':>10}  {name}")
+    return regressions
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the pipeline's hot paths.")
+    parser.add_argument("--output", help="Write the results here as JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="Flag regressions against an earlier --output")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="How much slower a median may get before it's a regression")
+    parser.add_argument("--only", help=f"Comma separated groups to run, of {', '.join(GROUPS)}")
+    parser.add_argument("--quick", action="store_true", help="Fewer rounds over smaller inputs")
+    parser.add_argument("--pin", action="store_true", help="Pin the process to one core for steadier timings")
+    args = parser.parse_args()
+
+    groups = [group for group in (args.only.split(",") if args.only else GROUPS) if group]
+    unknown = [group for group in groups if group not in GROUPS]
+    if unknown:
+        parser.error(f"Unknown groups {', '.join(unknown)}, choose from {', '.join(GROUPS)}")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "rb") as f:
+            baseline = orjson.loads(f.read())
+
+    if args.pin and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+
+    results: Dict[str, Result] = {}
+    errors: Dict[str, str] = {}
+    started = time.time()
+    with tempfile.TemporaryDirectory() as scratch:
+        suite = Suite(scratch, args.quick)
+        for group in groups:
+            try:
+                for result in GROUPS[group](suite):
+                    results[result.name] = result
+                    print(f"{result.name:<40} {format_seconds(result.median):>9}/op  (best {format_seconds(result.best)}, {result.ops} ops/round)")
+            except Exception as e:
+                print(f"[Benchmark Error] {group}: {e!r}")
+                errors[group] = repr(e)
+        suite.loop.close()
+
+    if args.output:
+        report = {
+            "meta": {
+                "started": started,
+                "seconds": time.time() - started,
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "quick": args.quick,
+                "errors": errors,
+            },
+            "results": {name: result.to_json() for name, result in results.items()},
+        }
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        print(f"Wrote {len(results)} results to {args.output}")
+
+    regressions = 0
+    if baseline is not None:
+        print(f"\nCompared with {args.compare} (tolerance {args.tolerance:.0%}):")
+        regressions = compare(results, baseline, args.tolerance, args.quick, partial=args.only is not None)
+        print(f"{regressions} regression(s)")
+
+    sys.exit(1 if regressions or errors else 0)
+
+
+if __name__ == "__main__":
+    main()
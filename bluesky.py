@@ -1,58 +1,221 @@
 from domain.post import Post
-from typing import List
+from metrics import metrics
+from recorder import Recorder
+from heuristics import KEYWORDS, SHORTLIST_ACCOUNTS, should_process_post
+from typing import Iterable, List
+from compression import zstd
+from urllib.parse import urlencode
 
 import asyncio
+import os
+import random
+import re
+import time
 import orjson
 import websockets
 
-BLUESKY_WEBSOCKET = "wss://jetstream2.us-east.bsky.network/subscribe?wantedCollections=app.bsky.feed.post"
+BLUESKY_WEBSOCKET = "wss://jetstream2.us-east.bsky.network/subscribe"
+BLUESKY_COLLECTIONS = ["app.bsky.feed.post"]
+
+# Jetstream compresses frames against a custom zstd dictionary, published at
+# https://github.com/bluesky-social/jetstream/blob/main/pkg/models/zstd_dictionary
+JETSTREAM_ZSTD_DICTIONARY = "zstd_dictionary"
+
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+# One in this many frames has its filtering timed, must be a power of two.
+# Frames take microseconds, timing every one would cost more than it tells.
+RELEVANCE_SAMPLE_RATE = 64
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Byte patterns for the cheap first pass over raw frames. Quotes inside post
+# text are always escaped, so these can only match the JSON structure itself.
+CREATE_MARKER = b'"operation":"create"'
+REPLY_MARKER = b'"reply":'
+DID_MARKER = b'"did":"'
+TIME_US_PATTERN = re.compile(rb'"time_us":(\d+)')
+
+SHORTLIST_DIDS = {account.encode() for account in SHORTLIST_ACCOUNTS if account.startswith("did:")}
+
+# Bytes regexes only fold ASCII case, so non-ASCII keywords are matched in
+# their common casings as well. This is a superset check, the exact keyword
+# match happens in `should_process_post` once the frame is decoded.
+KEYWORD_PATTERN = re.compile(
+    b"|".join(sorted({
+        re.escape(variant.encode())
+        for keyword in KEYWORDS
+        for variant in (keyword, keyword.lower(), keyword.upper(), keyword.capitalize())
+    })),
+    re.IGNORECASE
+)
+
 
 def extract_links(data) -> List[str]:
     links = []
-    
+
     try:
         facets = data["commit"]["record"]["facets"]
     except:
         return []
-    
+
     for facet in facets:
         for feature in facet["features"]:
             if feature["$type"] == "app.bsky.richtext.facet#link":
                 links.append(feature["uri"])
-                
+
     return links
 
+def read_time_us(frame: bytes) -> int | None:
+    match = TIME_US_PATTERN.search(frame)
+    return int(match.group(1)) if match else None
+
+def prefilter_frame(frame: bytes) -> bool:
+    """
+    Byte level scan that rejects deletes, updates, replies and frames without
+    any keyword hit before paying for a full JSON decode.
+    Posts from shortlisted accounts always pass.
+    """
+    if CREATE_MARKER not in frame or REPLY_MARKER in frame:
+        return False
+
+    start = frame.find(DID_MARKER)
+    if start != -1:
+        start += len(DID_MARKER)
+        if frame[start:frame.find(b'"', start)] in SHORTLIST_DIDS:
+            return True
+
+    return KEYWORD_PATTERN.search(frame) is not None
+
+def parse_frame(frame: bytes) -> Post | None:
+    """Fully decodes a frame that survived `prefilter_frame` into a Post, if it should be processed."""
+    try:
+        data = orjson.loads(frame)
+        commit = data["commit"]
+        if commit["operation"] != "create" or "reply" in commit["record"]:
+            return None
+
+        did = data["did"]
+        post = Post(
+            f"https://bsky.app/profile/{did}/post/{commit['rkey']}",
+            did,
+            commit["record"]["text"],
+            extract_links(data)
+        )
+    except:
+        return None
+
+    if not should_process_post(post):
+        return None
+
+    return post
+
+def load_zstd_dictionary(path: str) -> zstd.ZstdDict | None:
+    if not os.path.exists(path):
+        print(f"Jetstream zstd dictionary not found at {path}, falling back to uncompressed frames.")
+        return None
+    with open(path, "rb") as f:
+        return zstd.ZstdDict(f.read())
+
+
 class BlueskyClient:
-    def __init__(self, queue: asyncio.Queue[Post]) -> None:
+    def __init__(
+        self,
+        queue: asyncio.Queue[Post],
+        websocket_url: str = BLUESKY_WEBSOCKET,
+        wanted_dids: Iterable[str] | None = None,
+        cursor: int | None = None,
+        compress: bool = False,
+        recorder: Recorder | None = None,
+    ) -> None:
+        """
+        :param queue: The queue posts are pushed onto.
+        :param websocket_url: The Jetstream subscribe endpoint.
+        :param wanted_dids: Only receive posts from these accounts (filtered server side).
+        :param cursor: A `time_us` to resume playback from, that frame included.
+        :param compress: Request zstd compressed frames. It needs the dictionary
+            downloaded to JETSTREAM_ZSTD_DICTIONARY, frames stay uncompressed without it.
+        :param recorder: If given, every frame is recorded, decompressed, for replay.
+        """
         self.queue = queue
-        
+        self.websocket_url = websocket_url
+        self.wanted_dids = list(wanted_dids or [])
+        # The `time_us` the next connection plays back from
+        self.cursor = cursor
+        self.zstd_dict = load_zstd_dictionary(JETSTREAM_ZSTD_DICTIONARY) if compress else None
+        self.recorder = recorder
+
+        # Counted here and read by /metrics, a shared counter would cost more per frame
+        self.frames = 0
+        metrics.register_counter("bluesky_frames", "Jetstream frames received", lambda: {(): self.frames})
+        self.relevance_histogram = metrics.stages["relevance"]
+        self.ingest_histogram = metrics.source_stages["ingest", "bluesky"]
+
+    def get_url(self) -> str:
+        params = [("wantedCollections", collection) for collection in BLUESKY_COLLECTIONS]
+        params += [("wantedDids", did) for did in self.wanted_dids]
+        if self.zstd_dict is not None:
+            params.append(("compress", "true"))
+        if self.cursor is not None:
+            params.append(("cursor", str(self.cursor)))
+        return f"{self.websocket_url}?{urlencode(params)}"
+
     async def listen(self):
-        async with websockets.connect(BLUESKY_WEBSOCKET) as websocket:
-            async for message in websocket:
-                message = await websocket.recv()
-                data = orjson.loads(message)
-                
-                links = extract_links(data)
-                
-                try:
-                    if data["commit"]["operation"] != "create":
-                        continue
-                    if "reply" in data["commit"]["record"]:
-                        continue
-                    
-                    did = data["did"]
-                    rkey = data["commit"]["rkey"]
-                    
-                    post = Post(
-                        f"https://bsky.app/profile/{did}/post/{rkey}",
-                        did,
-                        data["commit"]["record"]["text"],
-                        links
-                    )
-
-                    await self.queue.put(post)
-                except:
-                    continue
+        """
+        Consumes the Jetstream firehose forever, reconnecting with jittered
+        exponential backoff and resuming from the last seen cursor.
+        """
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                async with websockets.connect(self.get_url(), max_size=None) as websocket:
+                    while True:
+                        # decode=False skips the UTF-8 decode, the prefilter works on bytes
+                        message = await websocket.recv(decode=False)
+                        delay = RECONNECT_MIN_DELAY
+                        try:
+                            await self.handle_frame(message)
+                        except Exception as e:
+                            # One bad frame shouldn't cost the connection
+                            metrics.inc("events_failed", "Stream events that couldn't be handled", source="bluesky")
+                            print(f"[Bluesky Error] bad frame: {e}")
+            except Exception as e:
+                print(f"[Bluesky Error]: {e}")
+
+            sleep_for = random.uniform(0, delay)
+            print(f"Bluesky disconnected, reconnecting in {sleep_for:.1f}s from cursor {self.cursor}")
+            await asyncio.sleep(sleep_for)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def handle_frame(self, message: bytes):
+        if self.zstd_dict is not None and message.startswith(ZSTD_MAGIC):
+            message = zstd.decompress(message, zstd_dict=self.zstd_dict)
+        if self.recorder is not None:
+            self.recorder.record("bluesky", message)
+
+        time_us = read_time_us(message)
+        if time_us is not None:
+            # Playback includes the cursor's own frame, resume after the one we have
+            self.cursor = time_us + 1
+
+        self.frames += 1
+        if not self.frames & (RELEVANCE_SAMPLE_RATE - 1):
+            start = time.perf_counter_ns()
+            passed = prefilter_frame(message)
+            self.relevance_histogram.record_ns(time.perf_counter_ns() - start)
+        else:
+            passed = prefilter_frame(message)
+        if not passed:
+            return
+
+        start = time.perf_counter_ns()
+        post = parse_frame(message)
+        if post is not None:
+            post.source = "bluesky"
+            metrics.inc("posts_ingested", "Posts queued for processing", source="bluesky")
+            await self.queue.put(post)
+            self.ingest_histogram.record_ns(time.perf_counter_ns() - start)
 
 
 async def main():
@@ -0,0 +1,104 @@
+"""
+Long documents embedded as overlapping windows.
+
+RSS items carry the full rendered page, tens of thousands of characters for
+a filing or a press release. Sent whole they're cut off at the model's
+input limit and take as long as their length. Instead a document longer
+than CHUNK_THRESHOLD is split into windows of CHUNK_SIZE characters that
+overlap by CHUNK_OVERLAP, ending at whitespace where there is some. At
+most MAX_CHUNKS are kept, spread evenly over the document, so every
+document costs one batched request of bounded size.
+
+That bound is a sample, not a cover. A document of more than MAX_CHUNKS
+windows, about 27,000 characters at the defaults, has gaps between the
+windows kept, and what's in a gap is never embedded: it weighs nothing in
+the pooled vector and no chunk search can find it. Raise MAX_CHUNKS for
+sources whose long documents bury what matters mid-page.
+
+The window vectors are pooled into the one vector that classifies the
+document. "mean" averages them. "attention" weighs each window by a softmax
+of its similarity to that average, so the windows on the document's main
+subject outweigh navigation, legal boilerplate and other passages that
+stray from it. The window vectors themselves are kept as well, a search can
+then point at the passage that matched.
+"""
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+from numpy import float64
+from numpy.typing import NDArray
+
+# Documents longer than this many characters are chunked, None embeds everything whole
+CHUNK_THRESHOLD: int | None = 4000
+# About 500 tokens, well inside the embedding model's input limit
+CHUNK_SIZE = 2000
+CHUNK_OVERLAP = 300
+# Windows embedded per document, all in one request. Longer documents are
+# sampled, the text between the windows kept isn't embedded at all
+MAX_CHUNKS = 16
+# How far back from a window's end to look for whitespace to end it at
+BOUNDARY_SLACK = 200
+
+# "mean" or "attention"
+CHUNK_POOLING = "mean"
+# Lower makes attention pooling favour the windows closest to the average more sharply
+ATTENTION_TEMPERATURE = 0.05
+
+
+@dataclass
+class Chunk:
+    # Character offsets of the window in the cleaned document
+    start: int
+    end: int
+    text: str
+    embedding: NDArray[float64]
+
+
+@dataclass
+class DocumentEmbedding:
+    embedding: NDArray[float64]
+    # Empty for a document embedded whole
+    chunks: List[Chunk]
+
+
+def split_chunks(text: str, size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP, max_chunks: int = MAX_CHUNKS) -> List[tuple[int, int]]:
+    """
+    The (start, end) offsets of the overlapping windows of `text`, at most
+    `max_chunks` of them, picked evenly from first to last when there are more.
+    The windows picked then no longer overlap, nor cover the text between them.
+    """
+    windows = []
+    start = 0
+    while True:
+        end = min(start + size, len(text))
+        if end < len(text):
+            # Don't cut a word in half if there's a space to end at instead
+            space = text.rfind(" ", end - BOUNDARY_SLACK, end)
+            if space > start:
+                end = space
+        windows.append((start, end))
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+        # Start the next window on a word too
+        space = text.find(" ", start, start + BOUNDARY_SLACK)
+        if space != -1 and space + 1 < end:
+            start = space + 1
+
+    if len(windows) > max_chunks:
+        picks = np.linspace(0, len(windows) - 1, max_chunks).round().astype(int)
+        windows = [windows[i] for i in picks]
+    return windows
+
+def pool(embeddings: NDArray[float64], pooling: str = CHUNK_POOLING) -> NDArray[float64]:
+    """One unit vector for the document out of its windows' unit vectors, the rows of `embeddings`."""
+    mean = embeddings.mean(axis=0)
+    if pooling == "attention":
+        mean /= max(np.linalg.norm(mean), 1e-12)
+        scores = embeddings @ mean / ATTENTION_TEMPERATURE
+        weights = np.exp(scores - scores.max())
+        mean = (weights / weights.sum()) @ embeddings
+    elif pooling != "mean":
+        raise ValueError(f"Unknown pooling {pooling!r}, expected 'mean' or 'attention'")
+    return mean / max(np.linalg.norm(mean), 1e-12)
@@ -0,0 +1,180 @@
+"""
+Live state pushed to dashboard viewers.
+
+The pipeline publishes signals, decisions and price bars here as they
+happen. Every message is serialized once into a shared ring buffer that
+all viewers read from with their own cursor, and the snapshot a new viewer
+starts from is built at most once per change, so the work per update does
+not depend on how many dashboards are open.
+
+Signals are kept as BUY/SELL/HOLD counts per SIGNAL_BUCKET, not one by one,
+so the memory held and the snapshot sent stay the same size however busy
+the firehose is. Event ids are "<boot>-<seq>": a browser's id from before a
+restart doesn't match the boot and gets a fresh snapshot.
+"""
+from collections import deque
+from typing import Deque, Dict, List
+
+import asyncio
+import time
+import orjson
+
+# How much history the snapshot covers
+FEED_WINDOW = 24 * 60 * 60
+# Messages kept for viewers catching up, one that falls further behind gets a new snapshot
+FEED_BUFFER_SIZE = 1000
+MAX_DECISIONS = 100
+# Seconds of signals counted together, fine enough for the dashboard's one hour breakdown
+SIGNAL_BUCKET = 60
+SIGNALS = ["BUY", "SELL", "HOLD"]
+
+# Comment lines sent on a quiet stream so proxies don't drop the connection
+HEARTBEAT_INTERVAL = 15
+
+# The ticker whose one-minute bars are charted
+PRICE_TICKER = "SI=F"
+
+
+class DashboardFeed:
+    def __init__(self, window: int = FEED_WINDOW, buffer_size: int = FEED_BUFFER_SIZE) -> None:
+        """
+        :param window: Seconds of signals and prices included in a snapshot.
+        :param buffer_size: Serialized messages kept for viewers that fall behind.
+        """
+        self.window = window
+        # Bucket start in ms -> [buy, sell, hold] counts, oldest first
+        self.signals: Dict[int, List[int]] = {}
+        # [timestamp_ms, close] pairs, oldest first
+        self.prices: Deque[list] = deque()
+        self.decisions: Deque[dict] = deque(maxlen=MAX_DECISIONS)
+
+        # Tells this process's sequence numbers from those of any before it
+        self.boot = time.time_ns() // 1000
+        self.seq = 0
+        self.buffer: Deque[tuple[int, bytes]] = deque(maxlen=buffer_size)
+        self.changed = asyncio.Event()
+        self._snapshot: bytes | None = None
+
+    def load_signals(self, signals: List[tuple[int, str]]):
+        """Seeds the signal history from (added, signal) rows of the database, before anything is published."""
+        for added, signal in sorted(signals):
+            self._count(added, signal)
+        self._snapshot = None
+
+    def publish_signal(self, signal: str, added: float | None = None):
+        bucket, counts = self._count(time.time() if added is None else added, signal)
+        # The bucket's whole count, so a message seen twice changes nothing
+        self._publish({"type": "signal", "time": bucket, "counts": counts})
+
+    def publish_decision(self, asset: str, decision: str, score: float):
+        entry = {"time": int(time.time() * 1000), "asset": asset, "decision": decision, "score": round(score, 3)}
+        self.decisions.append(entry)
+        self._publish({"type": "decision", **entry})
+
+    def publish_prices(self, bars: List[list]):
+        """Adds [timestamp_ms, close] bars, ignoring any not newer than the last one published."""
+        last = self.prices[-1][0] if self.prices else -1
+        new = [bar for bar in bars if bar[0] > last]
+        if not new:
+            return
+        self.prices.extend(new)
+        self._publish({"type": "prices", "bars": new})
+
+    def snapshot(self) -> tuple[int, bytes]:
+        """The full state as one serialized message, rebuilt only after something changed."""
+        if self._snapshot is None:
+            self._trim()
+            self._snapshot = orjson.dumps({
+                "type": "snapshot",
+                "signals": [[bucket, *counts] for bucket, counts in self.signals.items()],
+                "prices": list(self.prices),
+                "decisions": list(self.decisions),
+            })
+        return self.seq, self._snapshot
+
+    def since(self, seq: int) -> List[tuple[int, bytes]] | None:
+        """Messages after `seq`, or None if some were already dropped from the buffer."""
+        if seq >= self.seq:
+            return []
+        if not self.buffer or self.buffer[0][0] > seq + 1:
+            return None
+        return [(message_seq, message) for message_seq, message in self.buffer if message_seq > seq]
+
+    async def wait(self, seq: int, timeout: float) -> bool:
+        """Waits until there is something after `seq`. Returns False on timeout."""
+        while self.seq <= seq:
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except TimeoutError:
+                return False
+        return True
+
+    def resume_point(self, last_event_id: str | None) -> int | None:
+        """The sequence number a browser's Last-Event-ID resumes from, None if it's not one of this process's."""
+        boot, _, seq = (last_event_id or "").partition("-")
+        if boot != str(self.boot) or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        return int(seq)
+
+    async def stream(self, last_event_id: str | None = None):
+        """
+        Server-sent events for one viewer: a snapshot, unless `last_event_id`
+        can be resumed from the buffer, then every delta as it's published.
+        """
+        last_seq = self.resume_point(last_event_id)
+        messages = self.since(last_seq) if last_seq is not None else None
+        if messages is None:
+            seq, snapshot = self.snapshot()
+            yield self._event(seq, snapshot)
+        else:
+            seq = last_seq
+
+        while True:
+            messages = self.since(seq)
+            if messages is None:
+                # Fell too far behind, start over from the current state
+                seq, snapshot = self.snapshot()
+                yield self._event(seq, snapshot)
+                continue
+
+            for seq, message in messages:
+                yield self._event(seq, message)
+
+            if not await self.wait(seq, HEARTBEAT_INTERVAL):
+                yield b": heartbeat\n\n"
+
+    def _publish(self, message: dict):
+        self.seq += 1
+        self.buffer.append((self.seq, orjson.dumps({**message, "seq": self.seq})))
+        self._snapshot = None
+        self._trim()
+
+        # Wake every waiting viewer at once, then arm a fresh event for the next change
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def _count(self, added: float, signal: str) -> tuple[int, List[int]]:
+        """Counts one signal into its bucket. Returns the bucket and its counts."""
+        bucket = int(added) // SIGNAL_BUCKET * SIGNAL_BUCKET * 1000
+        counts = self.signals.get(bucket)
+        if counts is None:
+            counts = self.signals[bucket] = [0] * len(SIGNALS)
+        counts[SIGNALS.index(signal)] += 1
+        return bucket, counts
+
+    def _trim(self):
+        cutoff = (time.time() - self.window) * 1000
+        while self.prices and self.prices[0][0] < cutoff:
+            self.prices.popleft()
+        # Buckets are created in time order, the oldest come first
+        while self.signals:
+            oldest = next(iter(self.signals))
+            if oldest + SIGNAL_BUCKET * 1000 > cutoff:
+                break
+            del self.signals[oldest]
+
+    def _event(self, seq: int, data: bytes) -> bytes:
+        return b"id: %d-%d\ndata: %s\n\n" % (self.boot, seq, data)
+
+
+feed = DashboardFeed()
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, Iterator, List
 import orjson
 import sqlite3
 import importlib.resources
@@ -6,8 +6,34 @@ import numpy as np
 from numpy import float64
 from numpy.typing import NDArray
 import time
+import pathlib
+import queue
+import threading
+from contextlib import contextmanager
 from env import DB_NAME, GEMINI_EMBEDDING_LENGTH
 from dataclasses import dataclass
+from chunking import Chunk
+
+# Quantized codes of the searched embeddings are kept in a narrow
+# `<table>_codes` side table keyed by rowid, so similarity searches can do a
+# coarse scan over far fewer bytes, never touching the wide rows, before an
+# exact rerank. "int8" is 4x smaller with a per-vector scale, "binary" is 32x
+# smaller and compared by Hamming distance. None searches the float vectors directly.
+EMBEDDING_QUANTIZATION: str | None = "int8"
+# Coarse candidates kept per requested result for the exact rerank
+RERANK_FACTOR = 4
+# The tables similarity searches scan, each with a side table of codes
+QUANTIZED_TABLES = ["intelligence", "events", "document_chunks"]
+QUANTIZE_CHUNK_SIZE = 1000
+
+# Intelligence is searched in day sized time buckets. Closed days are compacted
+# into a single shard row so a search only reads the buckets in its window.
+SHARD_SECONDS = 24 * 60 * 60
+
+# Rows fetched from SQLite at a time while streaming a page
+PAGE_FETCH_SIZE = 100
+# The cursor that sorts after every row, to start from the newest
+FIRST_PAGE = (2 ** 63 - 1, 2 ** 63 - 1)
 
 
 @dataclass
@@ -34,6 +60,16 @@ class EventRow:
     added: int
     last_updated: int
 
+@dataclass
+class OutboxAlertRow:
+    id: int
+    title: str
+    url: str
+    content: str
+    attempts: int
+    created: int
+    event: int | None
+
 @dataclass
 class HistoricalSignalRow:
     url: str
@@ -41,66 +77,423 @@ class HistoricalSignalRow:
     signal: str
     added: int
 
+@dataclass
+class DocumentChunkRow:
+    url: str
+    chunk: int
+    content: str
+    embedding: NDArray[float64]
+    added: int
+
+
+## MIGRATIONS
+# Each migration moves the schema up one `PRAGMA user_version`. They are
+# written to also apply cleanly to databases created before versioning.
+
+def _create_tables(c: sqlite3.Cursor):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS rss (
+            source TEXT,
+            id TEXT,
+            added DATETIME DEFAULT (unixepoch()),
+            PRIMARY KEY (source, id)
+        );
+    """)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS intelligence (
+            url TEXT PRIMARY KEY,
+            content TEXT,
+            embedding BLOB,
+            event INTEGER,
+            added INTEGER DEFAULT (unixepoch()),
+            last_updated DATETIME DEFAULT (unixepoch())
+        )
+    """)
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY,
+            summary TEXT,
+            embedding BLOB,
+            signal INTEGER,
+            alerted INTEGER DEFAULT FALSE,
+            added INTEGER DEFAULT (unixepoch()),
+            last_updated DATETIME DEFAULT (unixepoch())
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alert ON events (signal, alerted)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_last_updated ON events (last_updated)")
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS historical_signals (
+            url TEXT PRIMARY KEY,
+            embedding BLOB,
+            signal TEXT,
+            added INTEGER DEFAULT (unixepoch())
+        )
+    """)
+
+def _create_code_table(c: sqlite3.Cursor, table: str):
+    c.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table}_codes (
+            id INTEGER PRIMARY KEY,
+            code BLOB,
+            scale REAL
+        )
+    """)
+    # A row's code goes with it, whoever deletes the row
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_codes_delete AFTER DELETE ON {table}
+        BEGIN
+            DELETE FROM {table}_codes WHERE id = old.rowid;
+        END
+    """)
+
+def _add_quantized_codes(c: sqlite3.Cursor):
+    # In narrow side tables, codes trailing the embedding and content blobs
+    # would make a scan of them read every overflow page, no fewer bytes than
+    # the floats. Signals are never searched by similarity and have none.
+    for table in ["intelligence", "events"]:
+        _create_code_table(c, table)
+
+def _add_intelligence_shards(c: sqlite3.Cursor):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_intelligence_last_updated ON intelligence (last_updated)")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS intelligence_shards (
+            day INTEGER PRIMARY KEY,
+            rowids BLOB,
+            timestamps BLOB,
+            codes BLOB,
+            quantization TEXT
+        )
+    """)
+
+def _add_hot_query_indexes(c: sqlite3.Cursor):
+    # get_signal_labels_since reads only these two columns, so the index covers it
+    c.execute("CREATE INDEX IF NOT EXISTS idx_signals_added ON historical_signals (added, signal)")
+    # get_event_intelligence
+    c.execute("CREATE INDEX IF NOT EXISTS idx_intelligence_event ON intelligence (event)")
+    # get_alertable_events: equality on alerted first, then the range on signal
+    c.execute("DROP INDEX IF EXISTS idx_alert")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_events_alertable ON events (alerted, signal)")
+
+def _add_signal_labels(c: sqlite3.Cursor):
+    # Labels from each anchor set / threshold, NULL label_version is the live classifier
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS signal_labels (
+            version TEXT,
+            url TEXT,
+            signal TEXT,
+            PRIMARY KEY (version, url)
+        ) WITHOUT ROWID
+    """)
+    # Retention deletes a signal's labels by url, whatever their version
+    c.execute("CREATE INDEX IF NOT EXISTS idx_signal_labels_url ON signal_labels (url)")
+    c.execute("ALTER TABLE historical_signals ADD COLUMN label_version TEXT")
+
+def _add_alert_outbox(c: sqlite3.Cursor):
+    # Alerts wait here until the webhook accepts them, so none are lost on restart
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS alert_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            url TEXT NOT NULL,
+            content TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt INTEGER NOT NULL DEFAULT 0,
+            created INTEGER DEFAULT (unixepoch())
+        )
+    """)
+
+def _add_event_alerts(c: sqlite3.Cursor):
+    # events.signal counts the directional posts corroborating an event, broken down here per asset
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS event_signals (
+            event INTEGER,
+            asset TEXT,
+            signal TEXT,
+            posts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (event, asset, signal)
+        ) WITHOUT ROWID
+    """)
+    # The webhook message each alerted event was posted as, so updates can edit it
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS event_alert_messages (
+            event INTEGER PRIMARY KEY,
+            message_id TEXT NOT NULL
+        )
+    """)
+    c.execute("ALTER TABLE alert_outbox ADD COLUMN event INTEGER")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alert_outbox_event ON alert_outbox (event)")
+
+def _add_price_bars(c: sqlite3.Cursor):
+    # Local price history per ticker at each resolution, time is the bar's start in epoch seconds
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS price_bars (
+            ticker TEXT,
+            resolution TEXT,
+            time INTEGER,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume REAL,
+            PRIMARY KEY (ticker, resolution, time)
+        ) WITHOUT ROWID
+    """)
+
+def _add_document_chunks(c: sqlite3.Cursor):
+    # The windows long documents were embedded as, `chunk` numbers them in order
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS document_chunks (
+            url TEXT,
+            chunk INTEGER,
+            content TEXT,
+            embedding BLOB,
+            added INTEGER DEFAULT (unixepoch()),
+            PRIMARY KEY (url, chunk)
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_document_chunks_added ON document_chunks (added)")
+    _create_code_table(c, "document_chunks")
+
+def _add_meta(c: sqlite3.Cursor):
+    # Settings the stored data was last prepared for, by name
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    """)
+
+def _add_duplicates(c: sqlite3.Cursor):
+    # Near-duplicates attached to the first copy of a story instead of being processed
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS duplicates (
+            url TEXT PRIMARY KEY,
+            original TEXT,
+            source TEXT,
+            added INTEGER DEFAULT (unixepoch())
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_original ON duplicates (original)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_added ON duplicates (added)")
+
+MIGRATIONS = [
+    _create_tables,
+    _add_quantized_codes,
+    _add_intelligence_shards,
+    _add_hot_query_indexes,
+    _add_signal_labels,
+    _add_alert_outbox,
+    _add_event_alerts,
+    _add_price_bars,
+    _add_document_chunks,
+    _add_meta,
+    _add_duplicates,
+]
+
+VECTOR_TABLES = ["intelligence", "events", "historical_signals", "document_chunks"]
+
 
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(DB_NAME)
+    def __init__(self, read_only: bool = False):
+        """
+        :param read_only: Open a connection that can only read, for queries
+            that must never hold up the writer. It may be used from any thread,
+            but by one at a time. The writer has to have brought the schema
+            up to date first.
+        """
+        self.read_only = read_only
+        if read_only:
+            uri = pathlib.Path(DB_NAME).absolute().as_uri() + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(MIGRATIONS):
+                self.conn.close()
+                raise RuntimeError(f"{DB_NAME} is at schema version {version} of {len(MIGRATIONS)}, open it for writing first")
+        else:
+            self.conn = sqlite3.connect(DB_NAME)
         self.conn.row_factory = sqlite3.Row
 
         vector_ext_path = importlib.resources.files("sqlite_vector.binaries") / "vector"
         self.conn.enable_load_extension(True)
         self.conn.load_extension(str(vector_ext_path))
         self.conn.enable_load_extension(False)
-        
+
         c = self.conn.cursor()
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS rss (
-                source TEXT,
-                id TEXT,
-                added DATETIME DEFAULT (unixepoch()),
-                PRIMARY KEY (source, id)
-            );
-        """)
+        if not read_only:
+            # Readers see a snapshot and never block the writer, nor it them
+            c.execute("PRAGMA journal_mode=WAL").fetchall()
+            self._migrate()
 
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS intelligence (
-                url TEXT PRIMARY KEY,
-                content TEXT,
-                embedding BLOB,
-                event INTEGER,
-                added INTEGER DEFAULT (unixepoch()),
-                last_updated DATETIME DEFAULT (unixepoch())
-            )
-        """)
-        c.execute(f"SELECT vector_init('intelligence', 'embedding', 'dimension={GEMINI_EMBEDDING_LENGTH},type=FLOAT32,distance=cosine')")
+        # Vector contexts live on the connection, not in the schema
+        for table in VECTOR_TABLES:
+            c.execute(f"SELECT vector_init('{table}', 'embedding', 'dimension={GEMINI_EMBEDDING_LENGTH},type=FLOAT32,distance=cosine')")
+        if read_only:
+            return
 
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS events (
-                id INTEGER PRIMARY KEY,
-                summary TEXT,
-                embedding BLOB,
-                signal INTEGER,
-                alerted INTEGER DEFAULT FALSE,
-                added INTEGER DEFAULT (unixepoch()),
-                last_updated DATETIME DEFAULT (unixepoch())
+        self._requantize()
+
+
+    def _migrate(self):
+        """Brings the schema up to date, doing nothing if `user_version` is already current."""
+        c = self.conn.cursor()
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        if version >= len(MIGRATIONS):
+            return
+
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            print(f"Migrating database to version {number}")
+            migration(c)
+            c.execute(f"PRAGMA user_version = {number}")
+            self.conn.commit()
+
+
+    ## QUANTIZATION
+
+    def _requantize(self):
+        """
+        Brings the codes and shards in line with EMBEDDING_QUANTIZATION, only
+        when it or the schema changed since the last time.
+        """
+        c = self.conn.cursor()
+        prepared = f"{len(MIGRATIONS)}:{_shard_quantization()}"
+        c.execute("SELECT value FROM meta WHERE key = 'quantization'")
+        row = c.fetchone()
+        if row is not None and row[0] == prepared:
+            return
+
+        # Shards packed under another quantization get rebuilt on the next search
+        c.execute("DELETE FROM intelligence_shards WHERE quantization != ?", (_shard_quantization(), ))
+        self.conn.commit()
+
+        if EMBEDDING_QUANTIZATION is not None:
+            for table in QUANTIZED_TABLES:
+                self.quantize_existing(table)
+
+        # Only once it's all done, an interrupted run starts over next time
+        c.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('quantization', ?)", (prepared, ))
+        self.conn.commit()
+
+    def quantize_existing(self, table: str):
+        """
+        Writes codes for every row whose code is missing or was made with a
+        different quantization, in chunks so memory stays bounded.
+        """
+        c = self.conn.cursor()
+        code_length = _code_length()
+        total = 0
+        while True:
+            c.execute(f"""
+                SELECT t.rowid, t.embedding
+                FROM {table} t LEFT JOIN {table}_codes k ON k.id = t.rowid
+                WHERE t.embedding IS NOT NULL AND (k.code IS NULL OR length(k.code) != ?)
+                LIMIT ?""",
+                (code_length, QUANTIZE_CHUNK_SIZE)
             )
-        """)
-        c.execute("CREATE INDEX IF NOT EXISTS idx_alert ON events (signal, alerted)")
-        c.execute("CREATE INDEX IF NOT EXISTS idx_last_updated ON events (last_updated)")
-        c.execute(f"SELECT vector_init('events', 'embedding', 'dimension={GEMINI_EMBEDDING_LENGTH},type=FLOAT32,distance=cosine')")
+            rows = c.fetchall()
+            if not rows:
+                break
 
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS historical_signals (
-                url TEXT PRIMARY KEY,
-                embedding BLOB,
-                signal TEXT,
-                added INTEGER DEFAULT (unixepoch())
+            updates = []
+            for rowid, embedding in rows:
+                code, scale = quantize_embedding(np.frombuffer(embedding, dtype=np.float32))
+                updates.append((rowid, code, scale))
+            c.executemany(f"INSERT OR REPLACE INTO {table}_codes (id, code, scale) VALUES (?, ?, ?)", updates)
+            self.conn.commit()
+            total += len(rows)
+
+        if total:
+            print(f"Quantized {total} existing {table} embeddings as {EMBEDDING_QUANTIZATION}")
+
+    def _quantized_search(self, table: str, embedding: NDArray[float64], amount: int, where: str | None = None, params: tuple = ()) -> List[tuple[sqlite3.Row, float]]:
+        """
+        Two stage similarity search: a coarse scan over the quantized codes,
+        then an exact rerank. Returns rows with their cosine distance, closest first.
+
+        :param where: Only search the rows of `table` (as `t`) matching this, the whole table if not given.
+        :param params: The parameters of `where`.
+        """
+        c = self.conn.cursor()
+        if where is None:
+            c.execute(
+                f"SELECT id, code FROM {table}_codes WHERE length(code) = ?",
+                (_code_length(), )
             )
-        """)
-        c.execute(f"SELECT vector_init('historical_signals', 'embedding', 'dimension={GEMINI_EMBEDDING_LENGTH},type=FLOAT32,distance=cosine')")
+        else:
+            c.execute(_coarse_scan(table, where), params)
+        coarse = c.fetchall()
+        if not coarse:
+            return []
+
+        query = embedding.astype(np.float32)
+        rowids = np.array([row[0] for row in coarse], dtype=np.int64)
+        distances = _coarse_distances(_to_code_matrix([row[1] for row in coarse]), query)
+        return self._rerank(table, rowids, distances, query, amount)
 
+    def _rerank(self, table: str, rowids: NDArray, distances: NDArray, query: NDArray, amount: int) -> List[tuple[sqlite3.Row, float]]:
+        """Exact cosine rerank of the best `amount * RERANK_FACTOR` coarse candidates."""
+        keep = min(len(rowids), amount * RERANK_FACTOR)
+        candidates = rowids[np.argpartition(distances, keep - 1)[:keep]].tolist()
+
+        c = self.conn.cursor()
+        c.execute(
+            f"SELECT rowid, * FROM {table} WHERE rowid IN ({','.join('?' * len(candidates))})",
+            candidates
+        )
+        # Candidates from a shard can outlive their rows, archived since it was packed
+        rows = c.fetchall()
+        if not rows:
+            return []
+        vectors = np.stack([np.frombuffer(row["embedding"], dtype=np.float32) for row in rows])
+        exact = 1 - (vectors @ query) / np.maximum(np.linalg.norm(vectors, axis=1) * np.linalg.norm(query), 1e-12)
+
+        return [(rows[i], float(exact[i])) for i in np.argsort(exact)[:amount]]
+
+
+    ## INTELLIGENCE SHARDS
+
+    def compact_intelligence_shards(self):
+        """
+        Packs every closed day of intelligence into one shard row holding its
+        rowids, timestamps and codes, so scanning that day reads a single blob.
+        """
+        c = self.conn.cursor()
+        today = int(time.time()) // SHARD_SECONDS
+        compacted_until = self._compacted_until()
+
+        c.execute("SELECT MIN(last_updated) FROM intelligence WHERE last_updated >= ?", (compacted_until * SHARD_SECONDS, ))
+        first = c.fetchone()[0]
+        if first is None:
+            return
+
+        for day in range(max(compacted_until, first // SHARD_SECONDS), today):
+            c.execute(
+                _coarse_scan("intelligence", "t.last_updated >= ? AND t.last_updated < ?", "t.last_updated"),
+                (day * SHARD_SECONDS, (day + 1) * SHARD_SECONDS)
+            )
+            rows = c.fetchall()
+            c.execute(
+                "INSERT OR REPLACE INTO intelligence_shards (day, rowids, timestamps, codes, quantization) VALUES (?, ?, ?, ?, ?)",
+                (
+                    day,
+                    np.array([row[0] for row in rows], dtype=np.int64).tobytes(),
+                    np.array([row[2] for row in rows], dtype=np.int64).tobytes(),
+                    b"".join(row[1] for row in rows),
+                    _shard_quantization(),
+                )
+            )
         self.conn.commit()
 
+    def _compacted_until(self) -> int:
+        """The first day that hasn't been compacted into a shard."""
+        c = self.conn.cursor()
+        c.execute("SELECT MAX(day) FROM intelligence_shards")
+        last = c.fetchone()[0]
+        return 0 if last is None else last + 1
+
 
     ## RSS ITEMS
 
@@ -122,6 +515,28 @@ class Database:
         return bool(c.fetchone()[0])
     
 
+    ## DUPLICATES
+
+    def add_duplicate(self, original: str, url: str, source: str):
+        """Records the post at `url` as a near-duplicate of the one at `original`."""
+        c = self.conn.cursor()
+        c.execute("""
+            INSERT OR IGNORE INTO duplicates (url, original, source)
+            VALUES (?, ?, ?)""",
+            (url, original, source)
+        )
+        self.conn.commit()
+
+    def get_duplicates(self, original: str) -> List[str]:
+        """The urls of the near-duplicates attached to `original`, oldest first."""
+        c = self.conn.cursor()
+        c.execute(
+            "SELECT url FROM duplicates WHERE original = ? ORDER BY added, rowid",
+            (original, )
+        )
+        return [row[0] for row in c.fetchall()]
+
+
     ## HISTORICAL SIGNALS
 
     def add_historical_signal(self, url: str, embedding: NDArray[float64], signal: str):
@@ -141,6 +556,8 @@ class Database:
             VALUES (?, ?, vector_as_f32(?))""",
             (url, content, embedding.astype('float32').tobytes())
         )
+        if c.rowcount:
+            _write_code(c, "intelligence", c.lastrowid, embedding)
         self.conn.commit()
 
     def set_intelligence_event(self, url: str, event_id: int):
@@ -161,6 +578,31 @@ class Database:
 
         return [_to_intelligence_row(row) for row in c.fetchall()]
 
+    def iter_intelligence_page(self, before: tuple[int, int], limit: int, min_timestamp: int = 0, event: int | None = None) -> Iterator[tuple[IntelligenceRow, int]]:
+        """
+        Intelligence newest first by (last_updated, rowid), starting after the
+        keyset cursor `before`, with the last_updated of each row. Pass
+        FIRST_PAGE for the first page.
+        """
+        c = self.conn.cursor()
+        c.execute(f"""
+            SELECT rowid, *
+            FROM intelligence
+            WHERE last_updated > ? AND (last_updated, rowid) < (?, ?) {"AND event = ?" if event is not None else ""}
+            ORDER BY last_updated DESC, rowid DESC
+            LIMIT ?""",
+            (min_timestamp, *before, *([event] if event is not None else []), limit)
+        )
+        while rows := c.fetchmany(PAGE_FETCH_SIZE):
+            for row in rows:
+                yield _to_intelligence_row(row), row["last_updated"]
+
+    def get_intelligence_by_url(self, url: str) -> IntelligenceRow | None:
+        c = self.conn.cursor()
+        c.execute("SELECT rowid, * FROM intelligence WHERE url = ?", (url, ))
+        row = c.fetchone()
+        return _to_intelligence_row(row) if row is not None else None
+
     def get_all_embeddings(self) -> List[IntelligenceRow]:
         c = self.conn.cursor()
         c.execute("SELECT rowid, * FROM intelligence")
@@ -168,19 +610,180 @@ class Database:
     
 
     def get_closest_intelligence(self, embedding: NDArray[float64], amount: float, min_timestamp: int) -> List[tuple[IntelligenceRow, float]]:
+        """
+        Finds the intelligence closest to `embedding` updated after `min_timestamp`.
+        Only shards and rows inside the window are scanned.
+        """
+        # A reader can't compact, the open day scan still covers whatever isn't yet
+        if not self.read_only:
+            self.compact_intelligence_shards()
+
         c = self.conn.cursor()
-        c.execute("""
-            SELECT
-                intelligence.rowid,
-                intelligence.*,
-                v.distance
-            FROM vector_full_scan('intelligence', 'embedding', vector_as_f32(?), ?) as v
-            JOIN intelligence ON intelligence.rowid = v.rowid
-            WHERE intelligence.last_updated > ?
-            """,
-            (embedding.astype('float32').tobytes(), amount, min_timestamp)
+        query = embedding.astype(np.float32)
+        rowids = []
+        distances = []
+
+        # Closed days, one packed blob each
+        c.execute("SELECT rowids, timestamps, codes FROM intelligence_shards WHERE day >= ?", (min_timestamp // SHARD_SECONDS, ))
+        for shard in c.fetchall():
+            shard_rowids = np.frombuffer(shard["rowids"], dtype=np.int64)
+            if not len(shard_rowids):
+                continue
+            in_window = np.frombuffer(shard["timestamps"], dtype=np.int64) > min_timestamp
+            codes = np.frombuffer(shard["codes"], dtype=_code_dtype()).reshape(len(shard_rowids), -1)
+            rowids.append(shard_rowids[in_window])
+            distances.append(_coarse_distances(codes[in_window], query))
+
+        # The open day, rowids from the last_updated index and their codes by key
+        c.execute(
+            _coarse_scan("intelligence", "t.last_updated > ? AND t.last_updated >= ?"),
+            (min_timestamp, self._compacted_until() * SHARD_SECONDS)
         )
-        return [(_to_intelligence_row(row), row["distance"]) for row in c.fetchall()]
+        recent = c.fetchall()
+        if recent:
+            rowids.append(np.array([row[0] for row in recent], dtype=np.int64))
+            distances.append(_coarse_distances(_to_code_matrix([row[1] for row in recent]), query))
+
+        if not rowids or not sum(len(r) for r in rowids):
+            return []
+
+        rows = self._rerank("intelligence", np.concatenate(rowids), np.concatenate(distances), query, int(amount))
+        return [(_to_intelligence_row(row), distance) for row, distance in rows]
+
+
+    ## DOCUMENT CHUNKS
+
+    def add_document_chunks(self, url: str, chunks: List[Chunk]):
+        c = self.conn.cursor()
+        for i, chunk in enumerate(chunks):
+            c.execute("""
+                INSERT OR IGNORE INTO document_chunks (url, chunk, content, embedding)
+                VALUES (?, ?, ?, vector_as_f32(?))""",
+                (url, i, chunk.text, chunk.embedding.astype('float32').tobytes())
+            )
+            if c.rowcount:
+                _write_code(c, "document_chunks", c.lastrowid, chunk.embedding)
+        self.conn.commit()
+
+    def get_closest_chunks(self, embedding: NDArray[float64], amount: int, min_timestamp: int = 0) -> List[tuple[DocumentChunkRow, float]]:
+        """The passages of long documents closest to `embedding`, added after `min_timestamp`."""
+        rows = self._quantized_search("document_chunks", embedding, amount, "t.added > ?", (min_timestamp, ))
+        return [(_to_document_chunk_row(row), distance) for row, distance in rows]
+
+    def get_best_chunks(self, urls: List[str], embedding: NDArray[float64]) -> Dict[str, tuple[DocumentChunkRow, float]]:
+        """The passage of each chunked document in `urls` closest to `embedding`, with its cosine distance."""
+        if not urls:
+            return {}
+        c = self.conn.cursor()
+        c.execute(
+            f"SELECT * FROM document_chunks WHERE url IN ({','.join('?' * len(urls))})",
+            urls
+        )
+        best: Dict[str, tuple[DocumentChunkRow, float]] = {}
+        query = embedding.astype(np.float32)
+        query_norm = max(float(np.linalg.norm(query)), 1e-12)
+        for row in c.fetchall():
+            chunk = _to_document_chunk_row(row)
+            distance = 1 - float(chunk.embedding @ query) / max(float(np.linalg.norm(chunk.embedding)) * query_norm, 1e-12)
+            if chunk.url not in best or distance < best[chunk.url][1]:
+                best[chunk.url] = (chunk, distance)
+        return best
+
+
+    ## PRICE BARS
+
+    def upsert_price_bars(self, ticker: str, resolution: str, bars: List[tuple[int, float, float, float, float, float]]):
+        """Writes (time, open, high, low, close, volume) bars, replacing any still-forming bar at the same time."""
+        c = self.conn.cursor()
+        c.executemany(
+            "INSERT OR REPLACE INTO price_bars (ticker, resolution, time, open, high, low, close, volume) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(ticker, resolution, *bar) for bar in bars]
+        )
+        self.conn.commit()
+
+    def get_price_closes(self, ticker: str, resolution: str, start: int, end: int) -> tuple[NDArray[np.int64], NDArray[np.float64]]:
+        """Bar times and closes in [start, end), oldest first."""
+        c = self.conn.cursor()
+        c.execute(
+            "SELECT time, close FROM price_bars WHERE ticker = ? AND resolution = ? AND time >= ? AND time < ? ORDER BY time",
+            (ticker, resolution, start, end)
+        )
+        rows = c.fetchall()
+        times = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        closes = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        return times, closes
+
+    def get_last_price_bar_time(self, ticker: str, resolution: str) -> int | None:
+        c = self.conn.cursor()
+        c.execute("SELECT MAX(time) FROM price_bars WHERE ticker = ? AND resolution = ?", (ticker, resolution))
+        return c.fetchone()[0]
+
+    def delete_price_bars_before(self, ticker: str, resolution: str, before: int):
+        c = self.conn.cursor()
+        c.execute("DELETE FROM price_bars WHERE ticker = ? AND resolution = ? AND time < ?", (ticker, resolution, before))
+        self.conn.commit()
+
+
+    ## ALERT OUTBOX
+
+    def enqueue_alert(self, title: str, url: str, content: str, event: int | None = None):
+        """Queues an alert. An event's alert replaces any of its updates still waiting, only the latest matters."""
+        c = self.conn.cursor()
+        if event is not None:
+            c.execute("DELETE FROM alert_outbox WHERE event = ?", (event, ))
+        c.execute(
+            "INSERT INTO alert_outbox (title, url, content, event) VALUES (?, ?, ?, ?)",
+            (title, url, content, event)
+        )
+        self.conn.commit()
+
+    def get_due_alerts(self, now: int, limit: int) -> List[OutboxAlertRow]:
+        """The oldest alerts whose next attempt is due."""
+        c = self.conn.cursor()
+        c.execute(
+            "SELECT * FROM alert_outbox WHERE next_attempt <= ? ORDER BY id LIMIT ?",
+            (now, limit)
+        )
+        return [_to_outbox_alert_row(row) for row in c.fetchall()]
+
+    def get_next_alert_attempt(self) -> int | None:
+        c = self.conn.cursor()
+        c.execute("SELECT MIN(next_attempt) FROM alert_outbox")
+        return c.fetchone()[0]
+
+    def count_pending_alerts(self) -> int:
+        c = self.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM alert_outbox")
+        return c.fetchone()[0]
+
+    def delete_alerts(self, ids: List[int]):
+        c = self.conn.cursor()
+        c.executemany("DELETE FROM alert_outbox WHERE id = ?", [(id, ) for id in ids])
+        self.conn.commit()
+
+    def defer_alerts(self, ids: List[int], next_attempt: int, count_attempt: bool = True):
+        """Pushes alerts back to `next_attempt`. Rate limiting isn't the alert's fault, so it needn't count as an attempt."""
+        c = self.conn.cursor()
+        c.executemany(
+            "UPDATE alert_outbox SET next_attempt = ?, attempts = attempts + ? WHERE id = ?",
+            [(next_attempt, int(count_attempt), id) for id in ids]
+        )
+        self.conn.commit()
+
+
+    def get_event_alert_message(self, event: int) -> str | None:
+        c = self.conn.cursor()
+        c.execute("SELECT message_id FROM event_alert_messages WHERE event = ?", (event, ))
+        row = c.fetchone()
+        return row[0] if row else None
+
+    def set_event_alert_message(self, event: int, message_id: str | None):
+        c = self.conn.cursor()
+        if message_id is None:
+            c.execute("DELETE FROM event_alert_messages WHERE event = ?", (event, ))
+        else:
+            c.execute("INSERT OR REPLACE INTO event_alert_messages (event, message_id) VALUES (?, ?)", (event, message_id))
+        self.conn.commit()
 
 
     ## EVENTS
@@ -192,6 +795,7 @@ class Database:
             (summary, signal, embedding.astype('float32').tobytes())
         )
         row = _to_event_row(c.fetchone())
+        _write_code(c, "events", row.id, embedding)
         self.conn.commit()
         return row
 
@@ -203,6 +807,27 @@ class Database:
         )
         self.conn.commit()
 
+    def corroborate_event(self, id: int, signals: List[tuple[str, str]]) -> EventRow:
+        """Counts one more post towards an event, with the (asset, signal) pairs it carried."""
+        c = self.conn.cursor()
+        c.executemany("""
+            INSERT INTO event_signals (event, asset, signal, posts) VALUES (?, ?, ?, 1)
+            ON CONFLICT (event, asset, signal) DO UPDATE SET posts = posts + 1""",
+            [(id, asset, signal) for asset, signal in signals]
+        )
+        c.execute(
+            "UPDATE events SET signal = signal + 1, last_updated = unixepoch() WHERE id = ? RETURNING *",
+            (id, )
+        )
+        row = _to_event_row(c.fetchone())
+        self.conn.commit()
+        return row
+
+    def get_event_signals(self, id: int) -> Dict[tuple[str, str], int]:
+        c = self.conn.cursor()
+        c.execute("SELECT asset, signal, posts FROM event_signals WHERE event = ?", (id, ))
+        return {(row["asset"], row["signal"]): row["posts"] for row in c.fetchall()}
+
     def get_alertable_events(self, min_signal: int) -> List[EventRow]:
         c = self.conn.cursor()
         c.execute("""
@@ -233,7 +858,34 @@ class Database:
 
         return [_to_event_row(row) for row in c.fetchall()]
 
-    def get_closest_events(self, embedding: NDArray[float64], amount: int) -> List[tuple[EventRow, float]]:
+    def iter_events_page(self, before: tuple[int, int], limit: int, min_timestamp: int = 0) -> Iterator[EventRow]:
+        """
+        Events newest first by (last_updated, id), starting after the keyset
+        cursor `before`. Pass FIRST_PAGE for the first page.
+        """
+        c = self.conn.cursor()
+        c.execute("""
+            SELECT *
+            FROM events
+            WHERE last_updated > ? AND (last_updated, id) < (?, ?)
+            ORDER BY last_updated DESC, id DESC
+            LIMIT ?""",
+            (min_timestamp, *before, limit)
+        )
+        while rows := c.fetchmany(PAGE_FETCH_SIZE):
+            for row in rows:
+                yield _to_event_row(row)
+
+    def get_closest_events(self, embedding: NDArray[float64], amount: int, min_timestamp: int = 0) -> List[tuple[EventRow, float]]:
+        """The events closest to `embedding`, of those updated after `min_timestamp` if it's given."""
+        if min_timestamp:
+            # Through the last_updated index, the floats are scanned as they are when quantization is off
+            rows = self._quantized_search("events", embedding, amount, "t.last_updated > ?", (min_timestamp, ))
+            return [(_to_event_row(row), distance) for row, distance in rows]
+        if EMBEDDING_QUANTIZATION is not None:
+            rows = self._quantized_search("events", embedding, amount)
+            return [(_to_event_row(row), distance) for row, distance in rows]
+
         c = self.conn.cursor()
         c.execute("""
             SELECT
@@ -251,6 +903,10 @@ class Database:
         c = self.conn.cursor()
         c.execute("DELETE FROM events WHERE 1=1")
         c.execute("UPDATE intelligence SET event = NULL WHERE 1=1")
+        # Event ids get reused once the table is empty, nothing may point at the old ones
+        c.execute("DELETE FROM event_signals WHERE 1=1")
+        c.execute("DELETE FROM event_alert_messages WHERE 1=1")
+        c.execute("DELETE FROM alert_outbox WHERE event IS NOT NULL")
         self.conn.commit()
 
     def get_signals_since(self, timestamp: int) -> List[HistoricalSignalRow]:
@@ -263,7 +919,157 @@ class Database:
 
         return [_to_historical_signal_row(row) for row in c.fetchall()]
 
+    def get_signal_labels_since(self, timestamp: int) -> List[tuple[int, str]]:
+        """Fetches (added, signal) for historical signals after a given timestamp, without embeddings."""
+        c = self.conn.cursor()
+        c.execute(
+            "SELECT added, signal FROM historical_signals WHERE added > ?",
+            (timestamp,)
+        )
+
+        return [(row["added"], row["signal"]) for row in c.fetchall()]
+
+    def iter_signal_embeddings(self, chunk_size: int) -> Iterator[tuple[List[str], List[str], NDArray[np.float32]]]:
+        """
+        Streams (urls, signals, embeddings) for every historical signal in
+        chunks, paging on rowid so memory stays bounded.
+        """
+        c = self.conn.cursor()
+        last_rowid = 0
+        while True:
+            c.execute(
+                "SELECT rowid, url, signal, embedding FROM historical_signals WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, chunk_size)
+            )
+            rows = c.fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            yield (
+                [row["url"] for row in rows],
+                [row["signal"] for row in rows],
+                np.frombuffer(b"".join(row["embedding"] for row in rows), dtype=np.float32).reshape(len(rows), -1),
+            )
+
+    def add_signal_labels(self, version: str, labels: List[tuple[str, str]]):
+        """Stores (url, signal) labels produced under `version`."""
+        c = self.conn.cursor()
+        c.executemany(
+            "INSERT OR REPLACE INTO signal_labels (version, url, signal) VALUES (?, ?, ?)",
+            [(version, url, signal) for url, signal in labels]
+        )
+        self.conn.commit()
+
+    def get_signal_labels(self, version: str, urls: List[str]) -> Dict[str, str]:
+        c = self.conn.cursor()
+        c.execute(
+            f"SELECT url, signal FROM signal_labels WHERE version = ? AND url IN ({','.join('?' * len(urls))})",
+            (version, *urls)
+        )
+        return {row["url"]: row["signal"] for row in c.fetchall()}
+
+    def set_historical_signal_labels(self, version: str, labels: List[tuple[str, str]]):
+        """Makes `version` the live label of the given (url, signal) pairs."""
+        c = self.conn.cursor()
+        c.executemany(
+            "UPDATE historical_signals SET signal = ?, label_version = ? WHERE url = ?",
+            [(signal, version, url) for url, signal in labels]
+        )
+        self.conn.commit()
+
+
+
+class ReadOnlyPool:
+    """
+    Read-only connections handed to one caller at a time, opened as needed
+    up to `size`. Callers past that wait for one to be returned.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.opened = 0
+        self.idle: queue.Queue[Database] = queue.Queue()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[Database]:
+        with self.lock:
+            opening = self.idle.empty() and self.opened < self.size
+            self.opened += opening
+        if opening:
+            try:
+                database = Database(read_only=True)
+            except BaseException:
+                # The slot wasn't filled, the next caller gets to try again
+                with self.lock:
+                    self.opened -= 1
+                raise
+        else:
+            database = self.idle.get()
+        try:
+            yield database
+        finally:
+            # Ends the read transaction of a page that wasn't read to the end
+            database.conn.rollback()
+            self.idle.put(database)
+
+
+def quantize_embedding(embedding: NDArray[float64]) -> tuple[bytes | None, float | None]:
+    """Returns the code and per-vector scale for `embedding` under EMBEDDING_QUANTIZATION."""
+    if EMBEDDING_QUANTIZATION is None:
+        return None, None
+
+    embedding = np.asarray(embedding, dtype=np.float32)
+    if EMBEDDING_QUANTIZATION == "binary":
+        return np.packbits(embedding > 0).tobytes(), float(np.linalg.norm(embedding))
+    if EMBEDDING_QUANTIZATION == "int8":
+        scale = float(np.abs(embedding).max()) / 127 or 1.0
+        return np.round(embedding / scale).astype(np.int8).tobytes(), scale
+    raise ValueError(f"Unknown quantization: {EMBEDDING_QUANTIZATION}")
+
+def _code_length() -> int:
+    if EMBEDDING_QUANTIZATION == "binary":
+        return (GEMINI_EMBEDDING_LENGTH + 7) // 8
+    return GEMINI_EMBEDDING_LENGTH
+
+def _code_dtype():
+    if EMBEDDING_QUANTIZATION == "binary":
+        return np.uint8
+    if EMBEDDING_QUANTIZATION == "int8":
+        return np.int8
+    return np.float32
+
+def _write_code(c: sqlite3.Cursor, table: str, rowid: int, embedding: NDArray[float64]):
+    if EMBEDDING_QUANTIZATION is None:
+        return
+    c.execute(f"INSERT OR REPLACE INTO {table}_codes (id, code, scale) VALUES (?, ?, ?)", (rowid, *quantize_embedding(embedding)))
+
+def _coarse_scan(table: str, where: str, *columns: str) -> str:
+    """
+    The query of the rowid and vector a coarse scan reads, then `columns`,
+    for the rows of `table` (as `t`) matching `where`. With quantization on
+    that's the code from the side table, the floats in the row when it's off.
+    """
+    extra = "".join(f", {column}" for column in columns)
+    if EMBEDDING_QUANTIZATION is None:
+        return f"SELECT t.rowid, t.embedding{extra} FROM {table} t WHERE {where} AND t.embedding IS NOT NULL"
+    return f"SELECT t.rowid, k.code{extra} FROM {table} t JOIN {table}_codes k ON k.id = t.rowid WHERE {where} AND length(k.code) = {_code_length()}"
+
+def _shard_quantization() -> str:
+    return EMBEDDING_QUANTIZATION or "float32"
+
+def _to_code_matrix(codes: List[bytes]) -> NDArray:
+    return np.frombuffer(b"".join(codes), dtype=_code_dtype()).reshape(len(codes), -1)
+
+def _coarse_distances(codes: NDArray, query: NDArray) -> NDArray:
+    """Approximate distances from `query` to each row of `codes`, smaller is closer."""
+    if EMBEDDING_QUANTIZATION == "binary":
+        return np.bitwise_count(codes ^ np.packbits(query > 0)).sum(axis=1)
 
+    # The per-vector scale cancels out of the cosine, so it isn't needed here
+    matrix = codes.astype(np.float32)
+    norms = np.maximum(np.linalg.norm(matrix, axis=1), 1e-12)
+    return 1 - (matrix @ query) / norms
 
 def _to_historical_signal_row(row: sqlite3.Row) -> HistoricalSignalRow:
     return HistoricalSignalRow(
@@ -273,12 +1079,21 @@ def _to_historical_signal_row(row: sqlite3.Row) -> HistoricalSignalRow:
         row["added"]
     )
 
+def _to_document_chunk_row(row: sqlite3.Row) -> DocumentChunkRow:
+    return DocumentChunkRow(
+        row["url"],
+        row["chunk"],
+        row["content"],
+        np.frombuffer(row["embedding"], dtype=np.float32),
+        row["added"]
+    )
+
 def _to_intelligence_row(row: sqlite3.Row) -> IntelligenceRow:
     return IntelligenceRow(
         row["rowid"],
         row["url"],
         row["content"],
-        np.frombuffer(row["embedding"], dtype=float64),
+        np.frombuffer(row["embedding"], dtype=np.float32),
         row["event"]
     )
 
@@ -286,9 +1101,20 @@ def _to_event_row(row: sqlite3.Row) -> EventRow:
     return EventRow(
         row["id"],
         row["summary"],
-        np.frombuffer(row["embedding"], dtype=float64),
+        np.frombuffer(row["embedding"], dtype=np.float32),
         row["signal"],
         row["alerted"],
         row["added"],
         row["last_updated"],
-    )
\ No newline at end of file
+    )
+
+def _to_outbox_alert_row(row: sqlite3.Row) -> OutboxAlertRow:
+    return OutboxAlertRow(
+        row["id"],
+        row["title"],
+        row["url"],
+        row["content"],
+        row["attempts"],
+        row["created"],
+        row["event"],
+    )
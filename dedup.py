@@ -0,0 +1,147 @@
+from collections import deque
+from dataclasses import dataclass
+from domain.post import Post
+from typing import Deque, Dict, List, Set
+from zlib import crc32
+
+import re
+import time
+import numpy as np
+from numpy.typing import NDArray
+
+SHINGLE_SIZE = 2
+
+# 32 bands of 4 rows: posts with a Jaccard similarity of 0.5 share a band
+# with probability > 0.87, unrelated posts almost never do.
+NUM_PERMUTATIONS = 128
+BANDS = 32
+ROWS = NUM_PERMUTATIONS // BANDS
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes, all of which fits in uint64
+LARGE_PRIME = np.uint64(4294967291)
+_rng = np.random.default_rng(0x5EED)
+PERMUTATION_A = _rng.integers(1, LARGE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+PERMUTATION_B = _rng.integers(0, LARGE_PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+
+WORD_PATTERN = re.compile(r"\w+")
+URL_PATTERN = re.compile(r"https?://\S+")
+
+
+def minhash(text: str) -> NDArray[np.uint64] | None:
+    """
+    MinHash signature of the word shingles of `text`.
+    Returns None if the text has no words to hash.
+    """
+    words = WORD_PATTERN.findall(URL_PATTERN.sub(" ", text.lower()))
+    if not words:
+        return None
+
+    if len(words) < SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+    hashes = np.fromiter((crc32(shingle.encode()) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    permuted = (PERMUTATION_A[:, None] * hashes[None, :] + PERMUTATION_B[:, None]) % LARGE_PRIME
+    return permuted.min(axis=1)
+
+
+@dataclass
+class _Entry:
+    id: int
+    added: float
+    signature: NDArray[np.uint64]
+    band_keys: List[bytes]
+    post: Post
+
+
+class NearDuplicateDetector:
+    """
+    Streaming near-duplicate detection over a sliding time window.
+
+    Posts are fingerprinted with MinHash and indexed by band in an LSH table,
+    so each lookup only compares against posts sharing a band. Looking a post
+    up (`find`) and indexing it (`add`) are separate, so a post can be made
+    an original only once it has actually been processed.
+    """
+
+    def __init__(self, window_seconds: float = 6 * 60 * 60, threshold: float = 0.5) -> None:
+        """
+        :param window_seconds: How long a post stays eligible as an original.
+        :param threshold: The estimated Jaccard similarity at which posts count as duplicates.
+        """
+        self.window_seconds = window_seconds
+        self.threshold = threshold
+
+        self.entries: Deque[_Entry] = deque()
+        self.by_id: Dict[int, _Entry] = {}
+        self.bands: List[Dict[bytes, Set[int]]] = [{} for _ in range(BANDS)]
+        self.next_id = 0
+
+    def find(self, post: Post, now: float | None = None) -> Post | None:
+        """Returns the first copy if `post` is a near-duplicate of a post indexed within the window, otherwise None."""
+        now = time.time() if now is None else now
+        self._evict(now - self.window_seconds)
+
+        signature = minhash(post.content)
+        if signature is None:
+            return None
+        return self._find(signature, _band_keys(signature))
+
+    def add(self, post: Post, now: float | None = None):
+        """Indexes `post` as the first copy of its story, for `find` to match later copies against."""
+        now = time.time() if now is None else now
+        signature = minhash(post.content)
+        if signature is not None:
+            self._add(post, now, signature, _band_keys(signature))
+
+    def check(self, post: Post, now: float | None = None) -> Post | None:
+        """
+        Returns the first copy if `post` is a near-duplicate of a post seen
+        within the window, otherwise indexes `post` and returns None.
+        """
+        now = time.time() if now is None else now
+        self._evict(now - self.window_seconds)
+
+        signature = minhash(post.content)
+        if signature is None:
+            return None
+
+        band_keys = _band_keys(signature)
+        original = self._find(signature, band_keys)
+        if original is None:
+            self._add(post, now, signature, band_keys)
+        return original
+
+    def _find(self, signature: NDArray[np.uint64], band_keys: List[bytes]) -> Post | None:
+        candidates = set()
+        for band, key in zip(self.bands, band_keys):
+            candidates.update(band.get(key, ()))
+
+        for candidate_id in sorted(candidates):
+            entry = self.by_id[candidate_id]
+            if np.count_nonzero(entry.signature == signature) >= self.threshold * NUM_PERMUTATIONS:
+                return entry.post
+        return None
+
+    def _add(self, post: Post, now: float, signature: NDArray[np.uint64], band_keys: List[bytes]):
+        entry = _Entry(self.next_id, now, signature, band_keys, post)
+        self.next_id += 1
+        self.entries.append(entry)
+        self.by_id[entry.id] = entry
+        for band, key in zip(self.bands, band_keys):
+            band.setdefault(key, set()).add(entry.id)
+
+    def _evict(self, cutoff: float):
+        while self.entries and self.entries[0].added < cutoff:
+            entry = self.entries.popleft()
+            del self.by_id[entry.id]
+            for band, key in zip(self.bands, entry.band_keys):
+                ids = band[key]
+                ids.discard(entry.id)
+                if not ids:
+                    del band[key]
+
+
+def _band_keys(signature: NDArray[np.uint64]) -> List[bytes]:
+    return [band.tobytes() for band in signature.reshape(BANDS, ROWS)]
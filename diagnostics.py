@@ -0,0 +1,132 @@
+"""
+Finding out what blocks the event loop, in the running process.
+
+`LoopMonitor` ticks on the loop and watches the ticks from a thread of its
+own. When the loop misses a tick for longer than STALL_THRESHOLD, the
+watcher grabs the loop thread's stack right then, which is the callback
+hogging it, and keeps it with the stall's duration.
+
+`sample_profile` samples the stacks of every thread for a few seconds and
+counts them as collapsed stacks, the "a;b;c 12" lines flamegraph.pl and
+speedscope read.
+"""
+from collections import Counter, deque
+from dataclasses import dataclass
+from metrics import metrics
+from types import FrameType
+from typing import Deque, Dict, List
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+
+# How often the loop ticks and the watcher checks on it
+LAG_CHECK_INTERVAL = 0.05
+# The loop going quiet for longer than this counts as a stall
+STALL_THRESHOLD = 0.25
+MAX_STALLS = 50
+
+PROFILE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 60
+
+
+@dataclass
+class Stall:
+    started: float
+    # Seconds the loop was blocked, None while it still is
+    duration: float | None
+    stack: List[str]
+
+
+class LoopMonitor:
+    def __init__(self, threshold: float = STALL_THRESHOLD, interval: float = LAG_CHECK_INTERVAL) -> None:
+        """
+        :param threshold: Seconds without a tick before the loop counts as stalled.
+        :param interval: Seconds between ticks.
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: Deque[Stall] = deque(maxlen=MAX_STALLS)
+        self.stall_count = 0
+        self.last_tick = time.monotonic()
+        self.loop_thread_id: int | None = None
+
+        self.lag = metrics.histogram("loop_lag_seconds", "How late the event loop ran a timer that was due")
+        metrics.register_counter("loop_stalls", "Times the event loop was blocked past the stall threshold", lambda: {(): self.stall_count})
+
+    async def run(self):
+        """Ticks forever on the running loop, starting the watcher thread on first call."""
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        threading.Thread(target=self._watch, name="loop-monitor", daemon=True).start()
+
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag.record(now - start - self.interval)
+            self.last_tick = now
+
+    def _watch(self):
+        reported_tick = None
+        stall = None
+        while True:
+            time.sleep(self.interval)
+            tick = self.last_tick
+
+            if stall is not None and tick != reported_tick:
+                # The loop is back, the tick landed about when the blocking callback returned
+                stall.duration = tick - reported_tick - self.interval
+                print(f"[Loop Monitor] Event loop was blocked for {stall.duration:.3f}s")
+                stall = None
+
+            if tick == reported_tick or time.monotonic() - tick < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)
+            stall = Stall(time.time() - (time.monotonic() - tick), None, stack)
+            reported_tick = tick
+            self.stalls.append(stall)
+            self.stall_count += 1
+            print(f"[Loop Monitor] Event loop blocked for over {self.threshold}s in:\n{''.join(stack[-5:])}")
+
+
+def sample_profile(seconds: float, interval: float = PROFILE_INTERVAL, thread_id: int | None = None) -> Counter[str]:
+    """
+    Samples every thread's stack, or only `thread_id`'s, each `interval`
+    for `seconds`. Run it in a thread of its own, it blocks for the whole
+    duration. Returns how often each collapsed stack was seen.
+    """
+    samples: Counter[str] = Counter()
+    sampler = threading.get_ident()
+    deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == sampler or (thread_id is not None and ident != thread_id):
+                continue
+            samples[_collapse(frame, names.get(ident, str(ident)))] += 1
+        time.sleep(interval)
+    return samples
+
+def format_collapsed(samples: Dict[str, int]) -> str:
+    """One "frame;frame;frame count" line per stack, most sampled first."""
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(samples.items(), key=lambda item: -item[1]))
+
+def _collapse(frame: FrameType | None, thread_name: str) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    # Outermost first, and the separator can't appear inside a frame
+    return ";".join(part.replace(";", ",") for part in [thread_name, *reversed(frames)])
+
+
+loop_monitor = LoopMonitor()
@@ -1,5 +1,6 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List
+import time
 
 @dataclass
 class Post:
@@ -7,4 +8,7 @@ class Post:
     author_id: str
     content: str
     links: List[str]
+    # Where the post came from ("bluesky", "mastodon", "rss") and when it arrived
+    source: str = ""
+    received: float = field(default_factory=time.time)
     
\ No newline at end of file
@@ -0,0 +1,294 @@
+"""
+Where embeddings come from.
+
+Every provider turns texts into unit vectors of GEMINI_EMBEDDING_LENGTH
+floats, so they fit the vector tables and the anchor store whichever is
+used. Vectors from different providers are not comparable, though. Anchors
+must be built with the provider that embeds the posts (see anchors.py), and
+stored intelligence, events and signals only match new ones made by the same
+provider.
+
+"gemini" calls the Gemini API in batches. "local" runs in-process with no
+network: the text's words and word pairs are hashed into a large sparse
+TF-IDF vector, which a fixed very sparse random projection takes down to
+GEMINI_EMBEDDING_LENGTH dimensions. It knows nothing of meaning beyond shared
+vocabulary, but it's free and takes microseconds. That makes it good for
+running offline, and as the pre-score deciding which posts are worth a Gemini
+call at all.
+
+Gemini requests go through an `AdaptiveClient` (see limiter.py), which keeps
+as many in flight as the quota allows and retries rate limited and failed
+ones. A text that can't be embedded in time raises `Unavailable` rather
+than coming back None, so the caller can try it again later, and a LOW
+priority one may be refused with `Shed` when Gemini is saturated.
+"""
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from google import genai
+from google.genai import errors
+from google.genai.types import EmbedContentConfig, HttpOptions
+from typing import List
+
+import aiohttp
+import argparse
+import asyncio
+import hashlib
+import os
+import re
+import time
+import zlib
+import numpy as np
+from numpy import float64
+from numpy.typing import NDArray
+
+from anchor_store import AnchorStore
+from limiter import AdaptiveClient, Priority, Retryable
+from env import GEMINI_API_KEY, GEMINI_EMBEDDING_MODEL, GEMINI_EMBEDDING_LENGTH
+
+# "gemini" or "local"
+EMBEDDING_PROVIDER = "gemini"
+# Posts whose local pre-score is below this aren't sent to Gemini at all, None sends every post.
+# Tune it on a replay, comparing the --output of runs with and without --prescore.
+PRESCORE_THRESHOLD: float | None = None
+
+# Texts per embed_content request
+GEMINI_BATCH_SIZE = 100
+# Seconds to get a text embedded in, by priority. Posts that can wait for the
+# quota do, LOW ones give way to them sooner.
+EMBED_DEADLINES = {Priority.HIGH: 5 * 60, Priority.LOW: 30}
+
+# Hashed TF-IDF features, collisions are rare at this size
+LOCAL_FEATURES = 2 ** 20
+# Output dimensions each feature is spread over, with random signs
+LOCAL_NONZEROS = 4
+# Fixed so the projection, and with it every local vector, is the same in every process
+LOCAL_SEED = 20261019
+# Document frequencies fitted on stored intelligence, plain term frequencies if missing
+LOCAL_IDF_PATH = "local_idf.npy"
+# Batches at least this big are split over threads
+LOCAL_CHUNK_SIZE = 64
+LOCAL_THREADS = min(os.cpu_count() or 1, 4)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class EmbeddingProvider(ABC):
+    # Recorded with anchor sets, so vectors of different providers aren't mixed
+    model: str
+    dimension: int
+    # The least similarity to an anchor that counts as a match, providers' similarities differ in scale
+    confidence_threshold: float = 0.4
+
+    @abstractmethod
+    async def embed(self, texts: List[str], priority: Priority = Priority.HIGH) -> List[NDArray[float64] | None]:
+        """
+        One unit vector per text, in order, None for any that can never be
+        embedded. Remote providers raise `Shed` or `Unavailable` for texts
+        that might be later.
+        """
+
+
+class GeminiEmbeddings(EmbeddingProvider):
+    def __init__(self, model: str = GEMINI_EMBEDDING_MODEL, dimension: int = GEMINI_EMBEDDING_LENGTH, base_url: str | None = None) -> None:
+        """
+        :param model: The Gemini embedding model.
+        :param dimension: Length of the vectors.
+        :param base_url: Where the API is, Google's unless given, such as a FakeGeminiServer's url.
+        """
+        self.client = genai.Client(api_key=GEMINI_API_KEY, http_options=HttpOptions(base_url=base_url) if base_url else None)
+        self.model = model
+        self.dimension = dimension
+        self.adaptive = AdaptiveClient("gemini")
+
+    async def embed(self, texts: List[str], priority: Priority = Priority.HIGH) -> List[NDArray[float64] | None]:
+        deadline = time.monotonic() + EMBED_DEADLINES[priority]
+        batches = [texts[i:i + GEMINI_BATCH_SIZE] for i in range(0, len(texts), GEMINI_BATCH_SIZE)]
+        results = await asyncio.gather(*[self._embed_batch(batch, priority, deadline) for batch in batches])
+        return [embedding for batch in results for embedding in batch]
+
+    async def _embed_batch(self, texts: List[str], priority: Priority, deadline: float) -> List[NDArray[float64] | None]:
+        try:
+            response = await self.adaptive.call(lambda: self._request(texts), priority, deadline)
+        except errors.APIError as e:
+            # Rejected for good, an invalid request or key, retrying won't help
+            print(f"Gemini Error: {e}")
+            return [None] * len(texts)
+
+        if response.embeddings is None or len(response.embeddings) != len(texts):
+            return [None] * len(texts)
+        return [_normalize(np.array(embedding.values)) for embedding in response.embeddings]
+
+    async def _request(self, texts: List[str]):
+        try:
+            return await self.client.aio.models.embed_content(
+                model=self.model,
+                contents=texts,
+                config=EmbedContentConfig(
+                    output_dimensionality=self.dimension,
+                    task_type="CLASSIFICATION"
+                )
+            )
+        except errors.APIError as e:
+            if e.code == 429 or e.code >= 500:
+                raise Retryable(f"Gemini answered {e.code}: {e.message}", overload=True, retry_after=_retry_delay(e.details)) from e
+            raise
+        except aiohttp.ClientError as e:
+            # genai makes its async requests with aiohttp when it's installed, as it is here
+            raise Retryable(f"Gemini request failed: {e}") from e
+
+
+class LocalEmbeddings(EmbeddingProvider):
+    # Only shared words count, related texts rarely get past 0.3
+    confidence_threshold = 0.15
+
+    def __init__(self, dimension: int = GEMINI_EMBEDDING_LENGTH, idf_path: str = LOCAL_IDF_PATH) -> None:
+        """
+        :param dimension: Length of the vectors.
+        :param idf_path: Inverse document frequencies written by `fit_idf`, if there are any.
+        """
+        self.dimension = dimension
+        self.executor: ThreadPoolExecutor | None = None
+
+        # The projection matrix, stored as the output dimensions and signs of each feature's nonzeros
+        rng = np.random.default_rng(LOCAL_SEED)
+        self.columns = rng.integers(0, dimension, size=(LOCAL_FEATURES, LOCAL_NONZEROS), dtype=np.int16)
+        self.signs = rng.choice(np.array([-1, 1], dtype=np.int8), size=(LOCAL_FEATURES, LOCAL_NONZEROS))
+
+        self.idf = np.ones(LOCAL_FEATURES, dtype=np.float32)
+        self.model = "local-hashed-tfidf"
+        if os.path.exists(idf_path):
+            self.idf = np.load(idf_path)
+            # Vectors change with the IDF, so which one made them is part of the model
+            self.model += "+" + hashlib.blake2b(self.idf.tobytes(), digest_size=4).hexdigest()
+
+    async def embed(self, texts: List[str], priority: Priority = Priority.HIGH) -> List[NDArray[float64] | None]:
+        if len(texts) < LOCAL_CHUNK_SIZE:
+            matrix = self.embed_sync(texts)
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(LOCAL_THREADS, thread_name_prefix="local-embed")
+            loop = asyncio.get_running_loop()
+            chunks = [texts[i:i + LOCAL_CHUNK_SIZE] for i in range(0, len(texts), LOCAL_CHUNK_SIZE)]
+            matrix = np.concatenate(await asyncio.gather(*[loop.run_in_executor(self.executor, self.embed_sync, chunk) for chunk in chunks]))
+        # A text without a single word has nothing to embed
+        return [row if row.any() else None for row in matrix]
+
+    def embed_sync(self, texts: List[str]) -> NDArray[float64]:
+        """The vectors of `texts` as rows of a matrix, a zero row for a text without words."""
+        documents = []
+        features = []
+        counts = []
+        for i, text in enumerate(texts):
+            grams = Counter(_hash_grams(text))
+            documents.append(np.full(len(grams), i, dtype=np.int64))
+            features.append(np.fromiter(grams.keys(), dtype=np.int64, count=len(grams)))
+            counts.append(np.fromiter(grams.values(), dtype=np.float64, count=len(grams)))
+
+        if not texts:
+            return np.zeros((0, self.dimension))
+        documents, features, counts = np.concatenate(documents), np.concatenate(features), np.concatenate(counts)
+
+        # Sublinear term frequency, a word said five times isn't five times the signal
+        weights = (1 + np.log(counts)) * self.idf[features]
+        cells = documents[:, None] * self.dimension + self.columns[features]
+        matrix = np.bincount(cells.ravel(), weights=(weights[:, None] * self.signs[features]).ravel(), minlength=len(texts) * self.dimension)
+        matrix = matrix.reshape(len(texts), self.dimension)
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+class LocalPrescorer:
+    """
+    A cheap first look at a text, to skip the remote embedding of posts
+    nowhere near a directional anchor. The buy and sell anchor texts of the
+    current set are embedded locally, once per version, and a text scores its
+    highest local similarity to any of them.
+    """
+
+    def __init__(self, anchor_store: AnchorStore, threshold: float, local: LocalEmbeddings | None = None) -> None:
+        """
+        :param anchor_store: The store whose anchor texts are scored against.
+        :param threshold: The score a text needs to be worth embedding.
+        :param local: The local provider, one is created if not given.
+        """
+        self.anchor_store = anchor_store
+        self.threshold = threshold
+        self.local = local or LocalEmbeddings()
+        self.version: str | None = None
+        self.anchors: NDArray[float64] | None = None
+
+    def score(self, text: str) -> float:
+        anchors = self._anchor_matrix()
+        if anchors is None:
+            # Nothing to judge by, everything is worth embedding
+            return 1.0
+        return float(np.max(anchors @ self.local.embed_sync([text])[0]))
+
+    def worth_embedding(self, text: str) -> bool:
+        return self.score(text) >= self.threshold
+
+    def _anchor_matrix(self) -> NDArray[float64] | None:
+        anchor_set = self.anchor_store.current
+        if anchor_set is None:
+            return None
+        if anchor_set.version != self.version:
+            # Sets converted from the old pickles have no texts
+            texts = [text for text, label in zip(anchor_set.texts, anchor_set.labels) if text and label != "noise"]
+            self.anchors = self.local.embed_sync(texts) if texts else None
+            self.version = anchor_set.version
+        return self.anchors
+
+
+def make_provider(name: str = EMBEDDING_PROVIDER) -> EmbeddingProvider:
+    if name == "gemini":
+        return GeminiEmbeddings()
+    if name == "local":
+        return LocalEmbeddings()
+    raise ValueError(f"Unknown embedding provider {name!r}, expected 'gemini' or 'local'")
+
+def fit_idf(texts: List[str]) -> NDArray[np.float32]:
+    """Smoothed inverse document frequencies of every hashed feature over `texts`."""
+    frequencies = np.zeros(LOCAL_FEATURES, dtype=np.int64)
+    for text in texts:
+        frequencies[np.fromiter(set(_hash_grams(text)), dtype=np.int64)] += 1
+    return (np.log((1 + len(texts)) / (1 + frequencies)) + 1).astype(np.float32)
+
+def _hash_grams(text: str) -> List[int]:
+    """The hashed features of a text's words and pairs of neighbouring words."""
+    words = TOKEN_PATTERN.findall(text.lower())
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    return [zlib.crc32(gram.encode()) % LOCAL_FEATURES for gram in grams]
+
+def _retry_delay(details: dict | None) -> float | None:
+    """The seconds a Gemini error's RetryInfo asks to wait, such as "27s", if it has one."""
+    for detail in ((details or {}).get("error") or {}).get("details") or []:
+        if detail.get("@type", "").endswith("google.rpc.RetryInfo") and "retryDelay" in detail:
+            return float(detail["retryDelay"].rstrip("s"))
+    return None
+
+def _normalize(embedding: NDArray[float64]) -> NDArray[float64]:
+    return embedding / np.linalg.norm(embedding)
+
+
+def main():
+    from db import Database, FIRST_PAGE
+
+    parser = argparse.ArgumentParser(description="Fit the local provider's document frequencies on stored intelligence.")
+    parser.add_argument("--output", default=LOCAL_IDF_PATH)
+    args = parser.parse_args()
+
+    database = Database()
+    texts = []
+    cursor = FIRST_PAGE
+    while page := list(database.iter_intelligence_page(cursor, 1000)):
+        texts += [row.content for row, _ in page]
+        row, last_updated = page[-1]
+        cursor = (last_updated, row.rowid)
+
+    np.save(args.output, fit_idf(texts))
+    print(f"Fitted document frequencies on {len(texts)} texts into {args.output}")
+    print("Local vectors change with them, rebuild local anchor sets with anchors.py")
+
+
+if __name__ == "__main__":
+    main()
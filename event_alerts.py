@@ -0,0 +1,86 @@
+from db import Database, EventRow
+from domain.post import Post
+from strategy import Signal, ASSETS
+from alert import AlertSender, suppress_urls
+from typing import Dict, List
+
+import time
+from numpy import float64
+from numpy.typing import NDArray
+
+# Max cosine distance between a post and an event's first post for it to join the event
+EVENT_DISTANCE_THRESHOLD = 0.15
+# Events quiet for longer than this are closed, a matching post starts a new one
+EVENT_WINDOW = 2 * 24 * 60 * 60
+# Candidate events fetched per post, the closest open one wins
+EVENT_CANDIDATES = 5
+
+# Directional posts an event needs before it alerts
+EVENT_ALERT_THRESHOLD = 3
+
+
+class EventAlerter:
+    """
+    Alerts once per story instead of once per post. Each directional post
+    joins the nearest open event or starts one. An event alerts when it
+    gathers EVENT_ALERT_THRESHOLD posts, and every later post updates that
+    alert in place.
+    """
+
+    def __init__(self, db: Database, alerter: AlertSender, distance_threshold: float = EVENT_DISTANCE_THRESHOLD, alert_threshold: int = EVENT_ALERT_THRESHOLD) -> None:
+        """
+        :param db: The database holding events.
+        :param alerter: Where event alerts are queued.
+        :param distance_threshold: Max cosine distance for a post to join an event.
+        :param alert_threshold: Directional posts an event needs before it alerts.
+        """
+        self.db = db
+        self.alerter = alerter
+        self.distance_threshold = distance_threshold
+        self.alert_threshold = alert_threshold
+        self.asset_names = {rules.ticker: rules.name for rules in ASSETS}
+
+    async def add_post(self, post: Post, embedding: NDArray[float64], signals: Dict[str, Signal]):
+        """Attaches a post's BUY and SELL signals to its event, alerting or updating as needed."""
+        directional = [(asset, signal.name) for asset, signal in signals.items() if signal in [Signal.BUY, Signal.SELL]]
+        if not directional:
+            return
+
+        event = self._find_event(embedding)
+        if event is None:
+            event = self.db.add_event(post.content[:1000], 0, embedding)
+            print(f"New event {event.id} | Post: {post.url}")
+
+        self.db.add_intelligence(post.url, post.content, embedding)
+        self.db.set_intelligence_event(post.url, event.id)
+        event = self.db.corroborate_event(event.id, directional)
+
+        # The first alert is posted, every later one edits it
+        if event.alerted or event.signal >= self.alert_threshold:
+            await self.alerter.send_event_alert(event.id, *self._format(event, post))
+            self.alerter.post_to_alert.record(time.time() - post.received)
+            if not event.alerted:
+                self.db.set_event_alerted(event.id)
+
+    def _find_event(self, embedding: NDArray[float64]) -> EventRow | None:
+        # Only open events are searched, closed ones closer still mustn't crowd them out
+        min_timestamp = int(time.time()) - EVENT_WINDOW
+        for event, distance in self.db.get_closest_events(embedding, EVENT_CANDIDATES, min_timestamp):
+            if distance <= self.distance_threshold:
+                return event
+        return None
+
+    def _format(self, event: EventRow, post: Post) -> tuple[str, str, str]:
+        """Title, source url and body of an event's alert."""
+        counts = sorted(self.db.get_event_signals(event.id).items(), key=lambda item: -item[1])
+        signals: List[str] = [
+            f"{signal} {self.asset_names.get(asset, asset)} ({asset}) x{posts}"
+            for (asset, signal), posts in counts
+        ]
+        title = f"EVENT: {', '.join(signals)}"
+        body = (
+            f"**Story**: {suppress_urls(event.summary[:500])}\n"
+            f"**Posts**: {event.signal}\n"
+            f">>> **Latest source**: <{post.url}>"
+        )
+        return title, post.url, body
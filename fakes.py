@@ -0,0 +1,356 @@
+"""
+Local stand-ins for the external services Balthazar talks to, so the
+pipeline can be exercised without the network.
+"""
+from compression import zstd
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qs
+
+import asyncio
+import hashlib
+import random
+import time
+import numpy as np
+import orjson
+import pandas as pd
+from aiohttp import web
+from numpy import float64
+from numpy.typing import NDArray
+from websockets.asyncio.server import serve, ServerConnection
+
+import anchors
+from ai_engine import GeminiAnalyst
+from anchor_store import AnchorSet
+from embeddings import EmbeddingProvider
+from limiter import Priority
+from market_data import MarketDataProvider
+from env import GEMINI_EMBEDDING_LENGTH
+
+
+class FakeJetstreamServer:
+    """
+    Replays recorded Jetstream frames over a local websocket, honouring the
+    `cursor`, `wantedDids` and `compress` query parameters.
+
+    Usage:
+        async with FakeJetstreamServer(frames) as server:
+            client = BlueskyClient(queue, websocket_url=server.url)
+    """
+
+    def __init__(self, frames: List[bytes], zstd_dict: zstd.ZstdDict | None = None, disconnect_after: int | None = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        :param frames: Raw JSON Jetstream frames, in playback order.
+        :param zstd_dict: The dictionary used when a client asks for compression.
+        :param disconnect_after: Drop each connection after sending this many frames.
+        """
+        self.frames = frames
+        self.zstd_dict = zstd_dict
+        self.disconnect_after = disconnect_after
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections = 0
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "FakeJetstreamServer":
+        """Loads frames from a file with one JSON frame per line."""
+        with open(path, "rb") as f:
+            frames = [line.rstrip(b"\n") for line in f if line.strip()]
+        return cls(frames, **kwargs)
+
+    @property
+    def url(self) -> str:
+        return f"ws://{self.host}:{self.port}/subscribe"
+
+    async def __aenter__(self):
+        self.server = await serve(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _handle(self, websocket: ServerConnection):
+        self.connections += 1
+        query = parse_qs(urlparse(websocket.request.path).query)
+        cursor = int(query["cursor"][0]) if "cursor" in query else None
+        wanted_dids = set(query.get("wantedDids", []))
+        compress = query.get("compress", ["false"])[0] == "true" and self.zstd_dict is not None
+
+        sent = 0
+        for frame in self.frames:
+            data = orjson.loads(frame)
+            if cursor is not None and data["time_us"] < cursor:
+                continue
+            if wanted_dids and data["did"] not in wanted_dids:
+                continue
+
+            if compress:
+                await websocket.send(zstd.compress(frame, zstd_dict=self.zstd_dict))
+            else:
+                await websocket.send(frame.decode())
+
+            sent += 1
+            if self.disconnect_after is not None and sent >= self.disconnect_after:
+                return
+
+        # Keep the connection open like a quiet firehose would, until the client leaves
+        await websocket.wait_closed()
+
+
+class FakeWebhookServer:
+    """
+    A Discord-style webhook that records the messages it accepts and
+    enforces a rate limit bucket, answering 429 with `Retry-After` once
+    the bucket is empty. Messages posted with `?wait=true` are returned
+    with an id and can be edited through `/messages/{id}`.
+
+    Usage:
+        async with FakeWebhookServer() as webhook:
+            sender = AlertSender(db, webhook_url=webhook.url)
+    """
+
+    def __init__(self, bucket_size: int = 5, reset_after: float = 2.0, statuses: List[int] | None = None, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        :param bucket_size: Requests allowed per bucket window.
+        :param reset_after: Seconds until an emptied bucket refills.
+        :param statuses: Status codes to answer the first requests with, before behaving normally.
+        """
+        self.bucket_size = bucket_size
+        self.reset_after = reset_after
+        self.statuses = list(statuses or [])
+        self.host = host
+        self.port = port
+        self.runner = None
+        self.messages: List[str] = []
+        # Current content of each message, by id
+        self.contents: Dict[str, str] = {}
+        self.edits = 0
+        self.requests = 0
+        self.remaining = bucket_size
+        self.reset_at = 0.0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/webhook"
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post("/webhook", self._handle)
+        app.router.add_patch("/webhook/messages/{message_id}", self._handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.statuses:
+            return web.Response(status=self.statuses.pop(0))
+
+        now = time.monotonic()
+        if now >= self.reset_at:
+            self.remaining = self.bucket_size
+            self.reset_at = now + self.reset_after
+        if self.remaining == 0:
+            retry_after = self.reset_at - now
+            return web.json_response({"retry_after": retry_after}, status=429, headers={"Retry-After": f"{retry_after:.3f}"})
+
+        self.remaining -= 1
+        form = await request.post()
+        headers: Dict[str, str] = {
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset-After": f"{self.reset_at - now:.3f}",
+        }
+
+        message_id = request.match_info.get("message_id")
+        if message_id is not None:
+            if message_id not in self.contents:
+                return web.Response(status=404, headers=headers)
+            self.contents[message_id] = form["content"]
+            self.edits += 1
+            return web.json_response({"id": message_id, "content": form["content"]}, headers=headers)
+
+        self.messages.append(form["content"])
+        message_id = str(len(self.messages))
+        self.contents[message_id] = form["content"]
+        if request.query.get("wait") == "true":
+            return web.json_response({"id": message_id, "content": form["content"]}, headers=headers)
+        return web.Response(status=204, headers=headers)
+
+
+class FakeGeminiServer:
+    """
+    Serves `batchEmbedContents` like the Gemini API, with made-up embeddings.
+    Requests come out of a quota bucket refilled at `quota` per second, once
+    it's empty they're answered 429 RESOURCE_EXHAUSTED with a RetryInfo
+    delay, as Gemini does. A share of the rest can fail with 503.
+
+    Usage:
+        async with FakeGeminiServer(quota=20) as server:
+            analyst = GeminiAnalyst(GeminiEmbeddings(base_url=server.url))
+    """
+
+    def __init__(self, quota: float = 10.0, burst: float | None = None, latency: float = 0.05, error_rate: float = 0.0, retry_delay: float | None = None, seed: int = 0, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        :param quota: Requests allowed per second.
+        :param burst: Requests allowed at once from a full bucket, a second's worth if not given.
+        :param latency: Seconds each accepted request takes.
+        :param error_rate: Share of accepted requests answered 503 instead.
+        :param retry_delay: Seconds of RetryInfo delay sent with 429s, none if not given.
+        :param seed: Seeds which requests fail.
+        """
+        self.quota = quota
+        self.burst = burst or quota
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_delay = retry_delay
+        self.random = random.Random(seed)
+        self.host = host
+        self.port = port
+        self.runner = None
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        # Texts embedded, across every accepted request
+        self.embedded = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_post("/{version}/models/{model}:batchEmbedContents", self._handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.quota, self.burst)
+        self.updated = now
+        if self.tokens < 1:
+            self.rejected += 1
+            details = [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{self.retry_delay}s"}] if self.retry_delay is not None else []
+            return web.json_response({"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED", "details": details}}, status=429)
+        self.tokens -= 1
+
+        body = await request.json()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+
+        if self.random.random() < self.error_rate:
+            self.failed += 1
+            return web.json_response({"error": {"code": 503, "message": "The model is overloaded. Please try again later.", "status": "UNAVAILABLE"}}, status=503)
+
+        embeddings = []
+        for item in body["requests"]:
+            text = " ".join(part["text"] for part in item["content"]["parts"])
+            embeddings.append({"values": fake_embedding(text, item.get("outputDimensionality", GEMINI_EMBEDDING_LENGTH)).tolist()})
+        self.embedded += len(embeddings)
+        return web.json_response({"embeddings": embeddings})
+
+
+class FakeEmbeddings(EmbeddingProvider):
+    """
+    Makes embeddings up. Every text gets the same unit vector each time,
+    seeded from its hash, after `latency` seconds standing in for the API call.
+    """
+
+    def __init__(self, latency: float = 0.0, dimension: int = GEMINI_EMBEDDING_LENGTH) -> None:
+        self.model = "fake"
+        self.dimension = dimension
+        self.latency = latency
+        self.calls = 0
+
+    async def embed(self, texts: List[str], priority: Priority = Priority.HIGH) -> List[NDArray[float64] | None]:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [fake_embedding(text, self.dimension) for text in texts]
+
+
+class FakeAnalyst(GeminiAnalyst):
+    """
+    A GeminiAnalyst on FakeEmbeddings. Classification still runs against
+    the real anchor set, so most posts come out HOLD.
+    """
+
+    def __init__(self, latency: float = 0.0, dimension: int = GEMINI_EMBEDDING_LENGTH) -> None:
+        super().__init__(FakeEmbeddings(latency, dimension))
+
+
+def fake_embedding(text: str, dimension: int = GEMINI_EMBEDDING_LENGTH) -> NDArray[float64]:
+    """A unit vector seeded from the hash of `text`, the same every time."""
+    seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest())
+    embedding = np.random.default_rng(seed).standard_normal(dimension)
+    return embedding / np.linalg.norm(embedding)
+
+def fake_anchor_set(dimension: int = GEMINI_EMBEDDING_LENGTH) -> AnchorSet:
+    """Every anchor text of anchors.py, per asset and shared, with made-up embeddings."""
+    labels, assets, texts = [], [], []
+    for asset, categories in anchors.ASSET_ANCHORS.items():
+        for label, category_texts in categories.items():
+            labels += [label] * len(category_texts)
+            assets += [asset] * len(category_texts)
+            texts += category_texts
+    labels += ["noise"] * len(anchors.NOISE_ANCHORS)
+    assets += [None] * len(anchors.NOISE_ANCHORS)
+    texts += anchors.NOISE_ANCHORS
+
+    matrix = np.array([fake_embedding(text, dimension) for text in texts], dtype=np.float32)
+    return AnchorSet("fake", matrix, np.array(labels), assets, texts, "fake", dimension)
+
+
+class FakeMarketProvider(MarketDataProvider):
+    """Serves a made-up random walk for every ticker instead of calling yfinance."""
+
+    def get_current_price(self, ticker: str) -> float | None:
+        hist_df = self.get_historical_data(ticker)
+        return float(hist_df["Close"].iloc[-1])
+
+    def get_historical_data(self, ticker: str, period: str = "1d", interval: str = "5m") -> pd.DataFrame | None:
+        bars = 500
+        index = pd.date_range(end=pd.Timestamp.now(tz="UTC").floor(interval.replace("m", "min")), periods=bars, freq=interval.replace("m", "min"))
+        seed = int.from_bytes(hashlib.blake2b(ticker.encode(), digest_size=8).digest())
+        close = 30 * np.exp(np.cumsum(np.random.default_rng(seed).normal(0, 0.002, bars)))
+        return pd.DataFrame({"Open": close, "High": close, "Low": close, "Close": close, "Volume": np.zeros(bars)}, index=index)
+
+
+class RecordedPages:
+    """Stands in for AntiBot on replay, serving pages from a recording instead of a browser."""
+
+    def __init__(self, pages: Dict[str, str] | None = None) -> None:
+        self.pages = pages or {}
+
+    async def get_page(self, url: str) -> str | None:
+        return self.pages.get(url)
+
+    async def get_rss_content(self, url: str) -> str | None:
+        return None
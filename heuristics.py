@@ -34,8 +34,8 @@ SHORTLIST_ACCOUNTS = {
     "did:plc:idwhjzs5boatwv4zxwwcjk5i", # malwaretech.com
     
     # Mastodon
-    # @mastodon.social users have no @mastodon.social in tag as we are on their fedi
-    "EUVD_Bot",
+    # Local accounts are qualified with the instance they were streamed from
+    "EUVD_Bot@mastodon.social",
 }
 
 IGNORE_ACCOUNTS = {
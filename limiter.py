@@ -0,0 +1,288 @@
+"""
+Adaptive concurrency and retries for calls to a rate limited service.
+
+`AdaptiveLimiter` caps the calls in flight with an AIMD limit. Every call
+that succeeds raises it by 1/limit, about one per round trip's worth of
+calls, and a call the service rejects as overloaded (a 429 or a 5xx, or a
+timeout) halves it. Rejections of calls sent together count once, only a
+call started after the last cut can cut it again. The limit settles around
+what the quota allows, the service sees a few rejections each time it
+probes for more and throughput stays at its ceiling.
+
+Calls waiting for a slot are queued by priority. A LOW call that would
+wait longer than its deadline allows, going by the queue ahead of it and
+how long calls take, is refused with `Shed` instead of queued.
+
+`AdaptiveClient.call` runs a request under the limiter, retrying failures
+worth retrying after a full-jitter backoff, or the delay the service asked
+for, until its deadline. Retries come out of a `RetryBudget`, so an outage
+doesn't turn every call into several.
+"""
+from enum import IntEnum
+from typing import Awaitable, Callable, List, TypeVar
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+
+from metrics import metrics
+
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+# The limit is multiplied by this on overload
+DECREASE_FACTOR = 0.5
+# Weight of each call in the moving average of call latency
+LATENCY_SMOOTHING = 0.2
+
+# A single attempt is given up on after this long, however far the deadline is
+ATTEMPT_TIMEOUT = 30
+DEFAULT_DEADLINE = 60
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# Each first try earns this much of a retry
+RETRY_RATIO = 0.2
+# Retries allowed however few first tries there are, per second
+RETRY_MIN_RATE = 1.0
+RETRY_MAX_TOKENS = 20
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    HIGH = 0
+    LOW = 1
+
+
+class Retryable(Exception):
+    """A failed attempt worth trying again."""
+
+    def __init__(self, message: str, overload: bool = False, retry_after: float | None = None) -> None:
+        """
+        :param overload: Whether the service rejected it for load, and wants fewer calls.
+        :param retry_after: Seconds the service asked to wait before trying again.
+        """
+        super().__init__(message)
+        self.overload = overload
+        self.retry_after = retry_after
+
+
+class Shed(Exception):
+    """A low priority call refused because the service is saturated."""
+
+
+class Unavailable(Exception):
+    """A call that couldn't succeed before its deadline or within the retry budget."""
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial: int = INITIAL_LIMIT, minimum: int = MIN_LIMIT, maximum: int = MAX_LIMIT) -> None:
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        # (priority, arrival, future) heap of calls waiting for a slot
+        self.waiters: List[tuple[int, int, asyncio.Future]] = []
+        self.arrivals = itertools.count()
+        self.last_decrease = 0.0
+        # Nothing new starts before this, set when the service asks for a pause
+        self.paused_until = 0.0
+        # Moving average of how long a successful call takes, None until one has
+        self.latency: float | None = None
+
+    async def acquire(self, priority: Priority, deadline: float):
+        """
+        Waits for a slot until `deadline`, a time.monotonic(). Raises `Shed`
+        for a LOW call that can't expect one in time and `Unavailable` when
+        the deadline passes first.
+        """
+        if not self.waiters and self._has_room():
+            self.in_flight += 1
+            return
+        if priority > Priority.HIGH and self.expected_wait() > deadline - time.monotonic():
+            raise Shed(f"{len(self.waiters)} calls waiting at a limit of {self.limit:.1f}")
+
+        waiter = (priority, next(self.arrivals), asyncio.get_running_loop().create_future())
+        heapq.heappush(self.waiters, waiter)
+        try:
+            async with asyncio.timeout_at(_loop_time(deadline)):
+                await waiter[2]
+        except BaseException as e:
+            if waiter[2].done():
+                # Granted a slot just as the wait was given up on, it goes to the next in line
+                self.release()
+            else:
+                waiter[2].cancel()
+                self.waiters.remove(waiter)
+                heapq.heapify(self.waiters)
+            if isinstance(e, TimeoutError):
+                raise Unavailable("No slot before the deadline") from None
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def on_success(self, seconds: float):
+        """
+        :param seconds: How long the call took.
+        """
+        self.limit = min(self.limit + 1 / self.limit, self.maximum)
+        self.latency = seconds if self.latency is None else self.latency + LATENCY_SMOOTHING * (seconds - self.latency)
+        self._wake()
+
+    def on_overload(self, started: float):
+        """
+        :param started: The time.monotonic() the rejected call was sent at.
+        """
+        # Calls sent before the last cut were sent at the old limit, they say nothing of the new one
+        if started >= self.last_decrease:
+            self.limit = max(self.limit * DECREASE_FACTOR, self.minimum)
+            self.last_decrease = time.monotonic()
+
+    def pause(self, seconds: float):
+        """Starts nothing new for `seconds`, calls in flight carry on."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        asyncio.get_running_loop().call_later(seconds, self._wake)
+
+    def expected_wait(self) -> float:
+        """Seconds a call queued now can expect to wait for a slot."""
+        return max(self.paused_until - time.monotonic(), 0) + len(self.waiters) / self.limit * (self.latency or 0)
+
+    def _has_room(self) -> bool:
+        return self.in_flight < int(self.limit) and time.monotonic() >= self.paused_until
+
+    def _wake(self):
+        while self.waiters and self._has_room():
+            _, _, future = heapq.heappop(self.waiters)
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(True)
+
+
+class RetryBudget:
+    """
+    Retries allowed as a share of first tries, a token bucket every first try
+    adds RETRY_RATIO to and every retry takes one from.
+    """
+
+    def __init__(self, ratio: float = RETRY_RATIO, min_rate: float = RETRY_MIN_RATE, max_tokens: float = RETRY_MAX_TOKENS) -> None:
+        self.ratio = ratio
+        self.min_rate = min_rate
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated = time.monotonic()
+
+    def record_try(self):
+        self._refill()
+        self.tokens = min(self.tokens + self.ratio, self.max_tokens)
+
+    def try_spend(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.updated) * self.min_rate, self.max_tokens)
+        self.updated = now
+
+
+class AdaptiveClient:
+    def __init__(self, name: str, limiter: AdaptiveLimiter | None = None, budget: RetryBudget | None = None) -> None:
+        """
+        :param name: The service called, labels its metrics.
+        :param limiter: The concurrency limit, a fresh one if not given.
+        :param budget: The retry budget, a fresh one if not given.
+        """
+        self.name = name
+        self.limiter = limiter or AdaptiveLimiter()
+        self.budget = budget or RetryBudget()
+        self.retries = 0
+        self.overloads = 0
+        self.shed = 0
+        self.unavailable = 0
+
+        labels = (("service", name),)
+        metrics.register_gauge("concurrency_limit", "Calls allowed in flight by the adaptive limiter", lambda: {labels: self.limiter.limit})
+        metrics.register_gauge("calls_in_flight", "Calls in flight to a rate limited service", lambda: {labels: self.limiter.in_flight})
+        metrics.register_counter("call_retries", "Attempts retried after a retryable failure", lambda: {labels: self.retries})
+        metrics.register_counter("call_overloads", "Attempts the service rejected as overloaded", lambda: {labels: self.overloads})
+        metrics.register_counter("calls_shed", "Low priority calls refused while the service was saturated", lambda: {labels: self.shed})
+        metrics.register_counter("calls_unavailable", "Calls given up on at their deadline or for lack of retry budget", lambda: {labels: self.unavailable})
+
+    async def call(self, request: Callable[[], Awaitable[T]], priority: Priority = Priority.HIGH, deadline: float | None = None) -> T:
+        """
+        Makes `request` until it succeeds. Anything it raises other than
+        `Retryable` is passed on as it is.
+
+        :param request: Makes one attempt, raising `Retryable` for failures worth trying again.
+        :param priority: LOW calls are the first refused under pressure.
+        :param deadline: The time.monotonic() to give up at, DEFAULT_DEADLINE from now if not given.
+        :raises Shed: If the call was refused to make room for higher priority ones.
+        :raises Unavailable: If it didn't succeed in time or the retry budget ran out.
+        """
+        deadline = time.monotonic() + DEFAULT_DEADLINE if deadline is None else deadline
+        attempt = 0
+        while True:
+            try:
+                await self.limiter.acquire(priority, deadline)
+            except Shed:
+                self.shed += 1
+                raise
+            except Unavailable:
+                self.unavailable += 1
+                raise
+
+            # A slot granted right at the deadline leaves no time for an attempt
+            timeout = min(ATTEMPT_TIMEOUT, deadline - time.monotonic())
+            if timeout <= 0:
+                self.limiter.release()
+                self.unavailable += 1
+                raise Unavailable(f"{self.name} ran out of time after {attempt} attempt(s)")
+
+            if attempt == 0:
+                # Earned as first tries go out, not as they queue, or a burst would fill the bucket at once
+                self.budget.record_try()
+            retry_after = None
+            started = time.monotonic()
+            try:
+                async with asyncio.timeout(timeout):
+                    result = await request()
+                self.limiter.on_success(time.monotonic() - started)
+                return result
+            except TimeoutError as e:
+                # A service slowing down is as overloaded as one saying so, an
+                # attempt cut short by its deadline says nothing of the service
+                error, overload = e, timeout >= ATTEMPT_TIMEOUT
+            except Retryable as e:
+                error, overload, retry_after = e, e.overload, e.retry_after
+            finally:
+                self.limiter.release()
+
+            if overload:
+                self.overloads += 1
+                self.limiter.on_overload(started)
+            if retry_after is not None:
+                self.limiter.pause(retry_after)
+
+            attempt += 1
+            delay = retry_after if retry_after is not None else random.uniform(0, min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX))
+            if time.monotonic() + delay >= deadline or not self.budget.try_spend():
+                self.unavailable += 1
+                raise Unavailable(f"{self.name} failed after {attempt} attempt(s): {str(error) or type(error).__name__}") from error
+
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+
+def _loop_time(deadline: float) -> float:
+    """A time.monotonic() as the running loop's clock, which needn't be the same."""
+    loop = asyncio.get_running_loop()
+    return loop.time() + deadline - time.monotonic()
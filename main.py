@@ -10,10 +10,21 @@ from ai_engine import GeminiAnalyst
 from mastodon_listener import MastodonClient
 from bluesky import BlueskyClient
 from post_processor import PostProcessor
+from alert import AlertSender
 from market_data import MarketDataProvider
+from retention import RetentionManager, retention_loop
+from dashboard_feed import feed
+from diagnostics import loop_monitor
+from recorder import Recorder
+from price_history import PriceHistorySync, price_history_loop
+from strategy import ASSETS
 import anchors
 
 FETCH_INTERVAL = 5 * 60
+# Posts waiting for the processor before the producers are made to wait too
+QUEUE_SIZE = 10_000
+# Tee every raw input into recordings/ so the traffic can be replayed offline with replay.py
+RECORD_INPUTS = False
 
 async def fetcher_loop(fetcher: RssFetcher):
     while True:
@@ -27,18 +38,25 @@ async def fetcher_loop(fetcher: RssFetcher):
 async def main():
     async with AntiBot() as antibot:
         # --- Component Initialization ---
-        queue = asyncio.Queue()
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
         database = Database()
         analyst = GeminiAnalyst()
+        analyst.require_anchors()
+        # The API embeds search texts through the same provider and limiter
+        app.state.analyst = analyst
         market_provider = MarketDataProvider()
+        retention = RetentionManager()
+        price_sync = PriceHistorySync(database, market_provider, [rules.ticker for rules in ASSETS], feed)
 
         # --- Producer Initialization ---
-        rss_client = RssFetcher(database, antibot, queue)
-        mastodon_client = MastodonClient(queue)
-        bluesky_client = BlueskyClient(queue)
+        recorder = Recorder() if RECORD_INPUTS else None
+        rss_client = RssFetcher(database, antibot, queue, recorder=recorder)
+        mastodon_client = MastodonClient(queue, recorder=recorder)
+        bluesky_client = BlueskyClient(queue, recorder=recorder)
     
         # --- Consumer/Processor Initialization ---
-        processor = PostProcessor(database, analyst, market_provider, queue)
+        alerter = AlertSender(database)
+        processor = PostProcessor(database, analyst, market_provider, queue, alerter)
 
         # --- Uvicorn Server Setup ---
         config = uvicorn.Config(app=app, host="127.0.0.1", port=7777, log_level="info")
@@ -49,7 +67,12 @@ async def main():
             asyncio.create_task(fetcher_loop(rss_client)),
             asyncio.create_task(bluesky_client.listen()),
             asyncio.create_task(processor.process_queue()),
-            asyncio.to_thread(mastodon_client.listen),
+            asyncio.create_task(alerter.run()),
+            asyncio.create_task(analyst.anchor_store.watch()),
+            asyncio.create_task(retention_loop(retention)),
+            asyncio.create_task(loop_monitor.run()),
+            asyncio.create_task(price_history_loop(price_sync)),
+            asyncio.create_task(mastodon_client.listen()),
             asyncio.create_task(server.serve()),
         ]
         
@@ -1,14 +1,20 @@
 import yfinance as yf
 from datetime import datetime, timedelta
+from typing import Dict
+import time
 import pandas as pd
 
+# How long fetched indicators are reused, one bar of the default interval
+INDICATOR_TTL = 5 * 60
+
 class MarketDataProvider:
     """
     Provides live market data for financial assets using yfinance.
     """
     def __init__(self):
-        # yfinance can be used without any initial setup
-        pass
+        # yfinance can be used without any initial setup.
+        # Latest indicators per (ticker, period, interval) with their fetch time, shared by every strategy
+        self._indicator_cache: Dict[tuple[str, str, str], tuple[float, pd.Series | None]] = {}
 
     def get_current_price(self, ticker: str) -> float | None:
         """
@@ -87,6 +93,27 @@ class MarketDataProvider:
 
         return hist_df
 
+    def get_latest_indicators(self, ticker: str, period: str = "10d", interval: str = "5m") -> pd.Series | None:
+        """
+        The most recent row of `get_technical_indicators` for a ticker. Each
+        ticker is fetched at most once per INDICATOR_TTL however many
+        strategies ask for it.
+
+        :param ticker: The ticker symbol (e.g., 'SI=F').
+        :param period: The period of history to compute indicators over.
+        :param interval: The bar interval.
+        :return: A Series with 'Close', 'MA20', 'MA50' and 'RSI', or None if no data could be fetched.
+        """
+        key = (ticker, period, interval)
+        cached = self._indicator_cache.get(key)
+        if cached is not None and time.time() - cached[0] < INDICATOR_TTL:
+            return cached[1]
+
+        hist_df = self.get_historical_data(ticker=ticker, period=period, interval=interval)
+        latest = None if hist_df is None or hist_df.empty else self.get_technical_indicators(hist_df).iloc[-1]
+        self._indicator_cache[key] = (time.time(), latest)
+        return latest
+
 
 if __name__ == '__main__':
     # Example usage:
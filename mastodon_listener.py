@@ -1,60 +1,175 @@
-from mastodon import Mastodon, StreamListener
+from dataclasses import dataclass
+from collections import OrderedDict
+from typing import Dict, List
+from urllib.parse import urlencode
 
+import aiohttp
 import asyncio
+import orjson
+import random
 from domain.post import Post
+from metrics import metrics
+from recorder import Recorder
 from html_to_markdown import convert
 from bs4 import BeautifulSoup
 from env import MASTODON_ACCESS_TOKEN
 
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+# How many status URIs to remember when deduplicating across instances, least recently seen forgotten first
+SEEN_URIS_SIZE = 50_000
+
+
+@dataclass
+class MastodonStream:
+    """
+    A single streaming subscription.
+
+    timeline is one of "public", "public:local", "hashtag" or "list".
+    For "hashtag" and "list", `param` is the tag or the list id.
+    """
+    instance: str
+    timeline: str = "public"
+    param: str | None = None
+    access_token: str | None = None
+
+    def get_url(self) -> str:
+        path = self.timeline.replace(":", "/")
+        url = f"https://{self.instance}/api/v1/streaming/{path}"
+        if self.timeline == "hashtag":
+            url += "?" + urlencode({"tag": self.param})
+        elif self.timeline == "list":
+            url += "?" + urlencode({"list": self.param})
+        return url
+
+
+MASTODON_STREAMS = [
+    MastodonStream("mastodon.social", "public", access_token=MASTODON_ACCESS_TOKEN),
+]
+
+
+def status_to_post(status: Dict, instance: str) -> Post:
+    content = status["content"]
+
+    external_links = []
+    soup = BeautifulSoup(content, "html.parser")
+    for a in soup.find_all("a", href=True):
+        classes = a.get("class") or []
+        if "mention" not in classes and "hashtag" not in classes:
+            link = a["href"]
+            if link not in external_links:
+                external_links.append(link)
+
+    # Local accounts have no domain in their acct, qualify them so the same
+    # author looks the same no matter which instance we saw them on
+    acct = status["account"]["acct"]
+    if "@" not in acct:
+        acct = f"{acct}@{instance}"
+
+    return Post(
+        status["uri"],
+        acct,
+        convert(content),
+        external_links
+    )
+
 
 class MastodonClient:
-    def __init__(self, queue: asyncio.Queue[Post]) -> None:
+    def __init__(self, queue: asyncio.Queue[Post], streams: List[MastodonStream] = MASTODON_STREAMS, recorder: Recorder | None = None) -> None:
+        """
+        :param queue: The queue posts are pushed onto.
+        :param streams: The instances and timelines to subscribe to concurrently.
+        :param recorder: If given, every status received is recorded for replay.
+        """
         self.queue = queue
-        self.client = Mastodon(
-            access_token=MASTODON_ACCESS_TOKEN,
-            api_base_url="https://mastodon.social"
-        )
-        
-    def listen(self):       
-        self.client.stream_public(
-            MastodonListener(self.queue), 
-            run_async=True,
-            reconnect_async=True
-        )
-                
-        
-
-class MastodonListener(StreamListener):
-    def __init__(self, queue: asyncio.Queue[Post]) -> None:
-        super().__init__()
-        self.queue = queue
-        
-    def on_update(self, status):
-        content = status["content"]
-        
-        external_links = []
-        soup = BeautifulSoup(content, "html.parser")
-        for a in soup.find_all("a", href=True):
-            classes = a.get("class") or []
-            if "mention" not in classes and "hashtag" not in classes:
-                link = a["href"]
-                if link not in external_links:
-                    external_links.append(link)
-            
-        post = Post(
-            status.uri,
-            status["account"]["acct"],
-            convert(content),
-            external_links
-        )
-
-        self.queue.put_nowait(post)
-
-
-def main():
+        self.streams = streams
+        self.recorder = recorder
+        self.seen_uris: OrderedDict[str, None] = OrderedDict()
+        self.last_event_ids: Dict[str, str] = {}
+
+    async def listen(self):
+        """Streams every configured timeline concurrently over one pooled session."""
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=120)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await asyncio.gather(*[self._listen_stream(session, stream) for stream in self.streams])
+
+    async def _listen_stream(self, session: aiohttp.ClientSession, stream: MastodonStream):
+        url = stream.get_url()
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            headers = {"Accept": "text/event-stream"}
+            if stream.access_token:
+                headers["Authorization"] = f"Bearer {stream.access_token}"
+            if url in self.last_event_ids:
+                headers["Last-Event-ID"] = self.last_event_ids[url]
+
+            try:
+                async with session.get(url, headers=headers) as response:
+                    response.raise_for_status()
+                    print(f"Mastodon connected to {url}")
+                    delay = RECONNECT_MIN_DELAY
+                    await self._read_events(response, stream, url)
+            except Exception as e:
+                print(f"[Mastodon Error] {url}: {e}")
+
+            sleep_for = random.uniform(0, delay)
+            await asyncio.sleep(sleep_for)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def _read_events(self, response: aiohttp.ClientResponse, stream: MastodonStream, url: str):
+        """Parses the server-sent event stream, dispatching each complete event."""
+        event = None
+        data = []
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8").rstrip("\r\n")
+
+            if line == "":
+                if event is not None and data:
+                    try:
+                        await self.handle_event(event, "\n".join(data), stream.instance)
+                    except Exception as e:
+                        # One malformed status shouldn't cost the connection
+                        metrics.inc("events_failed", "Stream events that couldn't be handled", source="mastodon")
+                        print(f"[Mastodon Error] {url}: bad {event} event: {e}")
+                event = None
+                data = []
+            elif line.startswith(":"):
+                continue  # heartbeat
+            elif line.startswith("event:"):
+                event = line[6:].strip()
+            elif line.startswith("data:"):
+                data.append(line[5:].lstrip())
+            elif line.startswith("id:"):
+                self.last_event_ids[url] = line[3:].strip()
+
+    async def handle_event(self, event: str, data: str, instance: str):
+        if event != "update":
+            return
+        if self.recorder is not None:
+            self.recorder.record("mastodon", data, instance=instance)
+
+        status = orjson.loads(data)
+        uri = status["uri"]
+        if uri in self.seen_uris:
+            # Boosted or federated again, keep it around as long as it's still going
+            self.seen_uris.move_to_end(uri)
+            return
+        self.seen_uris[uri] = None
+        if len(self.seen_uris) > SEEN_URIS_SIZE:
+            self.seen_uris.popitem(last=False)
+
+        with metrics.time("ingest", source="mastodon"):
+            post = status_to_post(status, instance)
+            post.source = "mastodon"
+            await self.queue.put(post)
+        metrics.inc("posts_ingested", "Posts queued for processing", source="mastodon")
+
+
+async def main():
     queue = asyncio.Queue()
     client = MastodonClient(queue)
-    client.listen()
+    await client.listen()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
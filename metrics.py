@@ -0,0 +1,216 @@
+"""
+In-process metrics, served in the Prometheus text format on /metrics.
+
+Latencies go into log-linear histograms: every power of two of nanoseconds
+is split into SUB_BUCKETS buckets, so any recorded value is kept to within
+about 9% whether it took a microsecond or a minute. Recording is a few
+integer operations on a preallocated list, no locks and no allocation, so
+stages can be timed on every post. Counters that change on every firehose
+frame are left as plain attributes on their owner and read at scrape time
+through `register_counter`.
+
+Everything is recorded from the event loop thread.
+"""
+from typing import Callable, Dict, List
+
+import time
+
+PREFIX = "balthazar"
+
+# The pipeline stages a post goes through, in order
+STAGES = ["ingest", "relevance", "dedup", "prescore", "embed", "classify", "db_write", "decide", "alert"]
+# Stages that cost very different amounts per source, a Chromium page load against a JSON decode,
+# are timed per source
+SOURCES = ["bluesky", "mastodon", "rss"]
+SOURCE_STAGES = ["ingest"]
+
+# Buckets per power of two, must be a power of two itself
+SUB_BUCKETS = 8
+SUB_BITS = SUB_BUCKETS.bit_length() - 1
+# Values from 2^10 ns (~1µs) to 2^43 ns (~2.4h), anything outside is clamped to the ends
+MIN_EXPONENT = 10
+MAX_EXPONENT = 43
+
+QUANTILES = [0.5, 0.9, 0.99, 0.999]
+
+
+class LatencyHistogram:
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * ((MAX_EXPONENT - MIN_EXPONENT) * SUB_BUCKETS)
+        self.count = 0
+        self.sum_ns = 0
+
+    def record_ns(self, ns: int):
+        exponent = ns.bit_length() - 1
+        if exponent < MIN_EXPONENT:
+            index = 0
+        elif exponent >= MAX_EXPONENT:
+            index = len(self.counts) - 1
+        else:
+            # The bits right below the leading one pick the sub bucket
+            index = (exponent - MIN_EXPONENT) * SUB_BUCKETS + ((ns >> (exponent - SUB_BITS)) & (SUB_BUCKETS - 1))
+        self.counts[index] += 1
+        self.count += 1
+        self.sum_ns += ns
+
+    def record(self, seconds: float):
+        # Wall clock differences can come out negative if the clock steps
+        self.record_ns(max(int(seconds * 1e9), 0))
+
+    def quantile(self, q: float) -> float:
+        """The value at quantile `q` in seconds, the middle of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                lower, upper = _bucket_bounds(index)
+                return (lower + upper) / 2 / 1e9
+        return _bucket_bounds(len(self.counts) - 1)[1] / 1e9
+
+    def octaves(self) -> List[tuple[float, int]]:
+        """Cumulative counts at every power of two, as (upper bound in seconds, count) pairs."""
+        cumulative = []
+        seen = 0
+        for octave in range(MAX_EXPONENT - MIN_EXPONENT):
+            seen += sum(self.counts[octave * SUB_BUCKETS:(octave + 1) * SUB_BUCKETS])
+            cumulative.append((2 ** (MIN_EXPONENT + octave + 1) / 1e9, seen))
+        return cumulative
+
+
+class Timer:
+    """
+    Times a block into a histogram, usable around awaits:
+
+        with metrics.time("embed"):
+            embedding = await analyst.get_embedding(text)
+    """
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: LatencyHistogram) -> None:
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.record_ns(time.perf_counter_ns() - self.start)
+
+    # So it can share an `async with` with the block it times
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
+
+
+class Metrics:
+    def __init__(self) -> None:
+        # name -> (help, labels -> histogram)
+        self.histograms: Dict[str, tuple[str, Dict[tuple, LatencyHistogram]]] = {}
+        # name -> (help, labels -> value)
+        self.counters: Dict[str, tuple[str, Dict[tuple, float]]] = {}
+        # name -> (help, type, callback returning labels -> value)
+        self.callbacks: Dict[str, tuple[str, str, Callable[[], Dict[tuple, float]]]] = {}
+
+        self.stages = {stage: self.histogram("stage_latency_seconds", "Time spent in each pipeline stage", stage=stage) for stage in STAGES if stage not in SOURCE_STAGES}
+        self.source_stages = {
+            (stage, source): self.histogram("stage_latency_seconds", "Time spent in each pipeline stage", stage=stage, source=source)
+            for stage in SOURCE_STAGES
+            for source in SOURCES
+        }
+
+    def histogram(self, name: str, help: str, **labels: str) -> LatencyHistogram:
+        """The histogram for `name` and `labels`, created on first use. Keep a reference on hot paths."""
+        _, series = self.histograms.setdefault(name, (help, {}))
+        key = tuple(labels.items())
+        if key not in series:
+            series[key] = LatencyHistogram()
+        return series[key]
+
+    def time(self, stage: str, source: str | None = None) -> Timer:
+        """
+        :param source: Where the post came from, for the SOURCE_STAGES.
+        """
+        return Timer(self.stages[stage] if source is None else self.source_stages[stage, source])
+
+    def observe(self, stage: str, seconds: float, source: str | None = None):
+        (self.stages[stage] if source is None else self.source_stages[stage, source]).record(seconds)
+
+    def inc(self, name: str, help: str, amount: float = 1, **labels: str):
+        _, series = self.counters.setdefault(name, (help, {}))
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + amount
+
+    def register_counter(self, name: str, help: str, callback: Callable[[], Dict[tuple, float]]):
+        """
+        A counter read from `callback` at scrape time, for counts kept where
+        they happen. The callback returns values keyed by label tuples, such
+        as {(("source", "bluesky"), ): 12}.
+        """
+        self.callbacks[name] = (help, "counter", callback)
+
+    def register_gauge(self, name: str, help: str, callback: Callable[[], Dict[tuple, float]]):
+        """A gauge read from `callback` at scrape time, keyed like `register_counter`."""
+        self.callbacks[name] = (help, "gauge", callback)
+
+    def render(self) -> str:
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+
+        for name, (help, series) in self.counters.items():
+            _header(lines, f"{name}_total", help, "counter")
+            for labels, value in series.items():
+                lines.append(f"{PREFIX}_{name}_total{_labels(labels)} {value:g}")
+
+        for name, (help, kind, callback) in self.callbacks.items():
+            try:
+                series = callback()
+            except Exception as e:
+                print(f"[Metrics Error] {name}: {e}")
+                continue
+            full_name = f"{name}_total" if kind == "counter" else name
+            _header(lines, full_name, help, kind)
+            for labels, value in series.items():
+                lines.append(f"{PREFIX}_{full_name}{_labels(labels)} {value:g}")
+
+        for name, (help, series) in self.histograms.items():
+            _header(lines, name, help, "histogram")
+            for labels, histogram in series.items():
+                for upper, count in histogram.octaves():
+                    lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', f'{upper:g}'), ))} {count}")
+                lines.append(f"{PREFIX}_{name}_bucket{_labels(labels + (('le', '+Inf'), ))} {histogram.count}")
+                lines.append(f"{PREFIX}_{name}_sum{_labels(labels)} {histogram.sum_ns / 1e9:g}")
+                lines.append(f"{PREFIX}_{name}_count{_labels(labels)} {histogram.count}")
+
+            # Precise quantiles from the fine buckets, the octave buckets above are coarse
+            _header(lines, f"{name}_quantile", f"{help}, by quantile", "gauge")
+            for labels, histogram in series.items():
+                for q in QUANTILES:
+                    lines.append(f"{PREFIX}_{name}_quantile{_labels(labels + (('quantile', f'{q:g}'), ))} {histogram.quantile(q):g}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _bucket_bounds(index: int) -> tuple[int, int]:
+    """The range of nanoseconds a bucket holds."""
+    octave, sub = divmod(index, SUB_BUCKETS)
+    base = 2 ** (MIN_EXPONENT + octave)
+    width = base // SUB_BUCKETS
+    return base + sub * width, base + (sub + 1) * width
+
+def _header(lines: List[str], name: str, help: str, kind: str):
+    lines.append(f"# HELP {PREFIX}_{name} {help}")
+    lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+metrics = Metrics()
@@ -1,51 +1,200 @@
 from db import Database
 from ai_engine import GeminiAnalyst
 from domain.post import Post
-from strategy import Strategy, Signal
+from strategy import Strategy, StrategyRegistry, Signal
+from anchor_store import LEGACY_ASSET
+from chunking import DocumentEmbedding
+from typing import Dict, Set
 from alert import AlertSender
 from market_data import MarketDataProvider
+from dedup import NearDuplicateDetector
+from heuristics import SHORTLIST_ACCOUNTS
+from limiter import Priority, Shed, Unavailable
+from event_alerts import EventAlerter
+from dashboard_feed import feed
+from metrics import metrics
 import asyncio
+import time
+
+# "decision" alerts on each debounced strategy decision, "event" alerts once
+# per story and updates that alert as more posts corroborate it
+ALERT_MODE = "decision"
+# "drop" discards near-duplicates, "attach" also records them against the first copy
+DUPLICATE_MODE = "drop"
+
+# Posts being embedded and classified at once, the limiter decides how many Gemini requests that makes
+MAX_CONCURRENT_POSTS = 256
+# Seconds before a post Gemini couldn't embed in time is tried again
+EMBED_RETRY_DELAY = 30
+# Times a post is put off before it's dropped, so an outage can't hold every slot for good
+MAX_EMBED_DELAYS = 4
 
 
 class PostProcessor:
-    def __init__(self, db: Database, analyst: GeminiAnalyst, market_provider: MarketDataProvider, queue: asyncio.Queue[Post]) -> None:
+    def __init__(self, db: Database, analyst: GeminiAnalyst, market_provider: MarketDataProvider, queue: asyncio.Queue[Post], alerter: AlertSender | None = None, deduplicator: NearDuplicateDetector | None = None, alert_mode: str = ALERT_MODE, duplicate_mode: str = DUPLICATE_MODE) -> None:
         self.db = db
         self.analyst = analyst
         self.queue = queue
-        self.strategy = Strategy(market_provider=market_provider)
-        self.alerter = AlertSender()
-        
+        self.deduplicator = deduplicator or NearDuplicateDetector()
+        self.strategies = StrategyRegistry(market_provider)
+        self.alerter = alerter or AlertSender(db)
+        self.decision_tasks: Dict[str, asyncio.Task] = {}
+        self.in_flight: Set[asyncio.Task] = set()
+        self.slots = asyncio.Semaphore(MAX_CONCURRENT_POSTS)
+        if alert_mode not in ("decision", "event"):
+            raise ValueError("alert_mode must be 'decision' or 'event'")
+        self.event_alerter = EventAlerter(db, self.alerter) if alert_mode == "event" else None
+        if duplicate_mode not in ("drop", "attach"):
+            raise ValueError("duplicate_mode must be 'drop' or 'attach'")
+        self.duplicate_mode = duplicate_mode
+
+        metrics.register_gauge("queue_depth", "Posts waiting to be processed", lambda: {(): self.queue.qsize()})
+        metrics.register_gauge("posts_in_flight", "Posts being embedded and classified", lambda: {(): len(self.in_flight)})
+        metrics.register_gauge("pending_decisions", "Assets waiting for their decision window to close", lambda: {(): sum(not task.done() for task in self.decision_tasks.values())})
+        self.post_to_signal = metrics.histogram("post_to_signal_seconds", "From a post arriving to its signal being stored")
+
     async def process_queue(self):
         """
         Continuously processes posts from the queue, generates signals,
-        logs them, and makes trading decisions.
+        logs them, and makes trading decisions. Posts are embedded
+        concurrently, up to MAX_CONCURRENT_POSTS, so they go to Gemini as fast
+        as its quota allows. Returns at a None, once the posts before it are done.
         """
         while post := await self.queue.get():
-            # 1. Generate embedding for the post content
-            payload = f"Post by author {post.author_id}. Content: {post.content}"
-            embedding = await self.analyst.get_embedding(payload)
+            # 0. Reworded copies of a story we've already classified cost nothing
+            with metrics.time("dedup"):
+                original = self.deduplicator.find(post)
+            if original is not None:
+                metrics.inc("posts_duplicate", "Posts dropped as near-duplicates", source=post.source)
+                if self.duplicate_mode == "attach":
+                    with metrics.time("db_write"):
+                        self.db.add_duplicate(original.url, post.url, post.source)
+                continue
 
-            if embedding is None:
+            # 1. Posts the local pre-score rules out never cost an embedding
+            payload = f"Post by author {post.author_id}. Content: {post.content}"
+            with metrics.time("prescore"):
+                worth_embedding = self.analyst.worth_embedding(payload)
+            if not worth_embedding:
+                metrics.inc("posts_prescored_out", "Posts the local pre-score judged not worth embedding", source=post.source)
                 continue
 
-            # 2. Get the signal from the embedding
-            initial_signal = self.analyst.get_signal_from_embedding(embedding)
+            await self.slots.acquire()
+            task = asyncio.create_task(self._process_post(post, payload))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+        if self.in_flight:
+            await asyncio.gather(*self.in_flight)
+
+    async def _process_post(self, post: Post, payload: str):
+        try:
+            # 2. Generate embedding for the post content, long articles as pooled passages
+            document = await self._embed(post, payload)
+            if document is None:
+                return
+            embedding = document.embedding
+
+            # 3. Get every asset's signal from the embedding in one pass
+            with metrics.time("classify"):
+                signals = self.analyst.get_signals_from_embedding(embedding)
+            initial_signal = signals.get(LEGACY_ASSET, Signal.HOLD)
             
-            # 3. Log the signal to the database for future backtesting
-            self.db.add_historical_signal(
-                url=post.url,
-                embedding=embedding,
-                signal=initial_signal.name  # Store 'BUY', 'SELL', or 'HOLD'
-            )
-
-            # 4. Only consider BUY or SELL signals for the active strategy
-            if initial_signal in [Signal.BUY, Signal.SELL]:
-                print(f"Signal received: {initial_signal.name} | Post: {post.url}")
-
-                self.strategy.add_signal(initial_signal, post)
-                final_decision = self.strategy.decide()
-
-                if final_decision != Signal.HOLD:
-                    latest_post = self.strategy.recent_signals[-1]['post']
-                    await self.alerter.send_decision_alert(final_decision, latest_post)
-                    self.strategy.record_action(final_decision)
\ No newline at end of file
+            # 4. Log the signal to the database for future backtesting
+            with metrics.time("db_write"):
+                self.db.add_historical_signal(
+                    url=post.url,
+                    embedding=embedding,
+                    signal=initial_signal.name  # Store 'BUY', 'SELL', or 'HOLD'
+                )
+                if document.chunks:
+                    self.db.add_document_chunks(post.url, document.chunks)
+            # Only now an original, a post that's shed or never embedded mustn't take its copies down with it
+            self.deduplicator.add(post)
+            self.post_to_signal.record(time.time() - post.received)
+            metrics.inc("posts_classified", "Posts embedded and classified", source=post.source, signal=initial_signal.name)
+            feed.publish_signal(initial_signal.name)
+
+            # 5. In event mode the story, not the post, is what alerts
+            if self.event_alerter is not None:
+                await self.event_alerter.add_post(post, embedding, signals)
+                return
+
+            # 6. Only consider BUY or SELL signals for the active strategies
+            for ticker, signal in signals.items():
+                strategy = self.strategies.get(ticker)
+                if strategy is None or signal not in [Signal.BUY, Signal.SELL]:
+                    continue
+
+                print(f"Signal received: {signal.name} {ticker} | Post: {post.url}")
+                strategy.add_signal(signal, post)
+
+                # 7. A burst of posts is decided once per asset, when its window closes
+                task = self.decision_tasks.get(ticker)
+                if task is None or task.done():
+                    self.decision_tasks[ticker] = asyncio.create_task(self._decide_after_window(strategy))
+        except Exception as e:
+            print(f"[Processor Error] {post.url}: {e}")
+        finally:
+            self.slots.release()
+
+    async def _embed(self, post: Post, payload: str) -> DocumentEmbedding | None:
+        """
+        The post's embedding, retried up to MAX_EMBED_DELAYS times until Gemini
+        has time for it, or None if it's shed or can't be embedded.
+        """
+        priority = post_priority(post)
+        for delays in range(MAX_EMBED_DELAYS + 1):
+            try:
+                with metrics.time("embed"):
+                    document = await self.analyst.embed_document(payload, priority)
+            except Shed:
+                metrics.inc("posts_shed", "Low priority posts dropped while Gemini was saturated", source=post.source)
+                return None
+            except Unavailable as e:
+                if delays == MAX_EMBED_DELAYS:
+                    metrics.inc("posts_unavailable", "Posts dropped after Gemini couldn't embed them in time, again and again", source=post.source)
+                    print(f"Couldn't embed {post.url} ({e}), giving up")
+                    return None
+                # Late, not lost
+                metrics.inc("embedding_delays", "Posts put off because Gemini couldn't embed them in time", source=post.source)
+                print(f"Couldn't embed {post.url} ({e}), trying again in {EMBED_RETRY_DELAY}s")
+                await asyncio.sleep(EMBED_RETRY_DELAY)
+                continue
+
+            if document is None:
+                metrics.inc("embedding_failures", "Posts dropped because they couldn't be embedded", source=post.source)
+            return document
+
+    async def _decide_after_window(self, strategy: Strategy):
+        # Signals that arrive while a decision is being alerted find this task
+        # still running and start none of their own, so they're decided here too
+        while strategy.pending_since is not None:
+            # Every new signal pushes the decision back, a burst is decided once it goes quiet
+            while (delay := strategy.decision_delay()) > 0:
+                await asyncio.sleep(delay)
+            await self._decide(strategy)
+
+    async def _decide(self, strategy: Strategy):
+        try:
+            with metrics.time("decide"):
+                final_decision = strategy.decide()
+            metrics.inc("decisions", "Strategy decisions", asset=strategy.rules.ticker, decision=final_decision.name)
+            feed.publish_decision(strategy.rules.ticker, final_decision.name, strategy.score())
+
+            if final_decision != Signal.HOLD:
+                latest_post = strategy.latest_post(final_decision)
+                if latest_post is None:
+                    # The posts behind the score have aged out of the history, there's nothing to cite
+                    print(f"[Strategy Error]: {final_decision.name} {strategy.rules.ticker} has no post carrying it, not alerting")
+                    return
+                await self.alerter.send_decision_alert(final_decision, latest_post, strategy.rules)
+                strategy.record_action(final_decision)
+        except Exception as e:
+            print(f"[Strategy Error]: {e}")
+
+def post_priority(post: Post) -> Priority:
+    """Shortlisted accounts and the official feeds are embedded first, the rest of the firehose gives way to them."""
+    if post.source == "rss" or post.author_id in SHORTLIST_ACCOUNTS:
+        return Priority.HIGH
+    return Priority.LOW
@@ -0,0 +1,228 @@
+"""
+Local price history at several resolutions.
+
+Bars are downloaded once per resolution and then topped up incrementally,
+so charts are served from SQLite and never wait on a live download.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List
+
+import asyncio
+import gzip
+import hashlib
+import time
+import numpy as np
+import orjson
+from numpy.typing import NDArray
+
+from db import Database
+from market_data import MarketDataProvider
+from dashboard_feed import DashboardFeed, PRICE_TICKER
+
+DAY = 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class Resolution:
+    """
+    A bar size as yfinance names it, with how far back it can be
+    downloaded, how much to re-download on each refresh and how long to
+    keep it. Coarser resolutions cover what finer ones drop.
+    """
+    name: str
+    seconds: int
+    backfill_period: str
+    refresh_period: str
+    refresh_interval: int
+    keep_seconds: int | None = None
+
+
+RESOLUTIONS = [
+    Resolution("1m", 60, "7d", "1d", 60, keep_seconds=30 * DAY),
+    Resolution("5m", 5 * 60, "60d", "1d", 5 * 60, keep_seconds=365 * DAY),
+    Resolution("1h", 60 * 60, "730d", "5d", 60 * 60),
+    Resolution("1d", DAY, "max", "1mo", 6 * 60 * 60),
+]
+RESOLUTIONS_BY_NAME = {resolution.name: resolution for resolution in RESOLUTIONS}
+
+SYNC_INTERVAL = 60
+
+DEFAULT_RANGE = DAY
+DEFAULT_POINTS = 1000
+MAX_POINTS = 10_000
+# Bars read per requested point when picking a resolution automatically
+AUTO_BARS_PER_POINT = 4
+
+CACHE_SIZE = 256
+# Cached responses are rebuilt after this long even if no bars changed
+CACHE_TTL = 60
+GZIP_MIN_SIZE = 1024
+
+# Bumped whenever bars of (ticker, resolution) are written, invalidating cached responses
+_versions: Dict[tuple[str, str], int] = {}
+
+
+class PriceHistorySync:
+    def __init__(self, db: Database, market_provider: MarketDataProvider, tickers: List[str], feed: DashboardFeed | None = None) -> None:
+        """
+        :param db: Where bars are stored.
+        :param market_provider: Where bars are downloaded from.
+        :param tickers: The tickers to keep history for.
+        :param feed: If given, new one-minute bars of PRICE_TICKER are pushed to the dashboard.
+        """
+        self.db = db
+        self.market_provider = market_provider
+        self.tickers = tickers
+        self.feed = feed
+        self.last_refresh: Dict[tuple[str, str], float] = {}
+
+    async def sync(self):
+        """Refreshes every (ticker, resolution) whose refresh interval has passed."""
+        now = time.time()
+        for ticker in self.tickers:
+            for resolution in RESOLUTIONS:
+                key = (ticker, resolution.name)
+                if now - self.last_refresh.get(key, 0) < resolution.refresh_interval:
+                    continue
+                self.last_refresh[key] = now
+                try:
+                    await self._sync_one(ticker, resolution)
+                except Exception as e:
+                    print(f"[Price History Error] {ticker} {resolution.name}: {e}")
+
+    async def _sync_one(self, ticker: str, resolution: Resolution):
+        # The first download goes back as far as the resolution allows, later ones only overlap the end
+        backfill = self.db.get_last_price_bar_time(ticker, resolution.name) is None
+        period = resolution.backfill_period if backfill else resolution.refresh_period
+
+        hist_df = await asyncio.to_thread(self.market_provider.get_historical_data, ticker=ticker, period=period, interval=resolution.name)
+        if hist_df is None or hist_df.empty:
+            return
+
+        times = hist_df.index.as_unit("s").asi8
+        columns = [hist_df[column].to_numpy(dtype=np.float64) for column in ("Open", "High", "Low", "Close", "Volume")]
+        bars = [(int(t), *(float(value) for value in values)) for t, *values in zip(times, *columns)]
+        self.db.upsert_price_bars(ticker, resolution.name, bars)
+
+        if resolution.keep_seconds is not None:
+            self.db.delete_price_bars_before(ticker, resolution.name, int(time.time()) - resolution.keep_seconds)
+
+        _versions[(ticker, resolution.name)] = _versions.get((ticker, resolution.name), 0) + 1
+        if backfill:
+            print(f"Backfilled {len(bars)} {resolution.name} bars for {ticker}")
+
+        if self.feed is not None and ticker == PRICE_TICKER and resolution.name == "1m":
+            self.feed.publish_prices([[bar[0] * 1000, bar[4]] for bar in bars])
+
+
+async def price_history_loop(sync: PriceHistorySync):
+    while True:
+        await sync.sync()
+        await asyncio.sleep(SYNC_INTERVAL)
+
+
+def lttb(times: NDArray, values: NDArray, threshold: int) -> tuple[NDArray, NDArray]:
+    """
+    Largest-Triangle-Three-Buckets downsampling to `threshold` points. Keeps
+    the first and last point and, from each bucket in between, the point
+    forming the largest triangle with the previous pick and the next
+    bucket's average, which preserves the peaks and troughs of the line.
+    """
+    n = len(times)
+    if threshold >= n or threshold < 3:
+        return times, values
+
+    x = times.astype(np.float64)
+    y = values.astype(np.float64)
+    # Bucket edges over the points between the fixed first and last
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[next_start:max(next_end, next_start + 1)].mean()
+        next_y = y[next_start:max(next_end, next_start + 1)].mean()
+
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        picked[i + 1] = a
+
+    return times[picked], values[picked]
+
+
+def pick_resolution(start: int, end: int, points: int) -> Resolution:
+    """The finest resolution that doesn't read more than AUTO_BARS_PER_POINT bars per point."""
+    now = time.time()
+    for resolution in RESOLUTIONS:
+        covers = resolution.keep_seconds is None or start >= now - resolution.keep_seconds
+        if covers and (end - start) / resolution.seconds <= points * AUTO_BARS_PER_POINT:
+            return resolution
+    return RESOLUTIONS[-1]
+
+
+@dataclass
+class CachedResponse:
+    version: int
+    created: float
+    etag: str
+    body: bytes
+    gzipped: bytes | None
+
+
+class PriceHistoryCache:
+    """Serialized, compressed /api/price-history responses, rebuilt only when their bars change."""
+
+    def __init__(self, db: Database, size: int = CACHE_SIZE) -> None:
+        self.db = db
+        self.size = size
+        self.entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+
+    def get(self, ticker: str, resolution: str | None, start: int | None, end: int | None, range_seconds: int, points: int) -> CachedResponse:
+        """
+        :param ticker: The ticker to chart.
+        :param resolution: One of RESOLUTIONS by name, or None to pick one for the range.
+        :param start: Range start in epoch milliseconds, defaults to `range_seconds` before `end`.
+        :param end: Range end in epoch milliseconds, defaults to now.
+        :param range_seconds: Length of the range when `start` isn't given.
+        :param points: Max points to return.
+        """
+        if resolution is not None and resolution not in RESOLUTIONS_BY_NAME:
+            raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS_BY_NAME)}")
+        points = max(3, min(points, MAX_POINTS))
+
+        key = (ticker, resolution, start, end, range_seconds, points)
+        entry = self.entries.get(key)
+        version = sum(_versions.get((ticker, r.name), 0) for r in RESOLUTIONS)
+        if entry is not None and entry.version == version and time.time() - entry.created < CACHE_TTL:
+            self.entries.move_to_end(key)
+            return entry
+
+        end_s = int(time.time()) if end is None else end // 1000
+        start_s = end_s - range_seconds if start is None else start // 1000
+        chosen = RESOLUTIONS_BY_NAME[resolution] if resolution is not None else pick_resolution(start_s, end_s, points)
+
+        times, closes = self.db.get_price_closes(ticker, chosen.name, start_s, end_s)
+        times, closes = lttb(times * 1000, closes, points)
+        body = orjson.dumps({
+            "ticker": ticker,
+            "resolution": chosen.name,
+            # Timestamps stay integers, a stacked float array would send them as 1.7e12
+            "prices": [[int(t), c] for t, c in zip(times, closes.tolist())],
+        })
+
+        entry = CachedResponse(
+            version,
+            time.time(),
+            '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"',
+            body,
+            gzip.compress(body, compresslevel=5) if len(body) >= GZIP_MIN_SIZE else None,
+        )
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return entry
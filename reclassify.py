@@ -0,0 +1,88 @@
+"""
+Re-labels every stored historical signal against a candidate anchor set.
+
+Usage:
+    python reclassify.py VERSION [--anchors PATH] [--threshold 0.4] [--against VERSION] [--apply]
+
+Labels are written to `signal_labels` under VERSION and compared with the
+live labels (or another stored version) in a confusion matrix. With --apply
+they also replace the live labels in `historical_signals`.
+"""
+from db import Database
+from vectors import max_similarities, classify_similarities
+from anchor_store import ANCHOR_STORE_DIR, open_anchor_set
+
+import argparse
+import numpy as np
+
+CHUNK_SIZE = 5000
+LABELS = ["BUY", "SELL", "HOLD"]
+
+
+def reclassify(db: Database, version: str, anchor_path: str, threshold: float, against: str | None = None, apply: bool = False) -> np.ndarray:
+    """
+    Streams embeddings in chunks, labels them with one matrix product per
+    anchor category and writes the labels in bulk.
+    Returns the confusion matrix with rows for `against` and columns for `version`.
+    """
+    anchors = open_anchor_set(anchor_path)
+    buy_anchors = anchors.category("buy")
+    sell_anchors = anchors.category("sell")
+    noise_anchors = anchors.category("noise")
+
+    confusion = np.zeros((len(LABELS), len(LABELS)), dtype=np.int64)
+    total = 0
+
+    for urls, signals, embeddings in db.iter_signal_embeddings(CHUNK_SIZE):
+        labels = classify_similarities(
+            max_similarities(embeddings, buy_anchors),
+            max_similarities(embeddings, sell_anchors),
+            max_similarities(embeddings, noise_anchors),
+            threshold,
+        )
+
+        if against is not None:
+            previous = db.get_signal_labels(against, urls)
+            signals = [previous.get(url) for url in urls]
+
+        pairs = [(LABELS.index(old), LABELS.index(new)) for old, new in zip(signals, labels) if old in LABELS]
+        if pairs:
+            rows, columns = zip(*pairs)
+            np.add.at(confusion, (list(rows), list(columns)), 1)
+
+        new_labels = list(zip(urls, labels.tolist()))
+        db.add_signal_labels(version, new_labels)
+        if apply:
+            db.set_historical_signal_labels(version, new_labels)
+
+        total += len(urls)
+        print(f"Relabelled {total} signals...", end="\r")
+
+    print()
+    return confusion
+
+def print_confusion(confusion: np.ndarray, old: str, new: str):
+    print(f"rows: {old}, columns: {new}")
+    print(" " * 6 + "".join(f"{label:>10}" for label in LABELS))
+    for label, row in zip(LABELS, confusion):
+        print(f"{label:>6}" + "".join(f"{count:>10}" for count in row))
+
+    changed = confusion.sum() - np.trace(confusion)
+    print(f"{changed} of {confusion.sum()} labels changed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-label historical signals against a new anchor set.")
+    parser.add_argument("version", help="Name to store the new labels under")
+    parser.add_argument("--anchors", default=ANCHOR_STORE_DIR, help="An anchor set version directory, or a store to use the published version of")
+    parser.add_argument("--threshold", type=float, default=0.4, help="Classifier confidence threshold")
+    parser.add_argument("--against", default=None, help="Stored version to compare with, defaults to the live labels")
+    parser.add_argument("--apply", action="store_true", help="Replace the live labels with the new ones")
+    args = parser.parse_args()
+
+    confusion = reclassify(Database(), args.version, args.anchors, args.threshold, args.against, args.apply)
+    print_confusion(confusion, args.against or "live", args.version)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Raw input recordings for offline replay.
+
+Every Jetstream frame, Mastodon status, RSS feed body and fetched page is
+appended, as received, to zstd compressed segment files:
+
+    recordings/
+        20261019-120000.rec.zst
+        20261019-121000.rec.zst
+
+Each record is a JSON header line, then the payload bytes, then a newline:
+
+    {"t": 1760875200.12, "kind": "bluesky", "length": 812}
+    <812 bytes>
+
+`kind` is "bluesky", "mastodon", "rss" or "page". Mastodon records carry
+the `instance` and RSS records the feed `source`, pages their `url`. RSS
+records also carry the JSON list of entry ids that were new and `queued`,
+which depends on the live database, and are written once the feed has been
+processed, after its pages.
+Writes happen on a thread of their own, recording costs the event loop one
+queue put per input.
+"""
+from compression import zstd
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator
+
+import os
+import queue
+import threading
+import time
+import orjson
+
+RECORDING_DIR = "recordings"
+SEGMENT_SUFFIX = ".rec.zst"
+# A new segment is started after this long, so old traffic can be deleted by file
+SEGMENT_SECONDS = 10 * 60
+RECORDING_LEVEL = 3
+# Buffered records are flushed at least this often, a crash loses no more than that
+FLUSH_INTERVAL = 1.0
+
+
+@dataclass
+class Record:
+    time: float
+    kind: str
+    data: bytes
+    fields: Dict[str, str] = field(default_factory=dict)
+
+
+class Recorder:
+    def __init__(self, directory: str = RECORDING_DIR, segment_seconds: float = SEGMENT_SECONDS, level: int = RECORDING_LEVEL) -> None:
+        """
+        :param directory: Where segments are written.
+        :param segment_seconds: How long each segment covers.
+        :param level: The zstd compression level.
+        """
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.level = level
+        self.pending: queue.SimpleQueue[Record | None] = queue.SimpleQueue()
+        self.recorded = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self._write, name="recorder", daemon=True)
+        self.thread.start()
+
+    def record(self, kind: str, data: bytes | str, **fields: str):
+        if isinstance(data, str):
+            data = data.encode()
+        self.pending.put(Record(time.time(), kind, data, fields))
+
+    def close(self):
+        """Writes out everything recorded so far and closes the segment."""
+        self.pending.put(None)
+        self.thread.join()
+
+    def _write(self):
+        segment = None
+        segment_start = 0.0
+        while True:
+            try:
+                record = self.pending.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                if segment is not None:
+                    segment.flush()
+                continue
+
+            if record is None:
+                break
+
+            try:
+                if segment is None or record.time - segment_start >= self.segment_seconds:
+                    if segment is not None:
+                        segment.close()
+                    segment = zstd.open(self._segment_path(record.time), "wb", level=self.level)
+                    segment_start = record.time
+
+                header = {"t": record.time, "kind": record.kind, "length": len(record.data), **record.fields}
+                segment.write(orjson.dumps(header) + b"\n" + record.data + b"\n")
+                self.recorded += 1
+            except Exception as e:
+                print(f"[Recorder Error]: {e}")
+
+        if segment is not None:
+            segment.close()
+
+    def _segment_path(self, start: float) -> str:
+        name = time.strftime("%Y%m%d-%H%M%S", time.gmtime(start))
+        path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        while os.path.exists(path):
+            name += "a"
+            path = os.path.join(self.directory, name + SEGMENT_SUFFIX)
+        return path
+
+
+def segment_paths(path: str) -> list[str]:
+    """The segments of a recording directory in time order, or `path` itself if it's a segment."""
+    if os.path.isfile(path):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(SEGMENT_SUFFIX))
+
+def read_records(paths: Iterable[str]) -> Iterator[Record]:
+    """
+    Every record in the given segments, in order. A segment cut short by a
+    crash is read up to its last complete record.
+    """
+    for path in paths:
+        with zstd.open(path, "rb") as segment:
+            while True:
+                try:
+                    line = segment.readline()
+                    if not line:
+                        break
+                    header = orjson.loads(line)
+                    length = header.pop("length")
+                    data = segment.read(length)
+                    if len(data) != length or segment.read(1) != b"\n":
+                        raise EOFError
+                except (EOFError, zstd.ZstdError, orjson.JSONDecodeError):
+                    print(f"Recording {path} ends early, skipping the rest of it")
+                    break
+                yield Record(header.pop("t"), header.pop("kind"), data, header)
@@ -0,0 +1,177 @@
+"""
+Replays recorded inputs through the processing pipeline, offline.
+
+Frames, statuses and feeds go back through the same client code that
+received them live, onto the same queue, and are processed against a
+scratch database with made-up embeddings and market data. Nothing is sent
+to Gemini, yfinance or the webhook.
+
+Usage:
+    python replay.py recordings/ --speed 10
+    python replay.py recordings/20261019-120000.rec.zst --speed max --output signals.json
+"""
+from typing import Iterable, List, Set
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import orjson
+
+import db
+from bluesky import BlueskyClient
+from mastodon_listener import MastodonClient
+from rss import RssFetcher
+from post_processor import PostProcessor
+from recorder import Record, read_records, segment_paths
+from ai_engine import GeminiAnalyst
+from embeddings import LocalEmbeddings, LocalPrescorer
+from fakes import FakeAnalyst, FakeMarketProvider, RecordedPages
+from metrics import metrics, STAGES, SOURCE_STAGES
+
+SOURCES = ["bluesky", "mastodon", "rss"]
+# Posts let into the queue ahead of the processor at max speed, so replay is held to its pace
+REPLAY_QUEUE_SIZE = 1000
+
+
+class ReplayRssFetcher(RssFetcher):
+    """
+    Queues the entries of a feed the live fetcher queued and no others. The
+    scratch database hasn't seen the entries the live one had, on its own it
+    would take every entry of every feed for new.
+    """
+
+    def __init__(self, database: db.Database, pages: RecordedPages, queue: asyncio.Queue) -> None:
+        super().__init__(database, pages, queue)
+        # The ids queued live from the feed being replayed, None for a recording that predates them
+        self.queued: Set[str] | None = None
+
+    async def replay_feed(self, source: str, rss_data: str, queued: Set[str] | None):
+        self.queued = queued
+        await self.process_feed(source, rss_data)
+
+    def is_new(self, source: str, entry_id: str) -> bool:
+        if self.queued is not None:
+            return entry_id in self.queued
+        return super().is_new(source, entry_id)
+
+
+class Replayer:
+    def __init__(self, queue: asyncio.Queue, database: db.Database, pages: RecordedPages, speed: float | None = 1.0, sources: Iterable[str] = SOURCES) -> None:
+        """
+        :param queue: The queue the processor reads posts from.
+        :param database: The scratch database, RSS entries are deduplicated against it.
+        :param pages: The recorded pages RSS entries are filled in from.
+        :param speed: How many times faster than recorded to replay, None for as fast as possible.
+        :param sources: Which kinds of input to replay.
+        """
+        self.speed = speed
+        self.sources = set(sources)
+        self.bluesky = BlueskyClient(queue, compress=False)
+        self.mastodon = MastodonClient(queue, streams=[])
+        self.rss = ReplayRssFetcher(database, pages, queue)
+        self.replayed = 0
+
+    async def replay(self, records: Iterable[Record]):
+        first = None
+        started = time.monotonic()
+        for record in records:
+            if record.kind not in self.sources:
+                continue
+
+            if self.speed is None:
+                # Let the processor run between inputs
+                await asyncio.sleep(0)
+            else:
+                first = record.time if first is None else first
+                delay = started + (record.time - first) / self.speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            try:
+                await self._dispatch(record)
+            except Exception as e:
+                print(f"[Replay Error] {record.kind}: {e}")
+            self.replayed += 1
+
+    async def _dispatch(self, record: Record):
+        if record.kind == "bluesky":
+            await self.bluesky.handle_frame(record.data)
+        elif record.kind == "mastodon":
+            await self.mastodon.handle_event("update", record.data.decode(), record.fields["instance"])
+        elif record.kind == "rss":
+            queued = record.fields.get("queued")
+            await self.rss.replay_feed(record.fields["source"], record.data.decode(), set(orjson.loads(queued)) if queued is not None else None)
+
+
+def load_pages(paths: List[str]) -> RecordedPages:
+    """Every recorded page, read ahead since a feed's pages are recorded after the feed itself."""
+    return RecordedPages({record.fields["url"]: record.data.decode() for record in read_records(paths) if record.kind == "page"})
+
+
+async def run(paths: List[str], speed: float | None, sources: List[str], latency: float, output: str | None, embeddings: str = "fake", prescore: float | None = None):
+    database = db.Database()
+    queue = asyncio.Queue(maxsize=REPLAY_QUEUE_SIZE if speed is None else 0)
+    analyst = GeminiAnalyst(LocalEmbeddings()) if embeddings == "local" else FakeAnalyst(latency=latency)
+    if prescore is not None:
+        analyst.prescorer = LocalPrescorer(analyst.anchor_store, prescore)
+    processor = PostProcessor(database, analyst, FakeMarketProvider(), queue)
+    pages = load_pages(paths) if "rss" in sources else RecordedPages()
+    replayer = Replayer(queue, database, pages, speed, sources)
+
+    processing = asyncio.create_task(processor.process_queue())
+    started = time.perf_counter()
+    await replayer.replay(read_records(paths))
+    # The processor stops at None, once every post ahead of it is done
+    await queue.put(None)
+    await processing
+    elapsed = time.perf_counter() - started
+    for task in processor.decision_tasks.values():
+        task.cancel()
+
+    embedded = metrics.stages["embed"].count
+    print(f"Replayed {replayer.replayed} inputs in {elapsed:.1f}s, {embedded} posts embedded ({embedded / elapsed:.1f}/s)")
+    for stage in STAGES:
+        if stage in SOURCE_STAGES:
+            histograms = [(f"{stage}[{source}]", metrics.source_stages[stage, source]) for source in SOURCES]
+        else:
+            histograms = [(stage, metrics.stages[stage])]
+        for name, histogram in histograms:
+            if histogram.count:
+                print(f"{name:>16}: n={histogram.count:<7} p50={histogram.quantile(0.5) * 1000:8.3f}ms p99={histogram.quantile(0.99) * 1000:8.3f}ms")
+
+    if output is not None:
+        # Sorted so two runs can be diffed to check a change didn't alter any signal
+        signals = sorted((row.url, row.signal) for row in database.get_signals_since(0))
+        with open(output, "wb") as f:
+            f.write(orjson.dumps(signals, option=orjson.OPT_INDENT_2))
+        print(f"Wrote {len(signals)} signals to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded inputs through the pipeline offline.")
+    parser.add_argument("recording", help="A recording directory or a single segment")
+    parser.add_argument("--speed", default="1", help="Multiple of the recorded pace, or 'max'")
+    parser.add_argument("--sources", default=",".join(SOURCES), help="Comma separated kinds of input to replay")
+    parser.add_argument("--embeddings", choices=["fake", "local"], default="fake", help="Made-up embeddings, or the local provider's")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds each fake embedding takes")
+    parser.add_argument("--prescore", type=float, help="Skip embedding posts whose local pre-score is below this")
+    parser.add_argument("--db", help="Scratch database to write to, a temporary one by default")
+    parser.add_argument("--output", help="Write the (url, signal) of every processed post here as JSON")
+    args = parser.parse_args()
+
+    speed = None if args.speed == "max" else float(args.speed)
+    sources = [source for source in args.sources.split(",") if source]
+    paths = segment_paths(args.recording)
+    if not paths:
+        parser.error(f"No segments found in {args.recording}")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        # Never the live database, replayed signals must not mix with real ones
+        db.DB_NAME = args.db or os.path.join(scratch, "replay.db")
+        asyncio.run(run(paths, speed, sources, args.latency, args.output, args.embeddings, args.prescore))
+
+
+if __name__ == "__main__":
+    main()
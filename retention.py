@@ -0,0 +1,221 @@
+import db
+from db import Database, MIGRATIONS, SHARD_SECONDS
+from dataclasses import dataclass
+from typing import Dict, List
+
+import argparse
+import asyncio
+import glob
+import os
+import sqlite3
+import time
+import numpy as np
+from numpy.typing import NDArray
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_CHUNK_SIZE = 10_000
+RETENTION_INTERVAL = 60 * 60
+
+# Pages released per run by incremental vacuum, 0 releases everything free
+VACUUM_PAGES = 0
+# Seconds to wait for the writer to let go of the lock
+BUSY_TIMEOUT = 30
+
+DAY = 24 * 60 * 60
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Rows of `table` whose `time_column` is older than `hot_seconds` are moved
+    out of the live database into the archive.
+    """
+    table: str
+    time_column: str
+    hot_seconds: int
+    text_columns: List[str]
+    int_columns: List[str]
+    embedding_column: str | None = None
+
+
+RETENTION_POLICIES = [
+    RetentionPolicy("historical_signals", "added", 30 * DAY, ["url", "signal"], ["added"], "embedding"),
+    RetentionPolicy("intelligence", "last_updated", 14 * DAY, ["url", "content"], ["event", "added", "last_updated"], "embedding"),
+    RetentionPolicy("document_chunks", "added", 30 * DAY, ["url", "content"], ["chunk", "added"], "embedding"),
+    RetentionPolicy("rss", "added", 90 * DAY, ["source", "id"], ["added"]),
+    RetentionPolicy("duplicates", "added", 30 * DAY, ["url", "original", "source"], ["added"]),
+]
+# intelligence_shards and signal_labels have no age of their own, they go
+# with the intelligence and historical_signals rows they refer to
+
+
+class RetentionManager:
+    def __init__(self, policies: List[RetentionPolicy] = RETENTION_POLICIES, archive_dir: str = ARCHIVE_DIR) -> None:
+        self.policies = policies
+        self.archive_dir = archive_dir
+
+    def run(self):
+        """
+        Archives everything outside the hot windows, then reclaims space and
+        refreshes statistics. It opens a plain connection of its own, so it can
+        run on a worker thread alongside the writer.
+        """
+        conn = _connect()
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                print("Incremental vacuum is off, free pages stay in the file. Run `python retention.py --enable-incremental-vacuum` offline to switch it on")
+
+            now = int(time.time())
+            for policy in self.policies:
+                # Align to a day so whole intelligence shards leave together
+                cutoff = (now - policy.hot_seconds) // DAY * DAY
+                archived = self.archive(conn, policy, cutoff)
+                if archived:
+                    print(f"Archived {archived} rows from {policy.table}")
+
+            conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+            conn.execute("ANALYZE")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def archive(self, conn: sqlite3.Connection, policy: RetentionPolicy, cutoff: int) -> int:
+        """
+        Moves rows older than `cutoff` into compressed .npz part files, one
+        chunk at a time. A chunk is only deleted once its file is on disk, and
+        in the same transaction as whatever refers to its rows.
+        """
+        c = conn.cursor()
+        columns = policy.text_columns + policy.int_columns
+        if policy.embedding_column:
+            columns.append(policy.embedding_column)
+
+        directory = os.path.join(self.archive_dir, policy.table)
+        os.makedirs(directory, exist_ok=True)
+
+        total = 0
+        while True:
+            c.execute(
+                f"SELECT rowid, {', '.join(columns)} FROM {policy.table} WHERE {policy.time_column} < ? ORDER BY rowid LIMIT ?",
+                (cutoff, ARCHIVE_CHUNK_SIZE)
+            )
+            rows = c.fetchall()
+            if not rows:
+                return total
+
+            arrays: Dict[str, NDArray] = {}
+            for column in policy.text_columns:
+                data, offsets = _pack_strings([row[column] or "" for row in rows])
+                arrays[f"{column}_data"] = data
+                arrays[f"{column}_offsets"] = offsets
+            for column in policy.int_columns:
+                arrays[column] = np.array([-1 if row[column] is None else row[column] for row in rows], dtype=np.int64)
+            if policy.embedding_column:
+                arrays[policy.embedding_column] = np.stack([np.frombuffer(row[policy.embedding_column], dtype=np.float32) for row in rows])
+
+            first, last = rows[0][0], rows[-1][0]
+            path = os.path.join(directory, f"{first:012d}-{last:012d}.npz")
+            with open(path + ".tmp", "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(path + ".tmp", path)
+
+            c.executemany(f"DELETE FROM {policy.table} WHERE rowid = ?", [(row[0], ) for row in rows])
+            if policy.table == "intelligence":
+                # Shards hold rowids, a search must never see one whose row is gone
+                c.execute("DELETE FROM intelligence_shards WHERE day < ?", (cutoff // SHARD_SECONDS, ))
+            elif policy.table == "historical_signals":
+                # Labels from reclassifying are only read next to their signal
+                c.executemany("DELETE FROM signal_labels WHERE url = ?", [(row["url"], ) for row in rows])
+            conn.commit()
+            total += len(rows)
+
+
+def load_archive(table: str, since: int = 0, until: int | None = None, archive_dir: str = ARCHIVE_DIR) -> Dict[str, NDArray]:
+    """
+    Reads archived rows of `table` back as columns. Text columns come back as
+    object arrays of str, embeddings as a float32 matrix.
+    """
+    policy = next(p for p in RETENTION_POLICIES if p.table == table)
+    parts: Dict[str, List[NDArray]] = {}
+
+    for path in sorted(glob.glob(os.path.join(archive_dir, table, "*.npz"))):
+        with np.load(path) as part:
+            times = part[policy.time_column]
+            mask = (times >= since) & (times < (until if until is not None else np.iinfo(np.int64).max))
+            if not mask.any():
+                continue
+            for column in policy.text_columns:
+                strings = _unpack_strings(part[f"{column}_data"], part[f"{column}_offsets"])
+                parts.setdefault(column, []).append(strings[mask])
+            for column in policy.int_columns:
+                parts.setdefault(column, []).append(part[column][mask])
+            if policy.embedding_column:
+                parts.setdefault(policy.embedding_column, []).append(part[policy.embedding_column][mask])
+
+    return {column: np.concatenate(values) for column, values in parts.items()}
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    A connection for archiving, deleting and vacuuming only. It runs none
+    of a Database's migrations, vector setup or requantizing, so the schema
+    has to be up to date already.
+    """
+    conn = sqlite3.connect(db.DB_NAME, timeout=BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < len(MIGRATIONS):
+        conn.close()
+        raise RuntimeError(f"{db.DB_NAME} is at schema version {version} of {len(MIGRATIONS)}, open it for writing first")
+    return conn
+
+def _pack_strings(strings: List[str]) -> tuple[NDArray, NDArray]:
+    encoded = [s.encode() for s in strings]
+    offsets = np.cumsum([0] + [len(e) for e in encoded], dtype=np.int64)
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def _unpack_strings(data: NDArray, offsets: NDArray) -> NDArray:
+    raw = data.tobytes()
+    return np.array([raw[offsets[i]:offsets[i + 1]].decode() for i in range(len(offsets) - 1)], dtype=object)
+
+
+def enable_incremental_vacuum():
+    """
+    Switches the database to incremental auto_vacuum. That takes a full
+    VACUUM, which rewrites the whole file, so it's done once and offline.
+    """
+    conn = _connect()
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            print("Incremental vacuum is already on")
+            return
+        print("Enabling incremental vacuum, this rewrites the database once...")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+async def retention_loop(manager: RetentionManager):
+    while True:
+        try:
+            # Archiving and ANALYZE take seconds, off the event loop
+            await asyncio.to_thread(manager.run)
+        except Exception as e:
+            print(f"[Retention Error]: {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Moves rows outside the hot windows into the archive.")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="Switch the database to incremental vacuum first, a one-time full rewrite")
+    args = parser.parse_args()
+
+    # Run on its own there may be no writer to have migrated the schema yet
+    Database().conn.close()
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+    RetentionManager().run()
+
+if __name__ == "__main__":
+    main()
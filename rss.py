@@ -2,14 +2,17 @@ from db import Database
 from trance import AntiBot
 from ai_engine import GeminiAnalyst
 from domain.post import Post
+from metrics import metrics
+from recorder import Recorder
 
 import asyncio
+import orjson
 from asyncio import Queue
 from html_to_markdown import convert
 import feedparser
 from feedparser import FeedParserDict
 from abc import ABC, abstractmethod
-from typing import Dict
+from typing import Dict, List
 import requests
 
 
@@ -113,10 +116,14 @@ RSS_FEEDS = [
 ]
 
 class RssFetcher:
-    def __init__(self, db: Database, antibot: AntiBot, queue: Queue[Post]) -> None:
+    def __init__(self, db: Database, antibot: AntiBot, queue: Queue[Post], recorder: Recorder | None = None) -> None:
+        """
+        :param recorder: If given, every feed body and fetched page is recorded for replay.
+        """
         self.db = db
         self.antibot = antibot
         self.queue = queue
+        self.recorder = recorder
 
     async def fetch_updates(self):
         print("Starting fetch RSS")
@@ -129,28 +136,45 @@ class RssFetcher:
         if rss_data is None: 
             print(f"Couldnt fetch {source}")
             return
-        
+        queued = await self.process_feed(source, rss_data)
+        if self.recorder is not None:
+            # Which entries are new depends on the live database, replay queues the same ones
+            self.recorder.record("rss", rss_data, source=source, queued=orjson.dumps(queued).decode())
+
+    async def process_feed(self, source: str, rss_data: str) -> List[str]:
+        """Queues every entry of a fetched feed that hasn't been seen before, returns their ids."""
         feed = feedparser.parse(rss_data)
         
         print(f"Found {len(feed.entries)} entries in {source}")
 
+        queued = []
         for entry in feed.entries:
             entry_id: str = entry.id # type: ignore
 
-            if self.db.has_rss_item(source, entry_id): continue
-
-            links = [str(l.href) for l in entry.links]
-            url = entry_id if entry_id.startswith("http") else (links[0] if links else "")
-            string_content = await self.get_string_content(entry, url)
-
-            await self.queue.put(Post(
-                url,
-                "N/A",
-                string_content,
-                links
-            ))
+            if not self.is_new(source, entry_id): continue
+
+            # Most of this is Chromium loading the linked page
+            with metrics.time("ingest", source="rss"):
+                links = [str(l.href) for l in entry.links]
+                url = entry_id if entry_id.startswith("http") else (links[0] if links else "")
+                string_content = await self.get_string_content(entry, url)
+
+                await self.queue.put(Post(
+                    url,
+                    "N/A",
+                    string_content,
+                    links,
+                    source="rss"
+                ))
+            metrics.inc("posts_ingested", "Posts queued for processing", source="rss")
             
             self.db.add_rss_item(source, entry_id)
+            queued.append(entry_id)
+        return queued
+
+    def is_new(self, source: str, entry_id: str) -> bool:
+        """Whether the entry `entry_id` of the feed `source` hasn't been queued before."""
+        return not self.db.has_rss_item(source, entry_id)
     
     def _get_adapter(self, source: str) -> BaseRssAdapter:
         for host in ADAPTERS:
@@ -178,6 +202,8 @@ class RssFetcher:
         page_content = await self.antibot.get_page(url)
         if page_content is not None:
             all_content.append(page_content)
+            if self.recorder is not None:
+                self.recorder.record("page", page_content, url=url)
         
         return "\n".join(all_content)
             
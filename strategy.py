@@ -1,9 +1,24 @@
 from collections import deque
+from dataclasses import dataclass
 from enum import Enum
+from typing import Dict, List
 from domain.post import Post
 from market_data import MarketDataProvider
+import math
+import time
 import pandas as pd
 
+# A signal's weight halves every SIGNAL_HALF_LIFE seconds
+SIGNAL_HALF_LIFE = 15 * 60
+
+# Pending signals are decided together once none has arrived for this many seconds
+DECISION_WINDOW = 60
+# A burst that keeps going is still decided this many seconds after its first signal
+DECISION_MAX_DELAY = 5 * 60
+
+# Net decayed intensity needed before the AI side counts as BUY or SELL
+SIGNAL_SCORE_THRESHOLD = 0.5
+
 
 class Signal(Enum):
     """Represents a trading signal."""
@@ -12,90 +27,195 @@ class Signal(Enum):
     HOLD = "HOLD"
 
 
+@dataclass(frozen=True)
+class AssetRules:
+    """The ticker a strategy trades and the thresholds of its rule set."""
+    ticker: str
+    name: str
+    rsi_oversold: float = 30
+    rsi_overbought: float = 70
+    period: str = "10d"
+    interval: str = "5m"
+
+
+# Every asset also needs buy and sell anchors in anchors.ASSET_ANCHORS
+ASSETS = [
+    AssetRules("SI=F", "Silver"),
+    AssetRules("GC=F", "Gold"),
+    AssetRules("CL=F", "Crude Oil", rsi_oversold=25, rsi_overbought=75),
+    AssetRules("DX-Y.NYB", "US Dollar Index"),
+]
+
+
+class DecayingIntensity:
+    """
+    An exponentially time-decayed sum of weights, updated in O(1) without
+    keeping the individual events.
+    """
+
+    def __init__(self, half_life: float) -> None:
+        self.decay_rate = math.log(2) / half_life
+        self.value = 0.0
+        self.updated = 0.0
+
+    def value_at(self, now: float) -> float:
+        return self.value * math.exp(-self.decay_rate * max(now - self.updated, 0.0))
+
+    def add(self, weight: float, now: float):
+        self.value = self.value_at(now) + weight
+        self.updated = now
+
+
 class Strategy:
     """
     Decides the final trading action based on a history of signals,
     market data, and the bot's own past actions.
     """
 
-    def __init__(self, market_provider: MarketDataProvider, max_history: int = 100):
+    def __init__(self, market_provider: MarketDataProvider, rules: AssetRules = ASSETS[0], max_history: int = 100, half_life: float = SIGNAL_HALF_LIFE, decision_window: float = DECISION_WINDOW, score_threshold: float = SIGNAL_SCORE_THRESHOLD):
         """
         Initializes the Strategy module.
 
         :param market_provider: An instance of MarketDataProvider to get live prices.
+        :param rules: The asset to trade and its rule thresholds.
         :param max_history: The maximum number of recent signals and actions to store.
+        :param half_life: Seconds for a signal's contribution to the aggregate score to halve.
+        :param decision_window: Seconds without a new signal before deciding on the pending ones together.
+        :param score_threshold: Net BUY minus SELL intensity needed to act on the AI side.
         """
         self.market_data = market_provider
+        self.rules = rules
         self.recent_signals = deque(maxlen=max_history)
         self.past_actions = deque(maxlen=max_history)
 
-    def add_signal(self, signal: Signal, post: Post):
-        """Adds a new signal from the AI engine to the history."""
-        self.recent_signals.append({'signal': signal, 'post': post})
+        self.buy_intensity = DecayingIntensity(half_life)
+        self.sell_intensity = DecayingIntensity(half_life)
+        self.decision_window = decision_window
+        self.score_threshold = score_threshold
+        self.pending_since: float | None = None
+        self.last_signal_at: float | None = None
+
+    def add_signal(self, signal: Signal, post: Post, now: float | None = None):
+        """Adds a new signal from the AI engine to the history and the aggregate intensities."""
+        now = time.time() if now is None else now
+        self.recent_signals.append({'signal': signal, 'post': post, 'time': now})
+
+        if signal == Signal.BUY:
+            self.buy_intensity.add(1.0, now)
+        elif signal == Signal.SELL:
+            self.sell_intensity.add(1.0, now)
+
+        if self.pending_since is None:
+            self.pending_since = now
+        self.last_signal_at = now
+
+    def decision_delay(self, now: float | None = None) -> float:
+        """
+        Seconds until the pending signals are due a decision: once the decision
+        window has passed without a new one, or DECISION_MAX_DELAY after the
+        first, whichever comes sooner. 0 if they're due or nothing is pending.
+        """
+        if self.pending_since is None or self.last_signal_at is None:
+            return 0.0
+        now = time.time() if now is None else now
+        due = min(self.last_signal_at + self.decision_window, self.pending_since + DECISION_MAX_DELAY)
+        return max(due - now, 0.0)
+
+    def score(self, now: float | None = None) -> float:
+        """Decayed BUY intensity minus decayed SELL intensity."""
+        now = time.time() if now is None else now
+        return self.buy_intensity.value_at(now) - self.sell_intensity.value_at(now)
+
+    def aggregate_signal(self, now: float | None = None) -> Signal:
+        """The AI signal implied by every recent post together rather than by the last one."""
+        score = self.score(now)
+        if score >= self.score_threshold:
+            return Signal.BUY
+        if score <= -self.score_threshold:
+            return Signal.SELL
+        return Signal.HOLD
+
+    def latest_post(self, signal: Signal) -> Post | None:
+        """The most recent post that carried `signal`, to cite in an alert."""
+        for entry in reversed(self.recent_signals):
+            if entry['signal'] == signal:
+                return entry['post']
+        return None
 
     def record_action(self, action: Signal):
         """Records a trading action taken by the bot."""
         self.past_actions.append(action)
 
-    def decide(self) -> Signal:
+    def decide(self, now: float | None = None) -> Signal:
         """
-        Makes a trading decision (BUY, SELL, HOLD) based on AI signals
-        and technical indicators.
+        Makes a trading decision (BUY, SELL, HOLD) based on the aggregate of
+        recent AI signals and technical indicators. Every signal added so far
+        is settled by this decision.
         """
+        self.pending_since = None
         if not self.recent_signals:
             return Signal.HOLD
 
-        # 1. Get the latest AI signal
-        latest_ai_signal = self.recent_signals[-1]['signal']
+        # 1. Get the aggregate AI signal
+        latest_ai_signal = self.aggregate_signal(now)
+        print(f"Strategy Insight [{self.rules.ticker}]: Aggregate signal score is {self.score(now):+.2f}.")
 
-        # 2. Get historical data to calculate technical indicators
+        # 2. Get the latest technical indicators, shared with any other strategy on this ticker
         # Fetching more data to ensure MA50 is calculated properly
-        hist_df = self.market_data.get_historical_data(ticker='SI=F', period="10d", interval="5m")
-        
-        if hist_df is None or hist_df.empty:
-            print("Strategy: Could not get historical data. Falling back to latest AI signal.")
+        latest_indicators = self.market_data.get_latest_indicators(self.rules.ticker, period=self.rules.period, interval=self.rules.interval)
+
+        if latest_indicators is None:
+            print(f"Strategy [{self.rules.ticker}]: Could not get historical data. Falling back to aggregate AI signal.")
             return latest_ai_signal
 
-        # 3. Calculate technical indicators
-        indicators_df = self.market_data.get_technical_indicators(hist_df)
-        
-        # Get the latest indicator values
-        latest_indicators = indicators_df.iloc[-1]
         ma20 = latest_indicators.get('MA20')
         ma50 = latest_indicators.get('MA50')
         rsi = latest_indicators.get('RSI')
 
         if pd.isna(ma20) or pd.isna(ma50) or pd.isna(rsi):
-            print("Strategy: Could not calculate all indicators. Falling back to latest AI signal.")
+            print(f"Strategy [{self.rules.ticker}]: Could not calculate all indicators. Falling back to aggregate AI signal.")
             return latest_ai_signal
 
         # 4. Define the trading strategy rules
         is_uptrend = ma20 > ma50
         is_downtrend = ma20 < ma50
-        is_overbought = rsi > 70
-        is_oversold = rsi < 30
+        is_overbought = rsi > self.rules.rsi_overbought
+        is_oversold = rsi < self.rules.rsi_oversold
 
-        print(f"Strategy Insight: Trend is {'UP' if is_uptrend else 'DOWN'}. RSI is {rsi:.2f}.")
+        print(f"Strategy Insight [{self.rules.ticker}]: Trend is {'UP' if is_uptrend else 'DOWN'}. RSI is {rsi:.2f}.")
 
         # --- Decision Logic ---
         if latest_ai_signal == Signal.BUY:
             # BUY if AI says BUY, we're in an uptrend, and it's not overbought
             if is_uptrend and not is_overbought:
-                print("DECISION: BUY (AI Signal + Uptrend + Not Overbought)")
+                print(f"DECISION [{self.rules.ticker}]: BUY (AI Signal + Uptrend + Not Overbought)")
                 return Signal.BUY
             else:
-                print("DECISION: HOLD (AI BUY signal did not meet trend/RSI criteria)")
+                print(f"DECISION [{self.rules.ticker}]: HOLD (AI BUY signal did not meet trend/RSI criteria)")
                 return Signal.HOLD
 
         elif latest_ai_signal == Signal.SELL:
             # SELL if AI says SELL, we're in a downtrend, and it's not oversold
             if is_downtrend and not is_oversold:
-                print("DECISION: SELL (AI Signal + Downtrend + Not Oversold)")
+                print(f"DECISION [{self.rules.ticker}]: SELL (AI Signal + Downtrend + Not Oversold)")
                 return Signal.SELL
             else:
-                print("DECISION: HOLD (AI SELL signal did not meet trend/RSI criteria)")
+                print(f"DECISION [{self.rules.ticker}]: HOLD (AI SELL signal did not meet trend/RSI criteria)")
                 return Signal.HOLD
 
         # If AI signal is HOLD, we also hold.
-        print("DECISION: HOLD (AI Signal was HOLD)")
+        print(f"DECISION [{self.rules.ticker}]: HOLD (AI Signal was HOLD)")
         return Signal.HOLD
+
+
+class StrategyRegistry:
+    """One Strategy per tracked asset, all sharing a MarketDataProvider and its indicator cache."""
+
+    def __init__(self, market_provider: MarketDataProvider, assets: List[AssetRules] = ASSETS) -> None:
+        self.strategies: Dict[str, Strategy] = {rules.ticker: Strategy(market_provider, rules) for rules in assets}
+
+    def get(self, ticker: str) -> Strategy | None:
+        return self.strategies.get(ticker)
+
+    def __iter__(self):
+        return iter(self.strategies.values())
@@ -0,0 +1,92 @@
+"""
+The Jetstream client against a FakeJetstreamServer: reconnecting, resuming
+from the cursor and surviving bad frames.
+
+Run from the repository root:
+    python -m unittest tests.test_bluesky
+"""
+import asyncio
+import unittest
+
+import orjson
+
+import bluesky
+from bluesky import BlueskyClient
+from fakes import FakeJetstreamServer
+
+FIRST_TIME_US = 1_760_875_200_000_000
+
+
+def make_frame(i: int, text: str = "Breaking: troops cross the border") -> bytes:
+    commit = {
+        "rev": f"rev{i}", "operation": "create", "collection": "app.bsky.feed.post", "rkey": f"post{i}", "cid": f"cid{i}",
+        "record": {"$type": "app.bsky.feed.post", "createdAt": "2026-10-19T12:00:00.000Z", "text": f"{text} ({i})"},
+    }
+    return orjson.dumps({"did": f"did:plc:author{i}", "time_us": FIRST_TIME_US + i, "kind": "commit", "commit": commit})
+
+
+class BlueskyClientTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # Reconnect at once, not after a second
+        self.reconnect_delay = bluesky.RECONNECT_MIN_DELAY
+        bluesky.RECONNECT_MIN_DELAY = 0.01
+
+    def tearDown(self):
+        bluesky.RECONNECT_MIN_DELAY = self.reconnect_delay
+
+    async def serve(self, frames, **options) -> FakeJetstreamServer:
+        server = FakeJetstreamServer(frames, **options)
+        await server.__aenter__()
+        self.addAsyncCleanup(server.__aexit__, None, None, None)
+        return server
+
+    async def listen(self, client: BlueskyClient, posts: int) -> list:
+        """The first `posts` posts the client queues, listening until it has them."""
+        listening = asyncio.create_task(client.listen())
+        try:
+            return [await asyncio.wait_for(client.queue.get(), 5) for _ in range(posts)]
+        finally:
+            listening.cancel()
+            await asyncio.gather(listening, return_exceptions=True)
+
+    async def test_reconnects_and_resumes_after_the_last_frame(self):
+        frames = [make_frame(i) for i in range(10)]
+        server = await self.serve(frames, disconnect_after=3)
+        client = BlueskyClient(asyncio.Queue(), websocket_url=server.url)
+
+        posts = await self.listen(client, 10)
+        # Every frame once, none repeated by the reconnects in between
+        self.assertEqual([post.url for post in posts], [f"https://bsky.app/profile/did:plc:author{i}/post/post{i}" for i in range(10)])
+        self.assertGreaterEqual(server.connections, 4)
+        self.assertEqual(client.cursor, FIRST_TIME_US + 10)
+        self.assertTrue(client.queue.empty())
+
+    async def test_cursor_given_is_played_back_from(self):
+        frames = [make_frame(i) for i in range(10)]
+        server = await self.serve(frames)
+        client = BlueskyClient(asyncio.Queue(), websocket_url=server.url, cursor=FIRST_TIME_US + 6)
+        self.assertIn(f"cursor={FIRST_TIME_US + 6}", client.get_url())
+
+        posts = await self.listen(client, 4)
+        self.assertEqual([post.author_id for post in posts], [f"did:plc:author{i}" for i in range(6, 10)])
+        self.assertIn(f"cursor={FIRST_TIME_US + 10}", client.get_url())
+
+    async def test_bad_frame_keeps_the_connection(self):
+        frames = [make_frame(0), make_frame(1), make_frame(2)]
+        server = await self.serve(frames)
+        client = BlueskyClient(asyncio.Queue(), websocket_url=server.url)
+        handle_frame = client.handle_frame
+
+        async def failing_once(message: bytes):
+            if b"post1" in message:
+                raise ValueError("bad frame")
+            await handle_frame(message)
+        client.handle_frame = failing_once
+
+        posts = await self.listen(client, 2)
+        self.assertEqual([post.author_id for post in posts], ["did:plc:author0", "did:plc:author2"])
+        self.assertEqual(server.connections, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+Near-duplicates through the PostProcessor: what's stored for the first copy
+of a story and what for its rewordings.
+
+Run from the repository root:
+    python -m unittest tests.test_dedup
+"""
+import asyncio
+import os
+import tempfile
+import unittest
+
+import db
+from db import Database
+from domain.post import Post
+from fakes import FakeAnalyst, FakeMarketProvider
+from limiter import Shed
+from post_processor import PostProcessor
+
+STORY = "Reuters: the central bank raised its benchmark rate by half a point on Tuesday, citing stubborn inflation in services"
+REWORDED = "Reuters: the central bank raised its benchmark rate by half a point on Tuesday, citing stubborn inflation in services and housing"
+UNRELATED = "Freight rail operators reported record grain shipments through the northern corridor this harvest"
+
+
+def make_post(i: int, content: str) -> Post:
+    return Post(f"https://example.com/post/{i}", f"author{i}", content, [], source="bluesky")
+
+
+class DuplicateTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.db_name = db.DB_NAME
+        db.DB_NAME = os.path.join(directory.name, "test.db")
+        self.database = Database()
+        self.addCleanup(self.database.conn.close)
+
+        self.analyst = FakeAnalyst()
+        # Every post gets embedded, what's under test is what happens after
+        self.analyst.prescorer = None
+
+    def tearDown(self):
+        db.DB_NAME = self.db_name
+
+    async def process(self, processor: PostProcessor, *posts: Post):
+        """Processes `posts` through to the database, the ones before each next post done first."""
+        for post in posts:
+            await processor.queue.put(post)
+            await processor.queue.put(None)
+            await processor.process_queue()
+
+    def stored_signals(self) -> list:
+        return [row[0] for row in self.database.conn.execute("SELECT url FROM historical_signals ORDER BY rowid")]
+
+    async def test_attach_stores_duplicates_against_the_first_copy(self):
+        processor = PostProcessor(self.database, self.analyst, FakeMarketProvider(), asyncio.Queue(), duplicate_mode="attach")
+        original, copy, again, other = make_post(0, STORY), make_post(1, REWORDED), make_post(2, STORY), make_post(3, UNRELATED)
+
+        await self.process(processor, original, copy, again, other)
+        self.assertEqual(self.stored_signals(), [original.url, other.url])
+        self.assertEqual(self.database.get_duplicates(original.url), [copy.url, again.url])
+        self.assertEqual(self.database.get_duplicates(other.url), [])
+        row = self.database.conn.execute("SELECT original, source FROM duplicates WHERE url = ?", (copy.url, )).fetchone()
+        self.assertEqual(tuple(row), (original.url, "bluesky"))
+
+    async def test_drop_stores_nothing_for_duplicates(self):
+        processor = PostProcessor(self.database, self.analyst, FakeMarketProvider(), asyncio.Queue())
+        original, copy = make_post(0, STORY), make_post(1, REWORDED)
+
+        await self.process(processor, original, copy)
+        self.assertEqual(self.stored_signals(), [original.url])
+        self.assertEqual(self.database.get_duplicates(original.url), [])
+
+    async def test_shed_post_is_not_an_original(self):
+        processor = PostProcessor(self.database, self.analyst, FakeMarketProvider(), asyncio.Queue(), duplicate_mode="attach")
+        embed_document = self.analyst.embed_document
+
+        async def shed_first(text, priority):
+            if "author0" in text:
+                raise Shed("saturated")
+            return await embed_document(text, priority)
+        self.analyst.embed_document = shed_first
+
+        shed, copy = make_post(0, STORY), make_post(1, REWORDED)
+        await self.process(processor, shed, copy)
+        # The copy is the story's first classified post, not a duplicate of one never stored
+        self.assertEqual(self.stored_signals(), [copy.url])
+        self.assertEqual(self.database.get_duplicates(shed.url), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+The adaptive limiter and retries against a FakeGeminiServer, through the
+real Gemini client.
+
+Run from the repository root:
+    python -m unittest tests.test_limiter
+"""
+import asyncio
+import time
+import unittest
+
+import limiter
+from embeddings import GeminiEmbeddings
+from fakes import FakeGeminiServer
+from limiter import AdaptiveClient, AdaptiveLimiter, Priority, RetryBudget, Shed, Unavailable
+
+
+class AdaptiveClientTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        # Retries a few milliseconds apart, not seconds
+        self.backoff_base = limiter.BACKOFF_BASE
+        limiter.BACKOFF_BASE = 0.01
+
+    def tearDown(self):
+        limiter.BACKOFF_BASE = self.backoff_base
+
+    async def serve(self, **options) -> FakeGeminiServer:
+        server = FakeGeminiServer(**options)
+        await server.__aenter__()
+        self.addAsyncCleanup(server.__aexit__, None, None, None)
+        return server
+
+    def provider(self, server: FakeGeminiServer, client: AdaptiveClient) -> GeminiEmbeddings:
+        provider = GeminiEmbeddings(base_url=server.url)
+        provider.adaptive = client
+        return provider
+
+    async def test_limit_halves_on_rejections_and_recovers(self):
+        server = await self.serve(quota=20, burst=2, latency=0.02)
+        # Budget enough to retry every rejection, only the limit is under test
+        client = AdaptiveClient("test", AdaptiveLimiter(initial=16), RetryBudget(max_tokens=10_000))
+        provider = self.provider(server, client)
+
+        embeddings = await asyncio.gather(*[provider.embed([f"post {i}"]) for i in range(60)])
+        self.assertTrue(all(embedding is not None for embedding, in embeddings))
+        self.assertGreater(server.rejected, 0)
+        self.assertGreater(client.overloads, 0)
+        # Rejections of calls sent together cut it once, not once each
+        self.assertLess(client.limiter.limit, 16)
+        self.assertGreaterEqual(client.limiter.limit, limiter.MIN_LIMIT)
+
+        # With the quota lifted every success raises it again
+        cut = client.limiter.limit
+        server.quota = server.burst = 10_000
+        await asyncio.gather(*[provider.embed([f"more {i}"]) for i in range(100)])
+        self.assertGreater(client.limiter.limit, cut + 2)
+        self.assertEqual(server.rejected, client.overloads)
+
+    async def test_retry_after_pauses_new_calls(self):
+        server = await self.serve(quota=4, burst=1, latency=0, retry_delay=0.5)
+        client = AdaptiveClient("test")
+        provider = self.provider(server, client)
+
+        start = time.monotonic()
+        embeddings = await asyncio.gather(provider.embed(["first"]), provider.embed(["second"]))
+        self.assertTrue(all(embedding is not None for embedding, in embeddings))
+        self.assertGreaterEqual(time.monotonic() - start, 0.5)
+        # Nothing was sent during the pause, the rejected call went once more after it
+        self.assertEqual(server.requests, 3)
+        self.assertEqual(server.rejected, 1)
+
+    async def test_low_priority_is_shed_when_saturated(self):
+        server = await self.serve(quota=10_000, latency=0.2)
+        client = AdaptiveClient("test", AdaptiveLimiter(initial=1, maximum=1))
+        provider = self.provider(server, client)
+        # One call to learn how long they take
+        await provider.embed(["warmup"])
+
+        high = [asyncio.create_task(provider.embed([f"high {i}"])) for i in range(10)]
+        # Until they're all waiting for the one slot
+        await asyncio.sleep(0.05)
+        with self.assertRaises(Shed):
+            await client.call(lambda: provider._request(["low"]), Priority.LOW, time.monotonic() + 1)
+        self.assertEqual(client.shed, 1)
+
+        # A HIGH call queues however long the wait
+        results = await asyncio.gather(*high)
+        self.assertTrue(all(embedding is not None for result in results for embedding in result))
+
+    async def test_retry_budget_caps_retries(self):
+        server = await self.serve(quota=10_000, latency=0, error_rate=1.0)
+        client = AdaptiveClient("test", budget=RetryBudget(ratio=0, min_rate=0, max_tokens=3))
+
+        provider = self.provider(server, client)
+        for i in range(5):
+            with self.assertRaises(Unavailable):
+                await client.call(lambda: provider._request([f"post {i}"]))
+        # Three retries in all, then every call gets its first try only
+        self.assertEqual(client.retries, 3)
+        self.assertEqual(server.requests, 5 + 3)
+        self.assertEqual(client.unavailable, 5)
+
+    async def test_deadline_is_not_an_overload(self):
+        server = await self.serve(quota=10_000, latency=1)
+        client = AdaptiveClient("test", AdaptiveLimiter(initial=8))
+        provider = self.provider(server, client)
+
+        with self.assertRaises(Unavailable):
+            await client.call(lambda: provider._request(["slow"]), deadline=time.monotonic() + 0.2)
+        self.assertEqual(client.overloads, 0)
+        self.assertEqual(client.limiter.limit, 8)
+
+        # Nor is a call whose deadline has passed by the time it gets a slot
+        with self.assertRaises(Unavailable):
+            await client.call(lambda: provider._request(["late"]), deadline=time.monotonic() - 1)
+        self.assertEqual(client.limiter.limit, 8)
+        self.assertEqual(client.limiter.in_flight, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
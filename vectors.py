@@ -24,3 +24,25 @@ def get_signal_probability(post_vector: NDArray[float64], high_anchors_vectors:
     probs = exp_scores / np.sum(exp_scores)
     
     return probs[0], high_score, low_score
+
+
+def max_similarities(embeddings: NDArray, anchors: List[NDArray[float64]]) -> NDArray:
+    """Max cosine similarity of every row of `embeddings` to any of `anchors`, as one matrix product."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if not len(anchors) or not len(embeddings):
+        return np.zeros(len(embeddings), dtype=np.float32)
+
+    anchor_matrix = np.asarray(anchors, dtype=np.float32)
+    anchor_matrix /= np.maximum(np.linalg.norm(anchor_matrix, axis=1, keepdims=True), 1e-12)
+    norms = np.maximum(np.linalg.norm(embeddings, axis=1), 1e-12)
+    return (embeddings @ anchor_matrix.T).max(axis=1) / norms
+
+def classify_similarities(buy_sims: NDArray, sell_sims: NDArray, noise_sims: NDArray, confidence_threshold: float) -> NDArray:
+    """
+    Vectorized `GeminiAnalyst.get_signal_from_embedding` over max anchor similarities.
+    Returns an array of "BUY", "SELL" and "HOLD".
+    """
+    directional = np.maximum(buy_sims, sell_sims)
+    best = np.maximum(directional, noise_sims)
+    is_noise = (best < confidence_threshold) | (noise_sims > directional)
+    return np.where(is_noise, "HOLD", np.where(buy_sims > sell_sims, "BUY", "SELL"))